@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Benchmark of encode/decode time and size of pyramid tiles for the codecs
+registered in :attr:`tmlib.image.PyramidTile.CODECS`.
+
+Tiles are either chopped from a given 8-bit or 16-bit grayscale image
+(e.g. a channel image file exported as PNG or TIFF) or, by default, generated
+synthetically as blurred blobs on a noisy background, which resembles a
+fluorescence microscopy image.
+
+Examples
+--------
+$ python benchmarks/tile_codecs.py
+$ python benchmarks/tile_codecs.py --image site.png --quality 75 85 95
+'''
+import time
+import argparse
+import numpy as np
+import cv2
+
+from tmlib.image import PyramidTile
+
+
+def create_synthetic_tiles(n, tile_size, seed=0):
+    '''Creates tiles with blurred blobs on a noisy background.'''
+    rng = np.random.RandomState(seed)
+    tiles = list()
+    for i in range(n):
+        array = rng.normal(10, 3, (tile_size, tile_size))
+        for j in range(rng.randint(0, 10)):
+            y, x = rng.randint(0, tile_size, 2)
+            radius = rng.randint(5, 30)
+            cv2.circle(array, (x, y), radius, rng.randint(50, 250), -1)
+        array = cv2.GaussianBlur(array, (9, 9), 3)
+        tiles.append(np.clip(array, 0, 255).astype(np.uint8))
+    # Spacer tiles between wells and plates
+    tiles.extend([np.zeros((tile_size, tile_size), np.uint8)] * (n / 10))
+    return tiles
+
+
+def load_tiles(filename, tile_size):
+    '''Chops an image into tiles after rescaling it to 8-bit.'''
+    array = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+    if array.ndim > 2:
+        array = array[:, :, 0]
+    if array.dtype != np.uint8:
+        lower, upper = np.percentile(array, (0.1, 99.9))
+        array = np.clip(
+            (array.astype(np.float32) - lower) / (upper - lower) * 255, 0, 255
+        ).astype(np.uint8)
+    tiles = list()
+    for y in range(0, array.shape[0] - tile_size + 1, tile_size):
+        for x in range(0, array.shape[1] - tile_size + 1, tile_size):
+            tiles.append(array[y:y+tile_size, x:x+tile_size].copy())
+    return tiles
+
+
+def benchmark(tiles, codec, quality, repeat):
+    '''Measures mean encode and decode time per tile in milliseconds, mean
+    number of bytes per tile and root mean squared reconstruction error.'''
+    encode_times = list()
+    decode_times = list()
+    for r in range(repeat):
+        start = time.time()
+        buffers = [PyramidTile(t).encode(codec, quality) for t in tiles]
+        encode_times.append(time.time() - start)
+        start = time.time()
+        decoded = [PyramidTile.create_from_buffer(b).array for b in buffers]
+        decode_times.append(time.time() - start)
+    sizes = [b.nbytes for b in buffers]
+    errors = [
+        np.mean((d.astype(np.float32) - t.astype(np.float32)) ** 2)
+        for d, t in zip(decoded, tiles)
+    ]
+    return (
+        min(encode_times) / len(tiles) * 1000,
+        min(decode_times) / len(tiles) * 1000,
+        np.mean(sizes),
+        np.sqrt(np.mean(errors))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--image',
+        help='image that should be chopped into tiles')
+    parser.add_argument('--n', type=int, default=200,
+        help='number of synthetic tiles (default: 200)')
+    parser.add_argument('--tile-size', type=int, default=PyramidTile.TILE_SIZE,
+        help='number of pixels along each axis of a tile')
+    parser.add_argument('--codecs', nargs='+',
+        default=sorted(PyramidTile.CODECS.keys()),
+        help='codecs that should be compared')
+    parser.add_argument('--quality', type=int, nargs='+',
+        help='quality values that should be compared '
+             '(default: default quality of each codec)')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='number of repetitions; the fastest one is reported')
+    args = parser.parse_args()
+
+    if args.image:
+        tiles = load_tiles(args.image, args.tile_size)
+    else:
+        tiles = create_synthetic_tiles(args.n, args.tile_size)
+
+    print '%d tiles of %dx%d pixels (%d bytes raw)' % (
+        len(tiles), args.tile_size, args.tile_size, args.tile_size ** 2
+    )
+    print '%-6s %8s %12s %12s %12s %8s' % (
+        'codec', 'quality', 'encode [ms]', 'decode [ms]', 'bytes/tile', 'rmse'
+    )
+    for codec in args.codecs:
+        qualities = args.quality or [PyramidTile.CODECS[codec]['quality']]
+        for quality in qualities:
+            if codec == 'png':
+                # PNG compression level must be in the range [0, 9]
+                quality = min(quality, 9)
+            enc, dec, size, rmse = benchmark(tiles, codec, quality, args.repeat)
+            print '%-6s %8d %12.3f %12.3f %12.0f %8.2f' % (
+                codec, quality, enc, dec, size, rmse
+            )
+
+
+if __name__ == '__main__':
+    main()
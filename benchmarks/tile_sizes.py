@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Benchmark of pyramid build time, storage and viewport load for different
+tile sizes (see :attr:`tmlib.models.experiment.Experiment.tile_size`).
+
+A mosaic is either loaded from a given 8-bit or 16-bit grayscale image or, by
+default, generated synthetically as blurred blobs on a noisy background. For
+each tile size the complete pyramid is built in memory the same way
+*illuminati* does: the base level is chopped from the mosaic and each lower
+level is created by downsampling blocks of tiles of the next higher level.
+The viewport load is the number of tiles and the time required to decode
+them for a viewport of given size at the base level, which approximates the
+number of requests a client has to make to fill the screen.
+
+Examples
+--------
+$ python benchmarks/tile_sizes.py
+$ python benchmarks/tile_sizes.py --image mosaic.png --tile-sizes 256 512
+'''
+import time
+import argparse
+import numpy as np
+import cv2
+
+from tmlib.image import PyramidTile
+
+
+def create_synthetic_mosaic(height, width, seed=0):
+    '''Creates a mosaic with blurred blobs on a noisy background.'''
+    rng = np.random.RandomState(seed)
+    array = rng.normal(10, 3, (height, width)).astype(np.float32)
+    n_blobs = height * width / 5000
+    for i in range(n_blobs):
+        y, x = rng.randint(0, height), rng.randint(0, width)
+        radius = rng.randint(5, 30)
+        cv2.circle(array, (x, y), radius, rng.randint(50, 250), -1)
+    array = cv2.GaussianBlur(array, (9, 9), 3)
+    return np.clip(array, 0, 255).astype(np.uint8)
+
+
+def load_mosaic(filename):
+    '''Loads an image and rescales it to 8-bit.'''
+    array = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+    if array.ndim > 2:
+        array = array[:, :, 0]
+    if array.dtype != np.uint8:
+        lower, upper = np.percentile(array, (0.1, 99.9))
+        array = np.clip(
+            (array.astype(np.float32) - lower) / (upper - lower) * 255, 0, 255
+        ).astype(np.uint8)
+    return array
+
+
+def chop(array, tile_size):
+    '''Chops an array into tiles; tiles at the border may be smaller.'''
+    tiles = dict()
+    for y in range(0, array.shape[0], tile_size):
+        for x in range(0, array.shape[1], tile_size):
+            tiles[(y / tile_size, x / tile_size)] = \
+                array[y:y+tile_size, x:x+tile_size].copy()
+    return tiles
+
+
+def build_pyramid(mosaic, tile_size, zoom_factor, codec, quality):
+    '''Builds all levels of the pyramid and returns the encoded tiles of
+    each level, ordered from the base level to the top level.'''
+    levels = list()
+    array = mosaic
+    while True:
+        tiles = chop(array, tile_size)
+        levels.append({
+            coordinate: PyramidTile(t).encode(codec, quality)
+            for coordinate, t in tiles.iteritems()
+        })
+        if len(tiles) == 1:
+            break
+        # The next lower level is created from the decoded tiles of this
+        # level, like illuminati does for all levels below the base level.
+        n_rows = max(c[0] for c in tiles) + 1
+        n_cols = max(c[1] for c in tiles) + 1
+        rows = list()
+        for r in range(n_rows):
+            rows.append(np.hstack([
+                PyramidTile.create_from_buffer(levels[-1][(r, c)]).array
+                for c in range(n_cols)
+            ]))
+        array = np.vstack(rows)
+        array = cv2.resize(
+            array,
+            (max(array.shape[1] / zoom_factor, 1),
+             max(array.shape[0] / zoom_factor, 1)),
+            interpolation=cv2.INTER_AREA
+        )
+    return levels
+
+
+def load_viewport(base_level, tile_size, height, width):
+    '''Decodes all base level tiles that intersect with a viewport in the
+    center of the mosaic and returns the number of tiles and the time it
+    took to decode them.'''
+    n_rows = max(c[0] for c in base_level) + 1
+    n_cols = max(c[1] for c in base_level) + 1
+    y = max(n_rows * tile_size - height, 0) / 2
+    x = max(n_cols * tile_size - width, 0) / 2
+    coordinates = [
+        (r, c)
+        for r in range(y / tile_size, (y + height - 1) / tile_size + 1)
+        for c in range(x / tile_size, (x + width - 1) / tile_size + 1)
+        if (r, c) in base_level
+    ]
+    start = time.time()
+    for coordinate in coordinates:
+        PyramidTile.create_from_buffer(base_level[coordinate])
+    return len(coordinates), time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--image',
+        help='image that should be used as mosaic')
+    parser.add_argument('--size', type=int, default=8192,
+        help='number of pixels along each axis of the synthetic mosaic '
+             '(default: 8192)')
+    parser.add_argument('--tile-sizes', type=int, nargs='+',
+        default=[128, 256, 512],
+        help='tile sizes that should be compared (default: 128 256 512)')
+    parser.add_argument('--zoom-factor', type=int, default=2,
+        help='zoom factor between pyramid levels (default: 2)')
+    parser.add_argument('--codec', default='jpeg',
+        choices=sorted(PyramidTile.CODECS.keys()),
+        help='codec that should be used to encode tiles (default: jpeg)')
+    parser.add_argument('--quality', type=int,
+        help='quality of the encoding '
+             '(default: default quality of the codec)')
+    parser.add_argument('--viewport', type=int, nargs=2, default=[1080, 1920],
+        metavar=('HEIGHT', 'WIDTH'),
+        help='size of the viewport in pixels (default: 1080 1920)')
+    args = parser.parse_args()
+
+    if args.image:
+        mosaic = load_mosaic(args.image)
+    else:
+        mosaic = create_synthetic_mosaic(args.size, args.size)
+
+    print 'mosaic of %dx%d pixels, %s codec' % (
+        mosaic.shape[0], mosaic.shape[1], args.codec
+    )
+    print '%-6s %7s %8s %10s %12s %11s %10s %14s' % (
+        'size', 'levels', 'tiles', 'build [s]', 'total [MB]', 'bytes/tile',
+        'view tiles', 'view load [ms]'
+    )
+    for tile_size in args.tile_sizes:
+        start = time.time()
+        levels = build_pyramid(
+            mosaic, tile_size, args.zoom_factor, args.codec, args.quality
+        )
+        build_time = time.time() - start
+        n_tiles = sum(len(level) for level in levels)
+        n_bytes = sum(
+            b.nbytes for level in levels for b in level.itervalues()
+        )
+        n_view, view_time = load_viewport(
+            levels[0], tile_size, args.viewport[0], args.viewport[1]
+        )
+        print '%-6d %7d %8d %10.2f %12.2f %11.0f %10d %14.1f' % (
+            tile_size, len(levels), n_tiles, build_time,
+            n_bytes / 1024.0 ** 2, float(n_bytes) / n_tiles,
+            n_view, view_time * 1000
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -235,6 +235,7 @@ class LibraryConfig(TmapsConfig):
         self.modules_home = '~/jtlibrary/modules'
         self.formats_home = '~/tmformats'
         self.storage_home = '/storage/filesystem'
+        self.tile_cache_size = 256 * 1024**2
         self._resource = None
         self.read()
 
@@ -294,6 +295,21 @@ class LibraryConfig(TmapsConfig):
             )
         self._config.set(self._section, 'storage_home', str(value))
 
+    @property
+    def tile_cache_size(self):
+        '''int: maximal number of bytes of pyramid tiles that are cached
+        per process when reading tiles (default: ``268435456``)
+        '''
+        return self._config.getint(self._section, 'tile_cache_size')
+
+    @tile_cache_size.setter
+    def tile_cache_size(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "tile_cache_size" must have type int.'
+            )
+        self._config.set(self._section, 'tile_cache_size', str(value))
+
     @property
     def formats_home(self):
         '''str: absolute path to the root directory of local copy of
@@ -14,14 +14,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import struct
+import itertools
+import collections
+import multiprocessing
 import numpy as np
 import scipy.ndimage as ndi
 import cv2
 import mahotas as mh
 import skimage.measure
 import skimage.color
-import skimage.draw
 import shapely.geometry
+from geoalchemy2.elements import WKBElement
 from geoalchemy2.shape import to_shape
 from abc import ABCMeta
 import logging
@@ -693,6 +697,261 @@ class ChannelImage(Image):
         return cv2.imencode('.tif', self.array)[1]
 
 
+def _decode_exteriors(geometries):
+    '''Decodes the exterior rings of polygon geometries.
+
+    Binary (extended) well-known representations of polygons are parsed
+    directly, such that no intermediate :mod:`shapely` objects need to be
+    created. Other geometries are decoded via :func:`to_shape
+    <geoalchemy2.shape.to_shape>`.
+
+    Parameters
+    ----------
+    geometries: List[Union[geoalchemy2.elements.WKBElement, shapely.geometry.polygon.Polygon]]
+        polygon geometries
+
+    Returns
+    -------
+    List[numpy.ndarray[numpy.float64]]
+        *x*, *y* coordinates of the exterior ring of each polygon
+    '''
+    exteriors = list()
+    for geometry in geometries:
+        data = None
+        if isinstance(geometry, WKBElement):
+            data = bytes(geometry.data)
+            byte_order = '<' if ord(data[0]) == 1 else '>'
+            geometry_type = struct.unpack_from(byte_order + 'I', data, 1)[0]
+            # Flags of extended representations and ISO type codes
+            n_dims = 2
+            if geometry_type & 0x80000000 or \
+                    (geometry_type & 0xffff) / 1000 in {1, 3}:
+                n_dims += 1
+            if geometry_type & 0x40000000 or \
+                    (geometry_type & 0xffff) / 1000 in {2, 3}:
+                n_dims += 1
+            offset = 5
+            if geometry_type & 0x20000000:
+                offset += 4
+            if (geometry_type & 0xffff) % 1000 != 3:
+                data = None
+        if data is None:
+            if not isinstance(geometry, shapely.geometry.base.BaseGeometry):
+                geometry = to_shape(geometry)
+            coords = np.array(geometry.exterior.coords)
+            if coords.size == 0:
+                coords = np.zeros((0, 2))
+            exteriors.append(coords[:, :2])
+            continue
+        n_rings = struct.unpack_from(byte_order + 'I', data, offset)[0]
+        if n_rings == 0:
+            exteriors.append(np.zeros((0, 2)))
+            continue
+        n_points = struct.unpack_from(byte_order + 'I', data, offset + 4)[0]
+        coords = np.frombuffer(
+            data, dtype=byte_order + 'f8', count=n_points * n_dims,
+            offset=offset + 8
+        )
+        exteriors.append(coords.reshape(n_points, n_dims)[:, :2])
+    return exteriors
+
+
+def _create_polygon(label, contours, hierarchy, bbox, centroid,
+        y_offset, x_offset):
+    '''Creates the polygon of a segmented object from the contours that were
+    traced for it.
+
+    Parameters
+    ----------
+    label: int
+        label of the object
+    contours: List[numpy.ndarray[numpy.int32]]
+        *x*, *y* pixel coordinates of the contours of the object as returned
+        by :func:`cv2.findContours`
+    hierarchy: numpy.ndarray[numpy.int32]
+        hierarchy of `contours` as returned by :func:`cv2.findContours`
+    bbox: numpy.ndarray[numpy.int32]
+        minimal *y*, maximal *y*, minimal *x* and maximal *x* coordinate of
+        the object
+    centroid: Tuple[int]
+        *y*, *x* coordinate of the center of mass of the object
+    y_offset: int
+        global vertical offset that needs to be subtracted from
+        *y*-coordinates (*y*-axis is inverted)
+    x_offset: int
+        global horizontal offset that needs to be added to *x*-coordinates
+
+    Returns
+    -------
+    shapely.geometry.polygon.Polygon
+        polygon of the object
+
+    Raises
+    ------
+    ValueError
+        when no valid polygon can be created for the object
+    '''
+    if len(contours) == 0:
+        logger.warn('no contours identified for object #%d', label)
+        # This is most likely an object that does not extend
+        # beyond the line of border pixels.
+        # To ensure a correct number of objects we represent
+        # it by the smallest possible valid polygon.
+        y, x = centroid
+        shell = np.array([
+            [x-1, x+1, x+1, x-1, x-1],
+            [y-1, y-1, y+1, y+1, y-1]
+        ]).T
+        holes = None
+    elif len(contours) > 1:
+        # It may happens that more than one contour is
+        # identified per object, for example if the object
+        # has holes, i.e. enclosed background pixels.
+        logger.debug(
+            '%d contours identified for object #%d', len(contours), label
+        )
+        holes = list()
+        for i in range(len(contours)):
+            child_idx = hierarchy[0][i][2]
+            parent_idx = hierarchy[0][i][3]
+            # There should only be two levels with one
+            # contour each.
+            if parent_idx >= 0:
+                shell = np.squeeze(contours[parent_idx])
+            elif child_idx >= 0:
+                holes.append(np.squeeze(contours[child_idx]))
+            else:
+                # Same hierarchy level. This shouldn't happen.
+                # Take only the largest one.
+                lengths = [len(c) for c in contours]
+                idx = lengths.index(np.max(lengths))
+                shell = np.squeeze(contours[idx])
+                break
+    else:
+        shell = np.squeeze(contours[0])
+        holes = None
+
+    if shell.ndim < 2 or shell.shape[0] < 3:
+        logger.warn('polygon doesn\'t have enough coordinates')
+        # In case the contour cannot be represented as a
+        # valid polygon we create a little square in the center of the
+        # (padded) bounding box to not loose the object.
+        y = (bbox[1] - bbox[0] + 2) / 2 + bbox[0] - 1
+        x = (bbox[3] - bbox[2] + 2) / 2 + bbox[2] - 1
+        # Create a closed ring with coordinates sorted
+        # counter-clockwise
+        shell = np.array([
+            [x-1, x+1, x+1, x-1, x-1],
+            [y-1, y-1, y+1, y+1, y-1]
+        ]).T
+
+    # Add offset required due to alignment and invert the y-axis as required
+    # by Openlayers.
+    shell[:, 0] = shell[:, 0] + x_offset
+    shell[:, 1] = -1 * (shell[:, 1] + y_offset)
+    if holes is not None:
+        for i in range(len(holes)):
+            holes[i][:, 0] = holes[i][:, 0] + x_offset
+            holes[i][:, 1] = -1 * (holes[i][:, 1] + y_offset)
+    poly = shapely.geometry.Polygon(shell, holes)
+    if not poly.is_valid:
+        logger.warn(
+            'invalid polygon for object #%d - trying to fix it', label
+        )
+        # In some cases there may be invalid intersections
+        # that can be fixed with the buffer trick.
+        poly = poly.buffer(0)
+        if not poly.is_valid:
+            raise ValueError('Polygon of object #%d is invalid.' % label)
+        if isinstance(poly, shapely.geometry.MultiPolygon):
+            logger.warn(
+                'object #%d has multiple polygons - take largest', label
+            )
+            # Repair may create multiple polygons.
+            # We take the largest and discard the smaller ones.
+            areas = [g.area for g in poly.geoms]
+            index = areas.index(np.max(areas))
+            poly = poly.geoms[index]
+    return poly
+
+
+def _extract_polygons_of_group(args):
+    '''Traces the contours of a group of segmented objects, which don't touch
+    each other, in a single pass over the image and creates a polygon for
+    each object.
+
+    Parameters
+    ----------
+    args: Tuple[Union[numpy.ndarray, int]]
+        labeled pixels plane with border pixels set to zero, labels, areas,
+        bounding boxes and centroids of the objects of the group as well as
+        the global *y* and *x* offset
+
+    Returns
+    -------
+    List[Tuple[Union[int, shapely.geometry.polygon.Polygon]]]
+        label and polygon for each object of the group
+
+    Note
+    ----
+    This is a module-level function such that it can be passed to a
+    :class:`multiprocessing.Pool`.
+    '''
+    plane, labels, areas, bboxes, centroids, y_offset, x_offset = args
+    lut = np.zeros(plane.max() + 1, dtype=bool)
+    lut[labels] = True
+    mask = lut[plane]
+    # We need to remove single pixel extensions on the border of
+    # objects because they can lead to polygon self-intersections.
+    # However, this should only be done if the object is larger
+    # than 1 pixel. Since objects of a group are not adjacent, opening the
+    # whole mask is equivalent to opening each object individually.
+    lut[labels[areas == 1]] = False
+    is_single_pixel = mask & ~lut[plane]
+    mask = mh.open(mask) | is_single_pixel
+    # NOTE: OpenCV returns x, y coordinates. This means one would need
+    # to flip the axis for numpy-based indexing (y,x coordinates).
+    _, contours, hierarchy = cv2.findContours(
+        mask.astype(np.uint8) * 255,
+        cv2.RETR_CCOMP,  # two-level hierarchy (holes)
+        cv2.CHAIN_APPROX_NONE
+    )
+    # Contours of the same object are assigned to the object via the label
+    # of the first contour point of the outer boundary. Holes inherit the
+    # label of their outer boundary.
+    indices = collections.defaultdict(list)
+    if hierarchy is not None:
+        contour_labels = np.zeros(len(contours), dtype=np.int64)
+        for i in range(len(contours)):
+            if hierarchy[0][i][3] < 0:
+                x, y = contours[i][0, 0]
+                contour_labels[i] = plane[y, x]
+        for i in range(len(contours)):
+            parent_idx = hierarchy[0][i][3]
+            if parent_idx >= 0:
+                contour_labels[i] = contour_labels[parent_idx]
+            indices[contour_labels[i]].append(i)
+
+    polygons = list()
+    for i, label in enumerate(labels.tolist()):
+        logger.debug('find contour for object #%d', label)
+        # The hierarchy is mapped onto the contours of the object, such that
+        # each object is handled as if its contours were traced separately.
+        object_indices = indices[label]
+        mapping = {idx: j for j, idx in enumerate(object_indices)}
+        mapping[-1] = -1
+        object_hierarchy = np.array([[
+            [mapping.get(v, -1) for v in hierarchy[0][idx]]
+            for idx in object_indices
+        ]])
+        poly = _create_polygon(
+            label, [contours[idx] for idx in object_indices],
+            object_hierarchy, bboxes[i], centroids[i], y_offset, x_offset
+        )
+        polygons.append((label, poly))
+    return polygons
+
+
 class SegmentationImage(Image):
 
     '''Class for a segmentation image: a labeled image where each segmented
@@ -762,20 +1021,59 @@ class SegmentationImage(Image):
         -------
         tmlib.image.SegmentationImage
             created image
+
+        Note
+        ----
+        Only the exterior ring of each polygon is considered. Pixels on the
+        contour are part of the object. Objects are drawn in the given order,
+        such that later objects overwrite earlier ones where they overlap.
         '''
         array = np.zeros(dimensions, dtype=np.int32)
-        for label, geometry in polygons:
-            poly = to_shape(geometry)
-            coordinates = np.array(poly.exterior.coords).astype(int)
-            x, y = np.split(coordinates, 2, axis=1)
-            y *= -1
-            x -= x_offset
-            y -= y_offset
-            y, x = skimage.draw.polygon(y, x, dimensions)
-            array[y, x] = label
+        if len(polygons) == 0:
+            return cls(array, metadata)
+        labels, geometries = zip(*polygons)
+        exteriors = _decode_exteriors(geometries)
+        # Coordinates of all objects are transformed at once and only split
+        # into the individual contours for drawing.
+        coordinates = np.concatenate(exteriors).astype(int)
+        coordinates[:, 0] -= x_offset
+        coordinates[:, 1] = -1 * coordinates[:, 1] - y_offset
+        coordinates = coordinates.astype(np.int32)
+        bounds = np.cumsum([len(e) for e in exteriors])[:-1]
+        for label, contour in zip(labels, np.split(coordinates, bounds)):
+            if len(contour) == 0:
+                continue
+            cv2.fillPoly(array, [contour], int(label))
         return cls(array, metadata)
 
-    def extract_polygons(self, y_offset, x_offset):
+    def extract_outlines(self):
+        '''Creates an outline representation of segmented objects, i.e.
+        an image where only pixels at the border of objects are set.
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            pixels array with value ``255`` for pixels of an object that have
+            a neighbor with a different label and ``0`` otherwise
+
+        Note
+        ----
+        Objects touching the border of the image are not closed along the
+        border, such that outlines of objects that span neighboring sites
+        line up on the map.
+        '''
+        array = self.array
+        vertical = array[1:, :] != array[:-1, :]
+        horizontal = array[:, 1:] != array[:, :-1]
+        outlines = np.zeros(array.shape, dtype=bool)
+        outlines[1:, :] |= vertical
+        outlines[:-1, :] |= vertical
+        outlines[:, 1:] |= horizontal
+        outlines[:, :-1] |= horizontal
+        outlines &= array > 0
+        return outlines.astype(np.uint8) * 255
+
+    def extract_polygons(self, y_offset, x_offset, n_processes=1):
         '''Creates a polygon representation for each segmented object.
         The coordinates of the polygon contours are relative to the global map,
         i.e. an offset is added to the :class:`Site <tmlib.models.site.Site>`.
@@ -787,151 +1085,183 @@ class SegmentationImage(Image):
             *y*-coordinates (*y*-axis is inverted)
         x_offset: int
             global horizontal offset that needs to be added to *x*-coordinates
+        n_processes: int, optional
+            number of processes that should be used to trace contours;
+            may speed up extraction for very large images (default: ``1``)
 
         Returns
         -------
         Generator[Tuple[Union[int, shapely.geometry.polygon.Polygon]]]
-            label and geometry for each segmented object
+            label and geometry for each segmented object, sorted by label
+
+        Note
+        ----
+        Objects are assigned to groups such that objects of the same group
+        don't touch each other. Contours of all objects of a group are then
+        traced at once on the whole image rather than for each object on its
+        bounding box.
         '''
         bboxes = mh.labeled.bbox(self.array)
         # We set border pixels to zero to get closed contours for
         # border objects. This may cause problems for very small objects
         # at the border, because they may get lost.
-        # We recreate them later on (see below).
+        # We recreate them later on (see _create_polygon).
         plane = self.array.copy()
         plane[0, :] = 0
         plane[-1, :] = 0
         plane[:, 0] = 0
         plane[:, -1] = 0
 
-        for label in np.unique(plane[plane > 0]):
-            bbox = bboxes[label]
-            obj_im = self._get_bbox_image(plane, bbox)
-            logger.debug('find contour for object #%d', label)
-            # We could do this for all objects at once, but doing it on the
-            # bounding box for each object individually ensures that we get the
-            # correct number of objects and that polygons are in the
-            # correct order, i.e. sorted according to their corresponding label.
-            mask = obj_im == label
-            if np.sum(mask > 0) > 1:
-                # We need to remove single pixel extensions on the border of
-                # objects because they can lead to polygon self-intersections.
-                # However, this should only be done if the object is larger
-                # than 1 pixel.
-                mask = mh.open(mask)
-            # NOTE: OpenCV returns x, y coordinates. This means one would need
-            # to flip the axis for numpy-based indexing (y,x coordinates).
-            _, contours, hierarchy = cv2.findContours(
-                (mask).astype(np.uint8) * 255,
-                cv2.RETR_CCOMP,  # two-level hierarchy (holes)
-                cv2.CHAIN_APPROX_NONE
-            )
-            if len(contours) == 0:
-                logger.warn('no contours identified for object #%d', label)
-                # This is most likely an object that does not extend
-                # beyond the line of border pixels.
-                # To ensure a correct number of objects we represent
-                # it by the smallest possible valid polygon.
-                coords = np.array(np.where(plane == label)).T
-                y, x = np.mean(coords, axis=0).astype(int)
-                shell = np.array([
-                    [x-1, x+1, x+1, x-1, x-1],
-                    [y-1, y-1, y+1, y+1, y-1]
-                ]).T
-                holes = None
-            elif len(contours) > 1:
-                # It may happens that more than one contour is
-                # identified per object, for example if the object
-                # has holes, i.e. enclosed background pixels.
-                logger.debug(
-                    '%d contours identified for object #%d',
-                    len(contours), label
-                )
-                holes = list()
-                for i in range(len(contours)):
-                    child_idx = hierarchy[0][i][2]
-                    parent_idx = hierarchy[0][i][3]
-                    # There should only be two levels with one
-                    # contour each.
-                    if parent_idx >= 0:
-                        shell = np.squeeze(contours[parent_idx])
-                    elif child_idx >= 0:
-                        holes.append(np.squeeze(contours[child_idx]))
-                    else:
-                        # Same hierarchy level. This shouldn't happen.
-                        # Take only the largest one.
-                        lengths = [len(c) for c in contours]
-                        idx = lengths.index(np.max(lengths))
-                        shell = np.squeeze(contours[idx])
-                        break
-            else:
-                shell = np.squeeze(contours[0])
-                holes = None
-
-            if shell.ndim < 2 or shell.shape[0] < 3:
-                logger.warn('polygon doesn\'t have enough coordinates')
-                # In case the contour cannot be represented as a
-                # valid polygon we create a little square to not loose
-                # the object.
-                y, x = np.array(mask.shape) / 2
-                # Create a closed ring with coordinates sorted
-                # counter-clockwise
-                shell = np.array([
-                    [x-1, x+1, x+1, x-1, x-1],
-                    [y-1, y-1, y+1, y+1, y-1]
-                ]).T
-
-            # Add offset required due to alignment and cropping and
-            # invert the y-axis as required by Openlayers.
-            add_y = y_offset + bbox[0] - 1
-            add_x = x_offset + bbox[2] - 1
-            shell[:, 0] = shell[:, 0] + add_x
-            shell[:, 1] = -1 * (shell[:, 1] + add_y)
-            if holes is not None:
-                for i in range(len(holes)):
-                    holes[i][:, 0] = holes[i][:, 0] + add_x
-                    holes[i][:, 1] = -1 * (holes[i][:, 1] + add_y)
-            poly = shapely.geometry.Polygon(shell, holes)
-            if not poly.is_valid:
-                logger.warn(
-                    'invalid polygon for object #%d - trying to fix it',
-                    label
-                )
-                # In some cases there may be invalid intersections
-                # that can be fixed with the buffer trick.
-                poly = poly.buffer(0)
-                if not poly.is_valid:
-                    raise ValueError(
-                        'Polygon of object #%d is invalid.' % label
-                    )
-                if isinstance(poly, shapely.geometry.MultiPolygon):
-                    logger.warn(
-                        'object #%d has multiple polygons - '
-                        'take largest', label
-                    )
-                    # Repair may create multiple polygons.
-                    # We take the largest and discard the smaller ones.
-                    areas = [g.area for g in poly.geoms]
-                    index = areas.index(np.max(areas))
-                    poly = poly.geoms[index]
+        flat_plane = plane.ravel()
+        counts = np.bincount(flat_plane, minlength=1)
+        labels = np.nonzero(counts)[0]
+        labels = labels[labels > 0]
+        if len(labels) == 0:
+            return
+        ys, xs = np.nonzero(plane)
+        values = plane[ys, xs]
+        centroids = np.column_stack([
+            np.bincount(values, weights=ys, minlength=counts.size)[labels],
+            np.bincount(values, weights=xs, minlength=counts.size)[labels]
+        ]) / counts[labels, np.newaxis].astype(float)
+        centroids = centroids.astype(int)
+
+        groups = self._group_objects(plane, labels)
+        tasks = list()
+        for g in np.unique(groups):
+            index = groups == g
+            tasks.append((
+                plane, labels[index], counts[labels[index]],
+                bboxes[labels[index]], centroids[index], y_offset, x_offset
+            ))
+        logger.debug(
+            'trace contours of %d objects in %d groups',
+            len(labels), len(tasks)
+        )
+        if n_processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(n_processes, len(tasks)))
+            try:
+                results = pool.map(_extract_polygons_of_group, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_extract_polygons_of_group, tasks)
+
+        polygons = sorted(itertools.chain.from_iterable(results))
+        for label, poly in polygons:
             yield (int(label), poly)
 
     @staticmethod
-    def _get_bbox_image(img, bbox):
-        return np.lib.pad(
-            img[bbox[0]:bbox[1], bbox[2]:bbox[3]],
-            (1, 1), 'constant', constant_values=(0)
-        )
+    def _group_objects(plane, labels):
+        '''Assigns segmented objects to groups such that no two objects of
+        the same group are adjacent.
+
+        Parameters
+        ----------
+        plane: numpy.ndarray[numpy.int32]
+            labeled pixels plane
+        labels: numpy.ndarray[numpy.int64]
+            sorted unique labels of objects in `plane`
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int64]
+            group of each object in `labels`
+        '''
+        # Objects are adjacent when any of their pixels are neighbors
+        # with respect to 8-connectivity.
+        n = np.int64(plane.max()) + 1
+        pairs = list()
+        for a, b in [(plane[1:, :], plane[:-1, :]),
+                     (plane[:, 1:], plane[:, :-1]),
+                     (plane[1:, 1:], plane[:-1, :-1]),
+                     (plane[1:, :-1], plane[:-1, 1:])]:
+            index = (a != b) & (a > 0) & (b > 0)
+            lower = np.minimum(a[index], b[index]).astype(np.int64)
+            upper = np.maximum(a[index], b[index]).astype(np.int64)
+            pairs.append(lower * n + upper)
+        pairs = np.unique(np.concatenate(pairs))
+        neighbors = collections.defaultdict(list)
+        for lower, upper in zip((pairs / n).tolist(), (pairs % n).tolist()):
+            neighbors[upper].append(lower)
+        # Greedy coloring in order of labels: each object gets the lowest
+        # group that is not yet taken by an adjacent object.
+        lut = dict()
+        for label in labels.tolist():
+            taken = {lut[l] for l in neighbors[label]}
+            group = 0
+            while group in taken:
+                group += 1
+            lut[label] = group
+        return np.array([lut[l] for l in labels.tolist()], dtype=np.int64)
 
 
 class PyramidTile(Image):
 
     '''Class for a pyramid tile: an image with a single z-level and
-    y, x dimensions of 256 x 256 pixels.
+    y, x dimensions of 256 x 256 pixels by default. The tile size can be
+    configured per experiment (see :attr:`tile_size
+    <tmlib.models.experiment.Experiment.tile_size>`).
+
+    Tiles usually hold 8-bit pixels, which can be displayed directly.
+    Tiles of high bit depth pyramids hold 16-bit pixels, which get mapped to
+    8-bit upon display (see :meth:`map_to_display
+    <tmlib.image.PyramidTile.map_to_display>`).
     '''
 
+    #: int: default number of pixels along each axis of a tile
     TILE_SIZE = 256
 
+    #: int: maximal number of pixels along each axis of a tile
+    MAX_TILE_SIZE = 1024
+
+    #: Dict[str, Dict[str, Union[str, int]]]: registered codecs for encoding
+    #: of tiles with file extension, mimetype, *OpenCV* quality parameter and
+    #: default quality for each codec
+    CODECS = {
+        'jpeg': {
+            'extension': '.jpeg', 'mimetype': 'image/jpeg',
+            'parameter': cv2.IMWRITE_JPEG_QUALITY, 'quality': 95
+        },
+        'webp': {
+            'extension': '.webp', 'mimetype': 'image/webp',
+            'parameter': cv2.IMWRITE_WEBP_QUALITY, 'quality': 95
+        },
+        # PNG is lossless; "quality" is the level of zlib compression
+        'png': {
+            'extension': '.png', 'mimetype': 'image/png',
+            'parameter': cv2.IMWRITE_PNG_COMPRESSION, 'quality': 3
+        },
+    }
+
+    #: Dict[Tuple, numpy.ndarray[numpy.uint8]]: encoded background tiles
+    #: hashable by codec, quality and tile size
+    _background_payloads = dict()
+
+    @classmethod
+    def register_codec(cls, name, extension, mimetype, parameter, quality):
+        '''Registers a codec for encoding of tiles.
+
+        Parameters
+        ----------
+        name: str
+            name of the codec
+        extension: str
+            file extension that *OpenCV* uses to select the encoder,
+            e.g. ``".jpeg"``
+        mimetype: str
+            media type of encoded tiles, e.g. ``"image/jpeg"``
+        parameter: int
+            *OpenCV* flag for the quality parameter of the encoder
+        quality: int
+            default quality
+        '''
+        cls.CODECS[name] = {
+            'extension': extension, 'mimetype': mimetype,
+            'parameter': parameter, 'quality': quality
+        }
+
     @assert_type(
         metadata=['tmlib.metadata.PyramidTileMetadata', 'types.NoneType']
     )
@@ -939,20 +1269,20 @@ class PyramidTile(Image):
         '''
         Parameters
         ----------
-        array: numpy.ndarray[uint8]
+        array: Union[numpy.ndarray[uint8], numpy.ndarray[uint16]]
             pixels array
         metadata: tmlib.metadata.PyramidTileMetadata, optional
             image metadata (default: ``None``)
         '''
         super(PyramidTile, self).__init__(array, metadata)
-        if not self.is_uint8:
+        if not(self.is_uint8 or self.is_uint16):
             raise TypeError(
-                'Image must have 8-bit unsigned integer data type.'
+                'Image must have 8-bit or 16-bit unsigned integer data type.'
             )
-        if any([d > self.TILE_SIZE or d == 0 for d in self.array.shape]):
+        if any([d > self.MAX_TILE_SIZE or d == 0 for d in self.array.shape]):
             raise ValueError(
                 'Height and width of image must be greater than zero and '
-                'maximally %d pixels.' % self.TILE_SIZE
+                'maximally %d pixels.' % self.MAX_TILE_SIZE
             )
 
     @property
@@ -973,7 +1303,9 @@ class PyramidTile(Image):
 
     @property
     def array(self):
-        '''numpy.ndarray[numpy.uint8]: 2D pixels array'''
+        '''Union[numpy.ndarray[numpy.uint8], numpy.ndarray[numpy.uint16]]: 2D
+        pixels array
+        '''
         return self._array
 
     @array.setter
@@ -984,15 +1316,18 @@ class PyramidTile(Image):
             )
         if value.ndim != 2:
             raise ValueError('Argument "array" must be two dimensional.')
-        if not value.dtype == np.uint8:
+        if value.dtype not in (np.uint8, np.uint16):
             raise ValueError(
-                'Argument "array" must have numpy.uint8 data type.'
+                'Argument "array" must have numpy.uint8 or numpy.uint16 '
+                'data type.'
             )
         self._array = value
 
     @classmethod
     def create_from_binary(cls, string, metadata=None):
-        '''Creates an image from a *JPEG* encoded binary string.
+        '''Creates an image from an encoded binary string. The codec is
+        determined from the content of `string`, so any format registered in
+        :attr:`CODECS <tmlib.image.PyramidTile.CODECS>` can be decoded.
 
         Parameters
         ----------
@@ -1005,9 +1340,10 @@ class PyramidTile(Image):
         -------
         tmlib.image.PyramidTile
 
-        Warning
-        -------
-        This assumes pixels are encoded as 8-bit unsigned integers.
+        Note
+        ----
+        The bit depth of pixels is preserved, i.e. 16-bit PNG tiles are
+        decoded as 16-bit unsigned integers.
         '''
         array = np.fromstring(string, np.uint8)
         array = cv2.imdecode(array, cv2.IMREAD_UNCHANGED)
@@ -1015,7 +1351,8 @@ class PyramidTile(Image):
 
     @classmethod
     def create_from_buffer(cls, buf, metadata=None):
-        '''Creates an image from a *JPEG* encoded buffer object.
+        '''Creates an image from an encoded buffer object. The codec is
+        determined from the content of `buf`.
 
         Parameters
         ----------
@@ -1028,17 +1365,53 @@ class PyramidTile(Image):
         -------
         tmlib.image.PyramidTile
 
-        Warning
-        -------
-        This assumes pixels are encoded as 8-bit unsigned integers.
+        Note
+        ----
+        The bit depth of pixels is preserved, i.e. 16-bit PNG tiles are
+        decoded as 16-bit unsigned integers.
         '''
         array = np.frombuffer(buf, np.uint8)
         array = cv2.imdecode(array, cv2.IMREAD_UNCHANGED)
         return cls(array, metadata)
 
+    @property
+    def is_background(self):
+        '''bool: whether the tile only consists of background pixels'''
+        return not self.array.any()
+
+    @classmethod
+    def get_background_payload(cls, codec='jpeg', quality=None,
+            tile_size=None):
+        '''Gets the encoded pixels of a tile that only consists of
+        background pixels. The tile is encoded only once per codec, quality
+        and tile size.
+
+        Parameters
+        ----------
+        codec: str, optional
+            name of the codec (default: ``"jpeg"``)
+        quality: int, optional
+            quality of the encoding (defaults to the default quality of
+            `codec`)
+        tile_size: int, optional
+            number of pixels along each axis of the tile (defaults to
+            :attr:`TILE_SIZE <tmlib.image.PyramidTile.TILE_SIZE>`)
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            encoded pixels array
+        '''
+        key = (codec, quality, tile_size)
+        if key not in cls._background_payloads:
+            cls._background_payloads[key] = \
+                cls.create_as_background(tile_size=tile_size).\
+                encode(codec, quality)
+        return cls._background_payloads[key]
+
     @classmethod
     def create_as_background(cls, add_noise=False, mu=None, sigma=None,
-            metadata=None):
+            metadata=None, dtype=np.uint8, tile_size=None):
         '''Creates an image with background pixels. By default background will
         be zero values. Optionally, Gaussian noise can be added to simulate
         camera background.
@@ -1053,23 +1426,120 @@ class PyramidTile(Image):
             variance of background noise (default: ``None``)
         metadata: tmlib.metadata.ImageMetadata, optional
             image metadata (default: ``None``)
+        dtype: type, optional
+            data type of pixels; either ``numpy.uint8`` or ``numpy.uint16``
+            (default: ``numpy.uint8``)
+        tile_size: int, optional
+            number of pixels along each axis of the tile (defaults to
+            :attr:`TILE_SIZE <tmlib.image.PyramidTile.TILE_SIZE>`)
 
         Returns
         -------
         tmlib.image.PyramidTile
             image with background pixel values
         '''
+        if tile_size is None:
+            tile_size = cls.TILE_SIZE
         if add_noise:
             if mu is None or sigma is None:
                 raise ValueError(
                     'Arguments "mu" and "sigma" are required '
                     'when argument "add_noise" is set to True.'
                 )
-            array = np.random.normal(mu, sigma, cls.TILE_SIZE**2).astype(np.uint8)
+            array = np.random.normal(mu, sigma, tile_size**2).astype(dtype)
         else:
-            array = np.zeros((cls.TILE_SIZE,) * 2, dtype=np.uint8)
+            array = np.zeros((tile_size,) * 2, dtype=dtype)
         return cls(array, metadata)
 
+    @staticmethod
+    def create_display_lut(lower, upper):
+        '''Creates a lookup table that maps 16-bit pixel values to 8-bit for
+        display, such that the range [`lower`, `upper`] is mapped to
+        [0, 255]. Values are mapped the same way as by
+        :class:`ImagePreprocessor <tmlib.image.ImagePreprocessor>`, so tiles
+        of high bit depth pyramids look the same as 8-bit tiles.
+
+        Parameters
+        ----------
+        lower: int
+            value at or below which pixels are mapped to 0
+        upper: int
+            value at or above which pixels are mapped to 255
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            lookup table with 65536 entries
+
+        Raises
+        ------
+        ValueError
+            when `lower` is not smaller than `upper`
+        '''
+        if lower >= upper:
+            raise ValueError(
+                'Argument "lower" must be smaller than argument "upper".'
+            )
+        lut = np.arange(2**16, dtype=np.float32)
+        lut -= lower
+        lut *= np.float32(255) / np.float32(max(upper - lower - 1, 1))
+        np.clip(lut, 0, 255, out=lut)
+        return lut.astype(np.uint8)
+
+    def map_to_display(self, lut):
+        '''Maps 16-bit pixels to 8-bit via a lookup table.
+
+        Parameters
+        ----------
+        lut: numpy.ndarray[numpy.uint8]
+            lookup table with 65536 entries
+            (see :meth:`create_display_lut
+            <tmlib.image.PyramidTile.create_display_lut>`)
+
+        Returns
+        -------
+        tmlib.image.PyramidTile
+            tile with 8-bit pixels; the tile itself if pixels are already
+            8-bit
+        '''
+        if self.is_uint8:
+            return self
+        return self.__class__(lut[self.array], self.metadata)
+
+    def encode(self, codec='jpeg', quality=None):
+        '''Encodes the image as a buffer object using a registered codec.
+
+        Parameters
+        ----------
+        codec: str, optional
+            name of the codec (options: keys of
+            :attr:`CODECS <tmlib.image.PyramidTile.CODECS>`, default:
+            ``"jpeg"``)
+        quality: int, optional
+            quality of the encoding; interpretation depends on `codec`
+            (defaults to the default quality of `codec`)
+
+        Returns
+        -------
+        numpy.ndarray
+
+        Raises
+        ------
+        ValueError
+            when `codec` is not registered
+        '''
+        if codec not in self.CODECS:
+            raise ValueError(
+                'Unknown codec "%s". Supported are: "%s"'
+                % (codec, '", "'.join(self.CODECS.keys()))
+            )
+        spec = self.CODECS[codec]
+        if quality is None:
+            quality = spec['quality']
+        return cv2.imencode(
+            spec['extension'], self.array, [spec['parameter'], quality]
+        )[1]
+
     def jpeg_encode(self, quality=95):
         '''Encodes the image as a JPEG buffer object.
 
@@ -1089,9 +1559,7 @@ class PyramidTile(Image):
         >>> with open('myfile.jpeg', 'w') as f:
         >>>     f.write(buf)
         '''
-        return cv2.imencode(
-            '.jpeg', self.array, [cv2.IMWRITE_JPEG_QUALITY, quality]
-        )[1]
+        return self.encode('jpeg', quality)
 
 
 class IllumstatsImage(Image):
@@ -1213,3 +1681,161 @@ class IllumstatsContainer(object):
         return self.percentiles[keys[idx]]
 
 
+
+class ImagePreprocessor(object):
+
+    '''Preprocessor for channel images, which corrects images for
+    illumination artifacts, aligns them and clips and rescales their
+    intensities to 8-bit in a single pass.
+
+    Correction terms are precomputed once per channel and all computations
+    are performed in place with single precision, such that only one
+    temporary array needs to be allocated per image.
+    '''
+
+    @assert_type(
+        stats=['tmlib.image.IllumstatsContainer', 'types.NoneType'],
+        clip_range=['tuple', 'list', 'types.NoneType']
+    )
+    def __init__(self, stats=None, clip_range=None, align=False, crop=True):
+        '''
+        Parameters
+        ----------
+        stats: tmlib.image.IllumstatsContainer, optional
+            illumination statistics of the channel; images don't get
+            corrected when ``None`` (default: ``None``)
+        clip_range: Tuple[int], optional
+            lower and upper intensity value that should be mapped to 0 and
+            255, respectively; 16-bit images don't get clipped and rescaled
+            when ``None`` (default: ``None``)
+        align: bool, optional
+            whether images should be aligned (default: ``False``)
+        crop: bool, optional
+            whether aligned images should be cropped or rather padded
+            with zero values (default: ``True``)
+
+        Raises
+        ------
+        ValueError
+            when lower bound of `clip_range` is not smaller than upper bound
+        '''
+        if stats is not None:
+            mean = stats.mean.array
+            std = stats.std.array
+            # The correction (log(img) - mean) / std * mean(std) + mean(mean)
+            # is rewritten as log(img) * gain + offset.
+            gain = np.mean(std) / std
+            self._gain = gain.astype(np.float32)
+            self._offset = (np.mean(mean) - mean * gain).astype(np.float32)
+            self._channel_id = stats.mean.metadata.channel_id
+        else:
+            self._gain = None
+            self._offset = None
+            self._channel_id = None
+        if clip_range is not None:
+            lower, upper = clip_range
+            if lower >= upper:
+                raise ValueError(
+                    'Lower bound of "clip_range" must be smaller than upper '
+                    'bound.'
+                )
+            # Mimics the lookup table of ChannelImage.scale()
+            n_values = max(upper - lower - 1, 1)
+            self._scale = np.float32(255) / np.float32(n_values)
+            self.clip_range = (lower, upper)
+        else:
+            self.clip_range = None
+        self.align = align
+        self.crop = crop
+
+    @property
+    def correct(self):
+        '''bool: whether images get corrected for illumination artifacts'''
+        return self._gain is not None
+
+    @staticmethod
+    def _get_alignment_slices(md):
+        # Same logic as Image._shift_and_crop()
+        row_start = md.top_residue - md.y_shift
+        row_end = md.bottom_residue + md.y_shift
+        row_end = None if row_end == 0 else -row_end
+        col_start = md.left_residue - md.x_shift
+        col_end = md.right_residue + md.x_shift
+        col_end = None if col_end == 0 else -col_end
+        return (slice(row_start, row_end), slice(col_start, col_end))
+
+    def process(self, image):
+        '''Preprocesses an image.
+
+        Parameters
+        ----------
+        image: tmlib.image.ChannelImage
+            image that should be preprocessed
+
+        Returns
+        -------
+        tmlib.image.ChannelImage
+            preprocessed image
+
+        Raises
+        ------
+        ValueError
+            when channel doesn't match between illumination statistics and
+            image
+        AttributeError
+            when image has no metadata but should be aligned
+
+        Note
+        ----
+        The metadata of `image` is updated in place.
+        '''
+        md = image.metadata
+        array = image.array
+        rescale = self.clip_range is not None and array.dtype == np.uint16
+        if self.correct:
+            if md.channel_id != self._channel_id:
+                raise ValueError('Channels don\'t match!')
+            buf = array.astype(np.float32)
+            np.maximum(buf, 10**-10, out=buf)
+            np.log10(buf, out=buf)
+            buf *= self._gain
+            buf += self._offset
+            np.power(np.float32(10), buf, out=buf)
+            md.is_corrected = True
+        elif rescale:
+            buf = array.astype(np.float32)
+        else:
+            buf = array
+
+        if rescale:
+            buf -= self.clip_range[0]
+            buf *= self._scale
+            np.clip(buf, 0, 255, out=buf)
+            dtype = np.uint8
+            md.is_clipped = True
+            md.is_rescaled = True
+        else:
+            dtype = array.dtype
+            if buf is not array:
+                np.clip(buf, 0, np.iinfo(dtype).max, out=buf)
+
+        if self.align:
+            if md is None:
+                raise AttributeError(
+                    'Image requires attribute "metadata" for alignment.'
+                )
+            region = self._get_alignment_slices(md)
+            if self.crop:
+                out = buf[region].astype(dtype, copy=False)
+            else:
+                # Cast and shift pixels in one go
+                out = np.zeros(buf.shape, dtype)
+                extracted = buf[region]
+                out[
+                    md.top_residue:md.top_residue + extracted.shape[0],
+                    md.left_residue:md.left_residue + extracted.shape[1]
+                ] = extracted
+            md.is_aligned = True
+        else:
+            out = buf.astype(dtype, copy=False)
+        return ChannelImage(out, md)
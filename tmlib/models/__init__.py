@@ -147,6 +147,7 @@ from tmlib.models.cycle import Cycle
 from tmlib.models.submission import Submission, Task
 from tmlib.models.site import Site
 from tmlib.models.alignment import SiteShift
+from tmlib.models.layout import ExperimentLayout
 from tmlib.models.file import (
     MicroscopeImageFile, MicroscopeMetadataFile, ChannelImageFile,
     IllumstatsFile
@@ -35,8 +35,12 @@ from tmlib.models.well import Well
 from tmlib.models.feature import FeatureValues
 from tmlib.models.result import LabelValues
 from tmlib.models.tile import ChannelLayerTile
+from tmlib.models.tile import calculate_pyramid_dimensions
+from tmlib.models.tile import calculate_pyramid_image_sizes
+from tmlib.models.tilestore import create_tile_store
 from tmlib.models.mapobject import MapobjectSegmentation
-from tmlib.models.plate import Plate
+from tmlib.models.layout import ExperimentLayout
+from tmlib.models.layout import get_experiment_layout
 from tmlib.models.base import (
     ExperimentModel, DirectoryModel, DateMixIn, IdMixIn
 )
@@ -44,7 +48,10 @@ from tmlib.models.utils import ExperimentConnection, ExperimentSession
 from tmlib.models.utils import remove_location_upon_delete
 from tmlib.errors import RegexError, DataError
 from tmlib.image import PyramidTile
+from tmlib.metadata import PyramidTileMetadata
 from tmlib.utils import autocreate_directory_property, create_directory
+from tmlib.utils import LRUCache
+from tmlib import cfg
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +61,47 @@ CHANNEL_LOCATION_FORMAT = 'channel_{id}'
 #: Format string for channel layer locations
 CHANNEL_LAYER_LOCATION_FORMAT = 'layer_{id}'
 
+#: Entry of the site grid index of a channel layer: ID of the image file,
+#: ID of the site and its parent well, zero-based row and column index of the
+#: site within the well, pixel offset of the site relative to the layer at
+#: the maximum zoom level, size of the site, whether the site is omitted and
+#: number of sites along the vertical and horizontal axis of the well
+SiteGridEntry = collections.namedtuple(
+    'SiteGridEntry', [
+        'file_id', 'site_id', 'well_id', 'y', 'x', 'y_offset', 'x_offset',
+        'height', 'width', 'omitted', 'well_dimensions'
+    ]
+)
+
+_tile_cache = None
+
+
+def get_tile_cache():
+    '''Gets the process-level cache of pyramid tiles, which is shared by all
+    channel layers of all experiments. The cache holds encoded and decoded
+    tiles hashable by ID of the experiment, ID and :attr:`revision
+    <tmlib.models.channel.ChannelLayer.revision>` of the channel layer, zoom
+    level index, row and column index and whether the tile is decoded. Its
+    size is limited by
+    :attr:`tile_cache_size <tmlib.config.LibraryConfig.tile_cache_size>`.
+
+    Returns
+    -------
+    tmlib.utils.LRUCache
+        tile cache
+
+    Note
+    ----
+    Tiles that get recreated for an existing layer by another process are
+    only visible once the revision of the layer got incremented, which
+    happens when all jobs of the run completed, or once they are evicted from
+    the cache.
+    '''
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = LRUCache(cfg.tile_cache_size)
+    return _tile_cache
+
 
 @remove_location_upon_delete
 class Channel(DirectoryModel, DateMixIn, IdMixIn):
@@ -181,13 +229,38 @@ class ChannelLayer(ExperimentModel, IdMixIn):
     tpoint = Column(Integer, index=True)
 
     #: int: maximum intensity value at which images get clipped at original
-    #: bit depth before rescaling to 8-bit
+    #: bit depth before rescaling to 8-bit; applied upon display for
+    #: layers with 16-bit tiles
     max_intensity = Column(Integer)
 
     #: int: minimum intensity value at which images get clipped at original
-    #: bit depth before rescaling to 8-bit
+    #: bit depth before rescaling to 8-bit; applied upon display for
+    #: layers with 16-bit tiles
     min_intensity = Column(Integer)
 
+    #: int: bit depth of pixels of tiles; 16-bit tiles hold intensities at
+    #: original bit depth, such that the contrast can be changed without
+    #: recreating tiles
+    bit_depth = Column(Integer, default=8)
+
+    #: str: name of the codec used to encode tiles
+    #: (see :attr:`tmlib.image.PyramidTile.CODECS`)
+    codec = Column(String, default='jpeg')
+
+    #: int: quality of the encoding of tiles; interpretation depends on
+    #: the codec (uses the default quality of the codec if ``None``)
+    quality = Column(Integer)
+
+    #: str: name of the backend that stores tiles
+    #: (see :attr:`tmlib.models.tilestore.TILE_STORE_BACKENDS`)
+    tile_backend = Column(String, default='database')
+
+    #: int: revision of the tiles, which gets incremented whenever tiles
+    #: are recreated, such that cached tiles of previous revisions are no
+    #: longer served (see :func:`get_tile_cache
+    #: <tmlib.models.channel.get_tile_cache>`)
+    revision = Column(Integer, default=0)
+
     #: int: ID of parent channel
     channel_id = Column(
         Integer,
@@ -201,7 +274,12 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         backref=backref('layers', cascade='all, delete-orphan')
     )
 
-    def __init__(self, channel_id, tpoint, zplane):
+    #: str: name of the codec used to encode tiles of layers with 16-bit
+    #: tiles upon display
+    DISPLAY_CODEC = 'jpeg'
+
+    def __init__(self, channel_id, tpoint, zplane, codec='jpeg', quality=None,
+            tile_backend='database', bit_depth=8):
         '''
         Parameters
         ----------
@@ -211,10 +289,73 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             zero-based time series index
         zplane: int
             zero-based z-resolution index
+        codec: str, optional
+            name of the codec that should be used to encode tiles
+            (default: ``"jpeg"``)
+        quality: int, optional
+            quality of the encoding of tiles (default: ``None``)
+        tile_backend: str, optional
+            name of the backend that should store tiles
+            (default: ``"database"``)
+        bit_depth: int, optional
+            bit depth of pixels of tiles; either ``8`` or ``16``
+            (default: ``8``)
         '''
         self.tpoint = tpoint
         self.zplane = zplane
         self.channel_id = channel_id
+        self.codec = codec
+        self.quality = quality
+        self.tile_backend = tile_backend
+        self.bit_depth = bit_depth
+
+    @property
+    def location(self):
+        '''str: location where pack files of tiles are stored in case
+        :attr:`tile_backend <tmlib.models.channel.ChannelLayer.tile_backend>`
+        is ``"packfile"``
+        '''
+        return os.path.join(
+            self.channel.location, 'layers',
+            CHANNEL_LAYER_LOCATION_FORMAT.format(id=self.id)
+        )
+
+    @property
+    def mimetype(self):
+        '''str: media type of encoded tiles served by :meth:`get_tiles
+        <tmlib.models.channel.ChannelLayer.get_tiles>`
+        '''
+        if self.is_high_bit_depth:
+            return PyramidTile.CODECS[self.DISPLAY_CODEC]['mimetype']
+        return PyramidTile.CODECS[self.codec or 'jpeg']['mimetype']
+
+    @property
+    def is_high_bit_depth(self):
+        '''bool: whether tiles hold 16-bit pixels'''
+        return self.bit_depth == 16
+
+    @property
+    def dtype(self):
+        '''type: data type of pixels of tiles'''
+        return np.uint16 if self.is_high_bit_depth else np.uint8
+
+    @property
+    def display_lut(self):
+        '''numpy.ndarray[numpy.uint8]: lookup table that maps 16-bit pixels
+        of tiles to 8-bit for display based on :attr:`min_intensity
+        <tmlib.models.channel.ChannelLayer.min_intensity>` and
+        :attr:`max_intensity <tmlib.models.channel.ChannelLayer.max_intensity>`
+        '''
+        # Instances loaded from the database don't get initialized.
+        key = (self.min_intensity, self.max_intensity)
+        if getattr(self, '_display_lut_key', None) != key:
+            lower = self.min_intensity or 0
+            upper = self.max_intensity
+            if upper is None:
+                upper = 2**16 - 1
+            self._display_lut = PyramidTile.create_display_lut(lower, upper)
+            self._display_lut_key = key
+        return self._display_lut
 
     @cached_property
     def height(self):
@@ -248,10 +389,10 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             raise DataError('Pyramid depth has not yet been calculated.')
         return depth
 
-    @property
+    @cached_property
     def tile_size(self):
         '''int: maximal number of pixels along each axis of a tile'''
-        return 256
+        return self.channel.experiment.tile_size or PyramidTile.TILE_SIZE
 
     @cached_property
     def zoom_factor(self):
@@ -280,13 +421,10 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         '''
         # NOTE: This could also be calculated based on maxzoom_level only
         logger.debug('calculate layer dimensions')
-        sizes = self._get_image_sizes(self.height, self.width)
-        levels = list()
-        for i, (height, width) in enumerate(sizes):
-            n_rows = int(np.ceil(np.float(height) / np.float(self.tile_size)))
-            n_cols = int(np.ceil(np.float(width) / np.float(self.tile_size)))
-            levels.append((n_rows, n_cols))
-        return levels
+        return calculate_pyramid_dimensions(
+            self.height, self.width, self.channel.experiment.zoom_factor,
+            self.tile_size
+        )
 
     def calculate_max_image_size(self):
         '''Determines dimensions of the pyramid, i.e. height, width
@@ -348,19 +486,64 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         level
         '''
         logger.debug('calculate image size at each resolution level')
-        experiment = self.channel.experiment
-        levels = list()
-        levels.append((height, width))
-        # Determine the size of the images at lower resolution levels up to the
-        # top of the pyramid
-        while True:
-            height = int(np.ceil(np.float(height) / experiment.zoom_factor))
-            width = int(np.ceil(np.float(width) / experiment.zoom_factor))
-            levels.append((height, width))
-            if height <= self.tile_size and width <= self.tile_size:
-                break
-        # Sort zoom levels top-down, i.e. from lowest to highest resolution
-        return list(reversed(levels))
+        return calculate_pyramid_image_sizes(
+            height, width, self.channel.experiment.zoom_factor, self.tile_size
+        )
+
+    @cached_property
+    def site_grid(self):
+        '''Dict[int, tmlib.models.channel.SiteGridEntry]: position, size and
+        image file of each site, hashable by site ID
+
+        Note
+        ----
+        Positions and sizes are taken from the :class:`ExperimentLayout
+        <tmlib.models.layout.ExperimentLayout>` of the session, which gets
+        loaded if necessary. Only image files are loaded in addition, such
+        that mapping between images and tiles doesn't require any further
+        database round-trips.
+        '''
+        logger.debug('load site grid of channel layer')
+        session = Session.object_session(self)
+        layout = get_experiment_layout(self)
+        if layout is None:
+            layout = ExperimentLayout(session)
+        records = session.query(
+                ChannelImageFile.id, ChannelImageFile.site_id, Site.omitted
+            ).\
+            join(Site).\
+            filter(
+                ChannelImageFile.channel_id == self.channel_id,
+                ChannelImageFile.tpoint == self.tpoint,
+                ChannelImageFile.zplane == self.zplane
+            ).\
+            all()
+        files = {r.site_id: r for r in records}
+        grid = dict()
+        sites = zip(
+            layout.site_ids.tolist(), layout.site_well_ids.tolist(),
+            layout.site_coordinates.tolist(), layout.site_offsets.tolist(),
+            layout.site_image_sizes.tolist()
+        )
+        for site_id, well_id, (y, x), offset, size in sites:
+            if site_id not in files:
+                continue
+            grid[site_id] = SiteGridEntry(
+                file_id=files[site_id].id, site_id=site_id, well_id=well_id,
+                y=y, x=x, y_offset=offset[0], x_offset=offset[1],
+                height=size[0], width=size[1],
+                omitted=files[site_id].omitted,
+                well_dimensions=layout.get_well_dimensions(well_id)
+            )
+        return grid
+
+    @cached_property
+    def _site_grid_positions(self):
+        '''Dict[Tuple[int], tmlib.models.channel.SiteGridEntry]: site grid
+        hashable by well ID and row and column index of the site within the
+        well
+        '''
+        return {(e.well_id, e.y, e.x): e for e in self.site_grid.itervalues()}
 
     def _calc_tile_indices_and_offsets(self, position, length, displacement):
         '''Calculates index (row or column) and pixel offset for each tile
@@ -433,17 +616,15 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         '''
         mappings = list()
         experiment = self.channel.experiment
-        site = image_file.site
-        well = image_file.site.well
-        y_offset_site, x_offset_site = site.offset
+        site = self.site_grid[image_file.site_id]
         # Determine the index and offset of each tile whose pixels are part of
         # the image
         row_info = self._calc_tile_indices_and_offsets(
-            y_offset_site, site.image_size[0],
+            site.y_offset, site.height,
             experiment.vertical_site_displacement
         )
         col_info = self._calc_tile_indices_and_offsets(
-            x_offset_site, site.image_size[1],
+            site.x_offset, site.width,
             experiment.horizontal_site_displacement
         )
         # Each job processes only the overlapping tiles at the upper and/or
@@ -453,34 +634,16 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         # or plates represent an exception because in these cases there is
         # no neighboring image to create the tile instead, but an empty spacer.
         # The same is true in case of missing neighboring images.
-        session = Session.object_session(self)
-        lower_neighbor_count = session.query(ChannelImageFile.id).\
-            join(Site).\
-            filter(
-                Site.y == site.y + 1, Site.x == site.x,
-                Site.well_id == site.well_id,
-                ChannelImageFile.channel_id == self.channel_id,
-                ChannelImageFile.tpoint == self.tpoint
-            ).\
-            count()
-        right_neighbor_count = session.query(ChannelImageFile.id).\
-            join(Site).\
-            filter(
-                Site.y == site.y, Site.x == site.x + 1,
-                Site.well_id == site.well_id,
-                ChannelImageFile.channel_id == self.channel_id,
-                ChannelImageFile.tpoint == self.tpoint
-            ).\
-            count()
-        has_lower_neighbor = lower_neighbor_count > 0
-        has_right_neighbor = right_neighbor_count > 0
+        positions = self._site_grid_positions
+        has_lower_neighbor = (site.well_id, site.y + 1, site.x) in positions
+        has_right_neighbor = (site.well_id, site.y, site.x + 1) in positions
         for i, y in enumerate(row_info['indices']):
             y_offset = row_info['offsets'][i]
             is_overhanging_vertically = (
-                (y_offset + self.tile_size) > site.image_size[0]
+                (y_offset + self.tile_size) > site.height
             )
             is_not_lower_plate_border = (y + 1) != self.dimensions[-1][0]
-            is_not_lower_well_border = (site.y + 1) != well.dimensions[0]
+            is_not_lower_well_border = (site.y + 1) != site.well_dimensions[0]
             if is_overhanging_vertically and has_lower_neighbor:
                 if (is_not_lower_plate_border and
                         is_not_lower_well_border):
@@ -488,10 +651,12 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             for j, x in enumerate(col_info['indices']):
                 x_offset = col_info['offsets'][j]
                 is_overhanging_horizontally = (
-                    (x_offset + self.tile_size) > site.image_size[1]
+                    (x_offset + self.tile_size) > site.width
                 )
                 is_not_right_plate_border = (x + 1) != self.dimensions[-1][1]
-                is_not_right_well_border = (site.x + 1) != well.dimensions[1]
+                is_not_right_well_border = (
+                    (site.x + 1) != site.well_dimensions[1]
+                )
                 if is_overhanging_horizontally and has_right_neighbor:
                     if (is_not_right_plate_border and
                             is_not_right_well_border):
@@ -561,7 +726,7 @@ class ChannelLayer(ExperimentModel, IdMixIn):
 
         Parameters
         ----------
-        site: tmlib.models.Site
+        site: Union[tmlib.models.Site, tmlib.models.channel.SiteGridEntry]
             site whose neighbours could be included in the search
 
         Returns
@@ -571,39 +736,28 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             y, x coordinates
         '''
         experiment = self.channel.experiment
-        session = Session.object_session(self)
-        # Only consider sites to the left and/or top of the current site
-        neighbouring_sites = session.query(Site).\
-            join(Well).\
-            filter(
-                Well.id == site.well.id,
-                Site.x.in_([site.x - 1, site.x]),
-                Site.y.in_([site.y - 1, site.y])
-            )
-
+        positions = self._site_grid_positions
         mapping = collections.defaultdict(list)
-        for current_site in neighbouring_sites:
-            if current_site.y == site.y and current_site.x == site.x:
+        # Only consider sites to the left and/or top of the current site
+        neighbours = itertools.product(
+            [site.y - 1, site.y], [site.x - 1, site.x]
+        )
+        for i, j in neighbours:
+            if i == site.y and j == site.x:
                 continue
-            if current_site.omitted:
+            current_site = positions.get((site.well_id, i, j))
+            if current_site is None or current_site.omitted:
                 continue
-            fid = session.query(ChannelImageFile.id).\
-                filter_by(
-                    site_id=current_site.id, channel_id=self.channel.id,
-                    tpoint=self.tpoint, zplane=self.zplane
-                ).\
-                one()[0]
-            y_offset_site, x_offset_site = current_site.offset
             row_indices = self._calc_tile_indices(
-                y_offset_site, current_site.image_size[0],
+                current_site.y_offset, current_site.height,
                 experiment.vertical_site_displacement
             )
             col_indices = self._calc_tile_indices(
-                x_offset_site, current_site.image_size[1],
+                current_site.x_offset, current_site.width,
                 experiment.horizontal_site_displacement
             )
             for y, x in itertools.product(row_indices, col_indices):
-                mapping[(y, x)].append(fid)
+                mapping[(y, x)].append(current_site.file_id)
 
         return mapping
 
@@ -615,32 +769,20 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         '''
         logger.debug('create mapping of base tile coordinates to image files')
         experiment = self.channel.experiment
-        session = Session.object_session(self)
-        sites = session.query(Site).\
-            join(Well).\
-            join(Plate).\
-            filter(Plate.experiment_id == experiment.id)
         mapping = collections.defaultdict(list)
-        for site in sites:
+        for site in self.site_grid.itervalues():
             if site.omitted:
                 continue
-            fid = session.query(ChannelImageFile.id).\
-                filter_by(
-                    site_id=site.id, channel_id=self.channel.id,
-                    tpoint=self.tpoint, zplane=self.zplane
-                ).\
-                one()[0]
-            y_offset_site, x_offset_site = site.offset
             row_indices = self._calc_tile_indices(
-                y_offset_site, site.image_size[0],
+                site.y_offset, site.height,
                 experiment.vertical_site_displacement
             )
             col_indices = self._calc_tile_indices(
-                x_offset_site, site.image_size[1],
+                site.x_offset, site.width,
                 experiment.horizontal_site_displacement
             )
             for y, x in itertools.product(row_indices, col_indices):
-                mapping[(y, x)].append(fid)
+                mapping[(y, x)].append(site.file_id)
         return mapping
 
     def calc_coordinates_of_next_higher_level(self, z, y, x):
@@ -677,6 +819,197 @@ class ChannelLayer(ExperimentModel, IdMixIn):
                 coordinates.append((r, c))
         return coordinates
 
+    def get_tile(self, z, y, x):
+        '''Gets the encoded pixels of a tile. Tiles that only consist of
+        background pixels are not stored. For those a constant payload is
+        served, which is encoded only once per process.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y: int
+            zero-based row index of the tile at the given zoom level
+        x: int
+            zero-based column index of the tile at the given zoom level
+
+        Returns
+        -------
+        str
+            encoded pixels (see :attr:`mimetype
+            <tmlib.models.channel.ChannelLayer.mimetype>`)
+
+        Raises
+        ------
+        ValueError
+            when the coordinates are outside of the layer
+
+        See also
+        --------
+        :meth:`get_tiles <tmlib.models.channel.ChannelLayer.get_tiles>`
+        '''
+        if not 0 <= z < len(self.dimensions):
+            raise ValueError('Zoom level %d is outside of the layer.' % z)
+        n_rows, n_cols = self.dimensions[z]
+        if not(0 <= y < n_rows and 0 <= x < n_cols):
+            raise ValueError(
+                'Tile "%d-%d-%d" is outside of the layer.' % (z, y, x)
+            )
+        return self.get_tiles(z, (y, y + 1), (x, x + 1))[(y, x)]
+
+    def get_tiles(self, z, y_range, x_range, decode=False):
+        '''Gets all tiles of a rectangular region of a zoom level, e.g. of a
+        viewport, at once. Tiles that are not cached are fetched with a single
+        request to the tile store.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y_range: Tuple[int]
+            zero-based index of the first and one past the last row; rows
+            outside of the layer are ignored
+        x_range: Tuple[int]
+            zero-based index of the first and one past the last column;
+            columns outside of the layer are ignored
+        decode: bool, optional
+            whether pixels should be decoded (default: ``False``)
+
+        Returns
+        -------
+        Dict[Tuple[int], Union[str, tmlib.image.PyramidTile]]
+            encoded pixels (see :attr:`mimetype
+            <tmlib.models.channel.ChannelLayer.mimetype>`) or decoded tiles
+            hashable by row, column coordinates; the mapping is ordered
+            row-major
+
+        Note
+        ----
+        Encoded pixels of layers with 16-bit tiles are mapped to 8-bit via
+        :attr:`display_lut <tmlib.models.channel.ChannelLayer.display_lut>`
+        and encoded with :attr:`DISPLAY_CODEC
+        <tmlib.models.channel.ChannelLayer.DISPLAY_CODEC>`, whereas decoded
+        tiles hold the stored 16-bit pixels.
+
+        Raises
+        ------
+        ValueError
+            when the zoom level is outside of the layer
+
+        Warning
+        -------
+        Decoded tiles are shared via the tile cache (see
+        :func:`get_tile_cache <tmlib.models.channel.get_tile_cache>`) and
+        must not be modified in place.
+        '''
+        if not 0 <= z < len(self.dimensions):
+            raise ValueError('Zoom level %d is outside of the layer.' % z)
+        n_rows, n_cols = self.dimensions[z]
+        coordinates = list(itertools.product(
+            range(max(y_range[0], 0), min(y_range[1], n_rows)),
+            range(max(x_range[0], 0), min(x_range[1], n_cols))
+        ))
+        if self.is_high_bit_depth and not decode:
+            return self._get_display_tiles(z, coordinates)
+        return self._get_stored_tiles(z, coordinates, decode)
+
+    @property
+    def _tile_cache_key(self):
+        # IDs of layers are only unique within an experiment.
+        return (self.channel.experiment_id, self.id, self.revision or 0)
+
+    def _get_stored_tiles(self, z, coordinates, decode):
+        cache = get_tile_cache()
+        key = self._tile_cache_key
+        tiles = collections.OrderedDict()
+        missing = list()
+        for y, x in coordinates:
+            tiles[(y, x)] = cache.get(key + (z, y, x, decode))
+            if tiles[(y, x)] is None:
+                missing.append((y, x))
+        # Encoded pixels are cached as well when decoded tiles are requested,
+        # such that they can be decoded again without hitting the store.
+        encoded = dict()
+        not_cached = list()
+        for y, x in missing:
+            encoded[(y, x)] = cache.get(key + (z, y, x, False))
+            if encoded[(y, x)] is None:
+                not_cached.append((y, x))
+        if not_cached:
+            logger.debug(
+                'fetch %d tiles of zoom level %d', len(not_cached), z
+            )
+            stored = self._tile_store.get_tiles(z, not_cached)
+            for y, x in not_cached:
+                # An empty string marks tiles that are not stored, such that
+                # background tiles are cached as well.
+                pixels = str(stored.get((y, x), ''))
+                cache.put(key + (z, y, x, False), pixels, len(pixels) + 1)
+                encoded[(y, x)] = pixels
+
+        for y, x in missing:
+            pixels = encoded[(y, x)]
+            if decode:
+                metadata = PyramidTileMetadata(
+                    z=z, y=y, x=x, channel_layer_id=self.id
+                )
+                if pixels:
+                    tile = PyramidTile.create_from_binary(pixels, metadata)
+                    cache.put(
+                        key + (z, y, x, True), tile, tile.array.nbytes
+                    )
+                else:
+                    tile = PyramidTile.create_as_background(
+                        metadata=metadata, dtype=self.dtype,
+                        tile_size=self.tile_size
+                    )
+                tiles[(y, x)] = tile
+            else:
+                tiles[(y, x)] = pixels
+
+        if not decode:
+            background = PyramidTile.get_background_payload(
+                self.codec or 'jpeg', self.quality, self.tile_size
+            ).tostring()
+            for key, pixels in tiles.iteritems():
+                if not pixels:
+                    tiles[key] = background
+        return tiles
+
+    def _get_display_tiles(self, z, coordinates):
+        cache = get_tile_cache()
+        key = self._tile_cache_key
+        # Encoded 8-bit tiles depend on the contrast, which may be changed
+        # at any time.
+        contrast = (self.min_intensity, self.max_intensity)
+        tiles = collections.OrderedDict()
+        missing = list()
+        for y, x in coordinates:
+            tiles[(y, x)] = cache.get(key + (z, y, x, contrast))
+            if tiles[(y, x)] is None:
+                missing.append((y, x))
+        if not missing:
+            return tiles
+        lut = self.display_lut
+        background = PyramidTile.get_background_payload(
+            self.DISPLAY_CODEC, tile_size=self.tile_size
+        ).tostring()
+        decoded = self._get_stored_tiles(z, missing, decode=True)
+        for (y, x), tile in decoded.iteritems():
+            if tile.is_background:
+                pixels = background
+            else:
+                pixels = tile.map_to_display(lut).\
+                    encode(self.DISPLAY_CODEC).tostring()
+            cache.put(key + (z, y, x, contrast), pixels, len(pixels))
+            tiles[(y, x)] = pixels
+        return tiles
+
+    @cached_property
+    def _tile_store(self):
+        session = Session.object_session(self)
+        return create_tile_store(session, self.id)
+
     def extract_tile_from_image(self, image, y_offset, x_offset):
         '''Extracts a subset of pixels for a tile from an image. In case the
         area of the tile overlaps the image, pad the tile with zeros.
@@ -40,6 +40,9 @@ logger = logging.getLogger(__name__)
 #: Format string for experiment locations.
 EXPERIMENT_LOCATION_FORMAT = 'experiment_{id}'
 
+#: Set[int]: supported number of pixels along each axis of pyramid tiles
+SUPPORTED_TILE_SIZES = {64, 128, 256, 512, 1024}
+
 
 @remove_location_upon_delete
 class ExperimentReference(MainModel, DateMixIn):
@@ -265,6 +268,9 @@ class Experiment(DirectoryModel):
     #: int: zoom factor between pyramid levels
     zoom_factor = Column(Integer, nullable=False)
 
+    #: int: number of pixels along each axis of pyramid tiles
+    tile_size = Column(Integer, default=256)
+
     #: displacement of neighboring sites within a well along the
     #: vertical axis in pixels
     vertical_site_displacement = Column(Integer, nullable=False)
@@ -279,7 +285,7 @@ class Experiment(DirectoryModel):
     def __init__(self, id, microscope_type, plate_format, plate_acquisition_mode,
             location, workflow_type='canonical', zoom_factor=2,
             well_spacer_size=500, vertical_site_displacement=0,
-            horizontal_site_displacement=0):
+            horizontal_site_displacement=0, tile_size=256):
         '''
         Parameters
         ----------
@@ -305,6 +311,9 @@ class Experiment(DirectoryModel):
         horizontal_site_displacement: int, optional
             displacement of neighboring sites within a well along the
             horizontal axis in pixels (default: ``0``)
+        tile_size: int, optional
+            number of pixels along each axis of pyramid tiles; must be a
+            power of two (default: ``256``)
 
         See also
         --------
@@ -315,6 +324,15 @@ class Experiment(DirectoryModel):
         self.id = id
         self._location = location
         self.zoom_factor = zoom_factor
+        # Tiles of lower zoom levels are created by downsampling a mosaic of
+        # tiles of the next higher level, which requires sizes that can be
+        # divided by the zoom factor.
+        if tile_size not in SUPPORTED_TILE_SIZES:
+            raise ValueError(
+                'Unsupported tile size! Supported are: %s'
+                % ', '.join(map(str, sorted(SUPPORTED_TILE_SIZES)))
+            )
+        self.tile_size = tile_size
         self.well_spacer_size = well_spacer_size
         # TODO: we may be able to calculate this automatically from OMEXML
         self.vertical_site_displacement = vertical_site_displacement
@@ -363,6 +381,12 @@ class Experiment(DirectoryModel):
         '''str: location where channel data are stored'''
         return os.path.join(self.location, 'channels')
 
+    @autocreate_directory_property
+    def segmentation_layers_location(self):
+        '''str: location where raster tiles of segmentation layers are stored
+        '''
+        return os.path.join(self.location, 'segmentation_layers')
+
     @cached_property
     def plate_spacer_size(self):
         '''int: gap between neighboring plates in pixels'''
@@ -15,6 +15,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import csv
+import itertools
+import numpy as np
 from cStringIO import StringIO
 from sqlalchemy import (
     Column, String, Integer, BigInteger, ForeignKey, Boolean, Index,
@@ -186,6 +188,42 @@ class FeatureValues(DistributedExperimentModel):
         )
         f.close()
 
+    @classmethod
+    def _bulk_ingest_frame(cls, connection, data, partition_key, tpoint=None):
+        '''Ingests the feature values of many mapobjects at once without
+        creating an instance of the class per mapobject. Values of the whole
+        matrix are formatted to text in a vectorized manner.
+
+        Parameters
+        ----------
+        connection: psycopg2.extensions.cursor
+            database cursor
+        data: pandas.DataFrame
+            feature values, where rows represent mapobjects and are indexed
+            by mapobject ID and columns represent features and are labeled by
+            feature ID
+        partition_key: int
+            key that determines on which shard the values will be stored
+        tpoint: int, optional
+            zero-based time point index
+        '''
+        if data.empty:
+            return
+        keys = np.array(['%s=>' % c for c in data.columns])
+        values = np.char.add(keys[np.newaxis, :], data.values.astype(str))
+        tpoint = '' if tpoint is None else str(tpoint)
+        f = StringIO()
+        for mapobject_id, row in itertools.izip(data.index, values):
+            f.write('%d;%d;%s;%s\n' % (
+                partition_key, mapobject_id, tpoint, ','.join(row)
+            ))
+        columns = ('partition_key', 'mapobject_id', 'tpoint', 'values')
+        f.seek(0)
+        connection.copy_from(
+            f, cls.__table__.name, sep=';', columns=columns, null=''
+        )
+        f.close()
+
     def __repr__(self):
         return (
             '<FeatureValues(id=%r, tpoint=%r, mapobject_id=%r)>'
@@ -0,0 +1,437 @@
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import numpy as np
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+#: str: key of the layout in the info dictionary of a session
+_SESSION_INFO_KEY = 'experiment_layout'
+
+
+def get_experiment_layout(instance):
+    '''Gets the layout that is attached to the session of a model instance.
+
+    Parameters
+    ----------
+    instance: tmlib.models.base.ExperimentModel
+        instance of a model class
+
+    Returns
+    -------
+    tmlib.models.layout.ExperimentLayout
+        layout or ``None`` when `instance` is not attached to a session or
+        no layout has been loaded for the session
+    '''
+    session = Session.object_session(instance)
+    if session is None:
+        return None
+    return session.info.get(_SESSION_INFO_KEY)
+
+
+class ExperimentLayout(object):
+
+    '''Position and size of all plates, wells and sites of an experiment
+    relative to the layer overview at the maximum zoom level.
+
+    Plates, wells and sites are loaded with one query each and their offsets
+    are computed for all objects at once. Upon creation, the layout is
+    attached to the session, such that the
+    :attr:`offset <tmlib.models.site.Site.offset>` properties of
+    :class:`Site <tmlib.models.site.Site>`,
+    :class:`Well <tmlib.models.well.Well>` and
+    :class:`Plate <tmlib.models.plate.Plate>` instances of the same session
+    delegate to it instead of walking up the relationships.
+
+    Warning
+    -------
+    The layout reflects the state of the database at the time it was loaded.
+    It should therefore only be used when the dimensions of sites don't
+    change within the session.
+
+    Examples
+    --------
+    >>> import tmlib.models as tm
+    >>> with tm.utils.ExperimentSession(experiment_id=1) as session:
+    >>>     layout = tm.ExperimentLayout(session)
+    >>>     site = session.query(tm.Site).first()
+    >>>     print(site.offset)
+    '''
+
+    def __init__(self, session):
+        '''
+        Parameters
+        ----------
+        session: tmlib.models.utils._SQLAlchemy_Session
+            experiment-specific database session
+        '''
+        # NOTE: Models depend on this module for delegation.
+        from tmlib.models.experiment import Experiment
+        from tmlib.models.plate import Plate
+        from tmlib.models.well import Well
+        from tmlib.models.site import Site
+
+        logger.debug('load experiment layout')
+        experiment = session.query(
+                Experiment.well_spacer_size,
+                Experiment.vertical_site_displacement,
+                Experiment.horizontal_site_displacement
+            ).\
+            one()
+        plates = session.query(Plate.id).\
+            order_by(Plate.id).\
+            all()
+        wells = session.query(Well.id, Well.plate_id, Well.name).\
+            order_by(Well.id).\
+            all()
+        sites = session.query(
+                Site.id, Site.well_id, Site.y, Site.x, Site.height,
+                Site.width, Site.top_residue, Site.bottom_residue,
+                Site.left_residue, Site.right_residue
+            ).\
+            order_by(Site.id).\
+            all()
+        self._compute(experiment, plates, wells, sites)
+        session.info[_SESSION_INFO_KEY] = self
+
+    def _compute(self, experiment, plates, wells, sites):
+        '''Computes offsets and sizes of plates, wells and sites.
+
+        Parameters
+        ----------
+        experiment: tmlib.models.experiment.Experiment
+            experiment or record with the spacer size and site displacements
+        plates: List[tmlib.models.plate.Plate]
+            plates or records with their ID, sorted by ID
+        wells: List[tmlib.models.well.Well]
+            wells or records with their ID, plate ID and name, sorted by ID
+        sites: List[tmlib.models.site.Site]
+            sites or records with their ID, well ID, coordinate, size and
+            residues, sorted by ID
+        '''
+        from tmlib.models.well import Well
+        from tmlib.workflow.illuminati.stitch import guess_stitch_dimensions
+
+        well_spacer_size = experiment.well_spacer_size
+        plate_spacer_size = well_spacer_size * 2
+        site_displacement = np.array([
+            experiment.vertical_site_displacement,
+            experiment.horizontal_site_displacement
+        ], dtype=np.int64)
+
+        #: numpy.ndarray[numpy.int64]: IDs of plates in ascending order
+        self.plate_ids = np.array([p.id for p in plates], dtype=np.int64)
+        #: numpy.ndarray[numpy.int64]: IDs of wells in ascending order
+        self.well_ids = np.array([w.id for w in wells], dtype=np.int64)
+        #: numpy.ndarray[numpy.int64]: IDs of sites in ascending order
+        self.site_ids = np.array([s.id for s in sites], dtype=np.int64)
+        n_plates = len(self.plate_ids)
+        n_wells = len(self.well_ids)
+        n_sites = len(self.site_ids)
+
+        well_plates = np.searchsorted(
+            self.plate_ids,
+            np.array([w.plate_id for w in wells], dtype=np.int64)
+        )
+        # Row and column of wells are not stored in the database, but are
+        # encoded in the name of the well.
+        well_coordinates = np.array(
+            [Well.map_name_to_coordinate(w.name) for w in wells],
+            dtype=np.int64
+        ).reshape(n_wells, 2)
+        site_wells = np.searchsorted(
+            self.well_ids,
+            np.array([s.well_id for s in sites], dtype=np.int64)
+        )
+        site_coordinates = np.array(
+            [(s.y, s.x) for s in sites], dtype=np.int64
+        ).reshape(n_sites, 2)
+        site_sizes = np.array(
+            [(s.height, s.width) for s in sites], dtype=np.int64
+        ).reshape(n_sites, 2)
+        residues = np.array(
+            [
+                (s.top_residue or 0, s.bottom_residue or 0,
+                 s.left_residue or 0, s.right_residue or 0)
+                for s in sites
+            ],
+            dtype=np.int64
+        ).reshape(n_sites, 4)
+
+        # Size of wells is determined by the number of sites along each axis
+        # and the size of the first site of the well.
+        well_dimensions = np.zeros((n_wells, 2), dtype=np.int64)
+        np.maximum.at(well_dimensions, site_wells, site_coordinates + 1)
+        #: numpy.ndarray[numpy.int64]: number of sites along the vertical
+        #: and horizontal axis of each well
+        self.well_dimensions = well_dimensions
+        well_site_sizes = np.zeros((n_wells, 2), dtype=np.int64)
+        wells_with_sites, first_sites = np.unique(
+            site_wells, return_index=True
+        )
+        well_site_sizes[wells_with_sites] = site_sizes[first_sites]
+        well_sizes = (
+            well_dimensions * well_site_sizes +
+            site_displacement * (well_dimensions - 1)
+        )
+
+        # Wells are allowed to have different sizes, but the offset is
+        # calculated using the size of the largest well of the plate.
+        plate_well_sizes = np.zeros((n_plates, 2), dtype=np.int64)
+        np.maximum.at(plate_well_sizes, well_plates, well_sizes)
+        row_ranks, n_rows = self._rank_within_groups(
+            well_plates, well_coordinates[:, 0], n_plates
+        )
+        column_ranks, n_columns = self._rank_within_groups(
+            well_plates, well_coordinates[:, 1], n_plates
+        )
+        n_nonempty = np.column_stack([n_rows, n_columns])
+
+        #: numpy.ndarray[numpy.int64]: number of pixels along the vertical
+        #: and horizontal axis of each plate
+        self.plate_image_sizes = (
+            n_nonempty * plate_well_sizes +
+            well_spacer_size * (n_nonempty - 1)
+        )
+        # Plates are arranged column-wise in the order of their IDs
+        # (see Experiment.plate_grid).
+        if n_plates > 0:
+            grid_rows = guess_stitch_dimensions(n_plates)[0]
+        else:
+            grid_rows = 1
+        plate_indices = np.arange(n_plates, dtype=np.int64)
+        plate_coordinates = np.column_stack([
+            plate_indices % grid_rows, plate_indices // grid_rows
+        ])
+        #: numpy.ndarray[numpy.int64]: *y*, *x* coordinate of the top, left
+        #: corner of each plate
+        self.plate_offsets = (
+            plate_coordinates * self.plate_image_sizes +
+            plate_coordinates * plate_spacer_size
+        )
+
+        #: numpy.ndarray[numpy.int64]: number of pixels along the vertical
+        #: and horizontal axis of each well
+        self.well_image_sizes = plate_well_sizes[well_plates]
+        well_ranks = np.column_stack([row_ranks, column_ranks])
+        #: numpy.ndarray[numpy.int64]: *y*, *x* coordinate of the top, left
+        #: corner of each well
+        self.well_offsets = (
+            well_ranks * self.well_image_sizes +
+            well_ranks * well_spacer_size +
+            self.plate_offsets[well_plates]
+        )
+
+        #: numpy.ndarray[numpy.int64]: IDs of the parent well of each site
+        self.site_well_ids = self.well_ids[site_wells]
+        #: numpy.ndarray[numpy.int64]: zero-based row and column index of
+        #: each site within its well
+        self.site_coordinates = site_coordinates
+        #: numpy.ndarray[numpy.int64]: number of pixels along the vertical
+        #: and horizontal axis of each site
+        self.site_image_sizes = site_sizes
+        #: numpy.ndarray[numpy.int64]: *y*, *x* coordinate of the top, left
+        #: corner of each site
+        self.site_offsets = (
+            site_coordinates * site_sizes +
+            site_coordinates * site_displacement +
+            self.well_offsets[site_wells]
+        )
+        #: numpy.ndarray[numpy.int64]: number of pixels along the vertical
+        #: and horizontal axis of each site after alignment between cycles
+        self.aligned_site_image_sizes = site_sizes - np.column_stack([
+            residues[:, 0] + residues[:, 1], residues[:, 2] + residues[:, 3]
+        ])
+        #: numpy.ndarray[numpy.int64]: *y*, *x* coordinate of the top, left
+        #: corner of each site after alignment between cycles
+        self.aligned_site_offsets = self.site_offsets + residues[:, [0, 2]]
+
+        self._plate_index = {
+            pid: i for i, pid in enumerate(self.plate_ids.tolist())
+        }
+        self._well_index = {
+            wid: i for i, wid in enumerate(self.well_ids.tolist())
+        }
+        self._site_index = {
+            sid: i for i, sid in enumerate(self.site_ids.tolist())
+        }
+
+    @staticmethod
+    def _rank_within_groups(groups, values, n_groups):
+        '''Ranks values among the unique values of the same group.
+
+        Parameters
+        ----------
+        groups: numpy.ndarray[numpy.int64]
+            zero-based group index of each value
+        values: numpy.ndarray[numpy.int64]
+            non-negative values
+        n_groups: int
+            number of groups
+
+        Returns
+        -------
+        Tuple[numpy.ndarray[numpy.int64]]
+            zero-based rank of each value and number of unique values of each
+            group
+        '''
+        if len(values) == 0:
+            return (
+                np.zeros((0, ), dtype=np.int64),
+                np.zeros((n_groups, ), dtype=np.int64)
+            )
+        base = values.max() + 1
+        keys, inverse = np.unique(groups * base + values, return_inverse=True)
+        key_groups = keys // base
+        ranks = np.arange(len(keys)) - np.searchsorted(key_groups, key_groups)
+        counts = np.bincount(key_groups, minlength=n_groups)
+        return (ranks[inverse], counts)
+
+    def has_site(self, site_id):
+        '''Determines whether the layout contains a site.
+
+        Parameters
+        ----------
+        site_id: int
+            ID of a :class:`Site <tmlib.models.site.Site>`
+
+        Returns
+        -------
+        bool
+        '''
+        return site_id in self._site_index
+
+    def has_well(self, well_id):
+        '''Determines whether the layout contains a well.
+
+        Parameters
+        ----------
+        well_id: int
+            ID of a :class:`Well <tmlib.models.well.Well>`
+
+        Returns
+        -------
+        bool
+        '''
+        return well_id in self._well_index
+
+    def has_plate(self, plate_id):
+        '''Determines whether the layout contains a plate.
+
+        Parameters
+        ----------
+        plate_id: int
+            ID of a :class:`Plate <tmlib.models.plate.Plate>`
+
+        Returns
+        -------
+        bool
+        '''
+        return plate_id in self._plate_index
+
+    def get_site_offset(self, site_id, aligned=False):
+        '''Gets the offset of a site.
+
+        Parameters
+        ----------
+        site_id: int
+            ID of a :class:`Site <tmlib.models.site.Site>`
+        aligned: bool, optional
+            whether the offset should account for alignment between cycles
+            (default: ``False``)
+
+        Returns
+        -------
+        Tuple[int]
+            *y*, *x* coordinate of the top, left corner of the site
+
+        Raises
+        ------
+        KeyError
+            when the layout doesn't contain the site
+        '''
+        index = self._site_index[site_id]
+        if aligned:
+            return tuple(self.aligned_site_offsets[index].tolist())
+        return tuple(self.site_offsets[index].tolist())
+
+    def get_well_offset(self, well_id):
+        '''Gets the offset of a well.
+
+        Parameters
+        ----------
+        well_id: int
+            ID of a :class:`Well <tmlib.models.well.Well>`
+
+        Returns
+        -------
+        Tuple[int]
+            *y*, *x* coordinate of the top, left corner of the well
+
+        Raises
+        ------
+        KeyError
+            when the layout doesn't contain the well
+        '''
+        return tuple(self.well_offsets[self._well_index[well_id]].tolist())
+
+    def get_well_dimensions(self, well_id):
+        '''Gets the number of sites of a well.
+
+        Parameters
+        ----------
+        well_id: int
+            ID of a :class:`Well <tmlib.models.well.Well>`
+
+        Returns
+        -------
+        Tuple[int]
+            number of sites along the vertical and horizontal axis
+
+        Raises
+        ------
+        KeyError
+            when the layout doesn't contain the well
+        '''
+        index = self._well_index[well_id]
+        return tuple(self.well_dimensions[index].tolist())
+
+    def get_plate_offset(self, plate_id):
+        '''Gets the offset of a plate.
+
+        Parameters
+        ----------
+        plate_id: int
+            ID of a :class:`Plate <tmlib.models.plate.Plate>`
+
+        Returns
+        -------
+        Tuple[int]
+            *y*, *x* coordinate of the top, left corner of the plate
+
+        Raises
+        ------
+        KeyError
+            when the layout doesn't contain the plate
+        '''
+        return tuple(self.plate_offsets[self._plate_index[plate_id]].tolist())
+
+    def __repr__(self):
+        return '<%s(n_plates=%r, n_wells=%r, n_sites=%r)>' % (
+            self.__class__.__name__, len(self.plate_ids),
+            len(self.well_ids), len(self.site_ids)
+        )
@@ -18,7 +18,10 @@ import os
 import csv
 import logging
 import random
+import socket
+import itertools
 import collections
+import numpy as np
 import pandas as pd
 from cStringIO import StringIO
 from sqlalchemy import func, case
@@ -31,8 +34,10 @@ from sqlalchemy import (
 )
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.hybrid import hybrid_property
+from cached_property import cached_property
 
 from tmlib import cfg
+from tmlib.image import PyramidTile, SegmentationImage
 from tmlib.models.dialect import _compile_distributed_query
 from tmlib.models.result import ToolResult, LabelValues
 from tmlib.models.base import (
@@ -41,10 +46,21 @@ from tmlib.models.base import (
 from tmlib.models.feature import Feature, FeatureValues
 from tmlib.models.types import ST_SimplifyPreserveTopology
 from tmlib.models.site import Site
+from tmlib.models.tile import calculate_pyramid_dimensions
+from tmlib.models.tilestore import PackFileTileStore
 from tmlib.utils import autocreate_directory_property, create_partitions
 
 logger = logging.getLogger(__name__)
 
+#: Format string for segmentation layer locations
+SEGMENTATION_LAYER_LOCATION_FORMAT = 'layer_{id}'
+
+#: Format string for locations of outline images of segmentation layers
+SEGMENTATION_LAYER_OUTLINES_LOCATION_FORMAT = 'outlines_{id}'
+
+#: Format string for locations of cached label images of segmentation layers
+SEGMENTATION_LAYER_LABELS_LOCATION_FORMAT = 'labels_{id}'
+
 
 class MapobjectType(ExperimentModel, IdMixIn):
 
@@ -230,6 +246,108 @@ class MapobjectType(ExperimentModel, IdMixIn):
 
         return segmentations
 
+    def get_label_image_per_site(self, site_id, tpoint, zplane, y_offset,
+            x_offset, dimensions, cache=False):
+        '''Gets a label image of the segmentations of a
+        :class:`Site <tmlib.models.site.Site>`, which is reconstructed from
+        the polygons of each
+        :class:`MapobjectSegmentation <tmlib.models.mapobject.MapobjectSegmentation>`
+        (see :meth:`create_from_polygons
+        <tmlib.image.SegmentationImage.create_from_polygons>`).
+
+        Parameters
+        ----------
+        site_id: int
+            ID of the :class:`Site <tmlib.models.site.Site>`
+        tpoint: int
+            time point for which objects should be filtered
+        zplane: int
+            z-plane for which objects should be filtered
+        y_offset: int
+            global vertical offset of the site
+        x_offset: int
+            global horizontal offset of the site
+        dimensions: Tuple[int]
+            *y*, *x* dimensions of the image
+        cache: bool, optional
+            whether the label image should be cached on disk; a cached image
+            is reused as long as the segmentations of the site, the offsets
+            and the dimensions don't change (default: ``False``)
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int32]
+            labeled pixels array
+        '''
+        session = Session.object_session(self)
+        layer = session.query(SegmentationLayer).\
+            filter_by(mapobject_type_id=self.id, tpoint=tpoint, zplane=zplane).\
+            one()
+        if cache:
+            filename = layer.get_label_image_filename(site_id)
+            if os.path.exists(filename):
+                fingerprint = layer.get_segmentations_fingerprint(site_id)
+                try:
+                    with np.load(filename) as f:
+                        is_valid = (
+                            str(f['fingerprint']) == fingerprint and
+                            tuple(f['offset']) == (y_offset, x_offset) and
+                            f['array'].shape == tuple(dimensions)
+                        )
+                        if is_valid:
+                            logger.debug(
+                                'load cached label image for site %d',
+                                site_id
+                            )
+                            return f['array']
+                except (IOError, ValueError, KeyError) as error:
+                    logger.warn(
+                        'cached label image for site %d cannot be read: %s',
+                        site_id, str(error)
+                    )
+        if cache:
+            # The fingerprint of the cached image is computed from the rows
+            # the image is created from rather than in a separate query,
+            # such that concurrent writes can't cause a mismatch.
+            records = session.query(
+                    MapobjectSegmentation.mapobject_id,
+                    MapobjectSegmentation.label,
+                    MapobjectSegmentation.geom_polygon,
+                    func.ST_MemSize(MapobjectSegmentation.geom_polygon).\
+                        label('size')
+                ).\
+                filter_by(
+                    segmentation_layer_id=layer.id, partition_key=site_id
+                ).\
+                order_by(MapobjectSegmentation.mapobject_id).\
+                all()
+            segmentations = [(r.label, r.geom_polygon) for r in records]
+            ids = [r.mapobject_id for r in records]
+            fingerprint = layer._format_fingerprint(
+                len(records), max(ids or [0]), sum(ids),
+                sum(r.label or 0 for r in records),
+                sum(r.size or 0 for r in records)
+            )
+        else:
+            segmentations = self.get_segmentations_per_site(
+                site_id, tpoint, zplane
+            )
+        image = SegmentationImage.create_from_polygons(
+            segmentations, y_offset, x_offset, dimensions
+        )
+        if cache:
+            logger.debug('cache label image for site %d', site_id)
+            # The file is replaced atomically, such that concurrent readers
+            # never see a partially written file.
+            suffix = '%s-%d.tmp' % (socket.gethostname(), os.getpid())
+            with open('%s.%s' % (filename, suffix), 'wb') as f:
+                np.savez(
+                    f, array=image.array, fingerprint=fingerprint,
+                    offset=np.array([y_offset, x_offset])
+                )
+            os.rename('%s.%s' % (filename, suffix), filename)
+        return image.array
+
     def get_feature_values_per_site(self, site_id, tpoint, feature_ids=None):
         '''Gets all
         :class:`FeatureValues <tmlib.models.feature.FeatureValues>`
@@ -762,6 +880,10 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
     #: int: zoom level threshold below which centroids will not be visualized
     centroid_thresh = Column(Integer)
 
+    #: bool: whether outlines of objects are available as a pyramid of
+    #: raster tiles
+    has_raster_tiles = Column(Boolean, default=False)
+
     #: int: ID of parent channel
     mapobject_type_id = Column(
         Integer,
@@ -790,9 +912,235 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
         self.tpoint = tpoint
         self.zplane = zplane
         self.mapobject_type_id = mapobject_type_id
+        self.has_raster_tiles = False
+
+    @property
+    def location(self):
+        '''str: location where pack files of raster tiles are stored'''
+        return os.path.join(
+            self.mapobject_type.experiment.segmentation_layers_location,
+            SEGMENTATION_LAYER_LOCATION_FORMAT.format(id=self.id)
+        )
+
+    @autocreate_directory_property
+    def outlines_location(self):
+        '''str: location where outline images of individual sites are stored
+        from which raster tiles get created
+        '''
+        return os.path.join(
+            self.mapobject_type.experiment.segmentation_layers_location,
+            SEGMENTATION_LAYER_OUTLINES_LOCATION_FORMAT.format(id=self.id)
+        )
+
+    def get_outlines_filename(self, site_id):
+        '''Gets the name of the outline image file of a site.
+
+        Parameters
+        ----------
+        site_id: int
+            ID of a :class:`Site <tmlib.models.site.Site>`
+
+        Returns
+        -------
+        str
+            absolute path to the PNG file
+        '''
+        return os.path.join(self.outlines_location, 'site_%d.png' % site_id)
+
+    @autocreate_directory_property
+    def labels_location(self):
+        '''str: location where label images of individual sites are cached
+        (see :meth:`get_label_image_per_site
+        <tmlib.models.mapobject.MapobjectType.get_label_image_per_site>`)
+        '''
+        return os.path.join(
+            self.mapobject_type.experiment.segmentation_layers_location,
+            SEGMENTATION_LAYER_LABELS_LOCATION_FORMAT.format(id=self.id)
+        )
+
+    def get_label_image_filename(self, site_id):
+        '''Gets the name of the cached label image file of a site.
+
+        Parameters
+        ----------
+        site_id: int
+            ID of a :class:`Site <tmlib.models.site.Site>`
+
+        Returns
+        -------
+        str
+            absolute path to the NPZ file
+        '''
+        return os.path.join(self.labels_location, 'site_%d.npz' % site_id)
+
+    def get_segmentations_fingerprint(self, site_id):
+        '''Computes a fingerprint of the segmentations of a site, which
+        changes whenever segmentations are added, removed or replaced.
+
+        Parameters
+        ----------
+        site_id: int
+            ID of a :class:`Site <tmlib.models.site.Site>`
+
+        Returns
+        -------
+        str
+            number of segmentations, maximum and sum of their mapobject IDs,
+            sum of their labels and sum of the sizes of their polygons
+            (empty if there are no segmentations)
+
+        Note
+        ----
+        The fingerprint is aggregated by the database server from values
+        that don't require reading polygons, such that validating a cached
+        label image is cheap. Segmentations of a site get replaced together
+        with their mapobjects, which get new IDs. A polygon that is updated
+        in place without changing its size isn't detected.
+        '''
+        session = Session.object_session(self)
+        summary = session.query(
+                func.count(MapobjectSegmentation.mapobject_id),
+                func.coalesce(func.max(MapobjectSegmentation.mapobject_id), 0),
+                func.coalesce(func.sum(MapobjectSegmentation.mapobject_id), 0),
+                func.coalesce(func.sum(MapobjectSegmentation.label), 0),
+                func.coalesce(
+                    func.sum(func.ST_MemSize(
+                        MapobjectSegmentation.geom_polygon
+                    )),
+                    0
+                )
+            ).\
+            filter_by(segmentation_layer_id=self.id, partition_key=site_id).\
+            one()
+        return self._format_fingerprint(*summary)
+
+    @staticmethod
+    def _format_fingerprint(count, max_mapobject_id, mapobject_id_sum,
+            label_sum, size_sum):
+        '''Formats the fingerprint of the segmentations of a site, such that
+        fingerprints computed by the database server (see
+        :meth:`get_segmentations_fingerprint
+        <tmlib.models.mapobject.SegmentationLayer.get_segmentations_fingerprint>`)
+        and on the client side are equal.
+
+        Parameters
+        ----------
+        count: int
+            number of segmentations
+        max_mapobject_id: int
+            maximum mapobject ID
+        mapobject_id_sum: int
+            sum of mapobject IDs
+        label_sum: int
+            sum of labels
+        size_sum: int
+            sum of the sizes of polygons in bytes
+
+        Returns
+        -------
+        str
+            fingerprint (empty if there are no segmentations)
+        '''
+        if count == 0:
+            return ''
+        return '%d:%d:%d:%d:%d' % (
+            count, max_mapobject_id, mapobject_id_sum, label_sum, size_sum
+        )
+
+    @property
+    def mimetype(self):
+        '''str: media type of raster tiles served by :meth:`get_raster_tiles
+        <tmlib.models.mapobject.SegmentationLayer.get_raster_tiles>`
+        '''
+        return PyramidTile.CODECS['png']['mimetype']
+
+    @cached_property
+    def tile_size(self):
+        '''int: maximal number of pixels along each axis of a raster tile'''
+        experiment = self.mapobject_type.experiment
+        return experiment.tile_size or PyramidTile.TILE_SIZE
+
+    @cached_property
+    def zoom_factor(self):
+        '''int: factor by which resolution increases per pyramid level'''
+        return self.mapobject_type.experiment.zoom_factor
+
+    @cached_property
+    def dimensions(self):
+        '''List[Tuple[int]]: number of raster tiles along the vertical and
+        horizontal axis at each zoom level; levels are sorted from the lowest
+        to the highest resolution level like the levels of
+        :attr:`ChannelLayer.dimensions
+        <tmlib.models.channel.ChannelLayer.dimensions>`
+        '''
+        experiment = self.mapobject_type.experiment
+        return calculate_pyramid_dimensions(
+            experiment.pyramid_height, experiment.pyramid_width,
+            self.zoom_factor, self.tile_size
+        )
+
+    @cached_property
+    def _raster_tile_store(self):
+        session = Session.object_session(self)
+        return PackFileTileStore(session, self)
+
+    def get_raster_tiles(self, z, y_range, x_range):
+        '''Gets the encoded raster tiles of a rectangular region of a zoom
+        level, e.g. of a viewport. Raster tiles are served the same way as
+        tiles of a :class:`ChannelLayer
+        <tmlib.models.channel.ChannelLayer>` (see :meth:`get_tiles
+        <tmlib.models.channel.ChannelLayer.get_tiles>`), such that outlines
+        of many objects can be overlaid at any zoom level.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y_range: Tuple[int]
+            zero-based index of the first and one past the last row; rows
+            outside of the layer are ignored
+        x_range: Tuple[int]
+            zero-based index of the first and one past the last column;
+            columns outside of the layer are ignored
+
+        Returns
+        -------
+        Dict[Tuple[int], str]
+            encoded pixels (see :attr:`mimetype
+            <tmlib.models.mapobject.SegmentationLayer.mimetype>`) hashable by
+            row, column coordinates; the mapping is ordered row-major
+
+        Raises
+        ------
+        ValueError
+            when the layer doesn't have raster tiles or when the zoom level is
+            outside of the layer
+        '''
+        if not self.has_raster_tiles:
+            raise ValueError(
+                'Segmentation layer %d doesn\'t have raster tiles.' % self.id
+            )
+        if not 0 <= z < len(self.dimensions):
+            raise ValueError('Zoom level %d is outside of the layer.' % z)
+        n_rows, n_cols = self.dimensions[z]
+        coordinates = list(itertools.product(
+            range(max(y_range[0], 0), min(y_range[1], n_rows)),
+            range(max(x_range[0], 0), min(x_range[1], n_cols))
+        ))
+        stored = self._raster_tile_store.get_tiles(z, coordinates)
+        background = PyramidTile.get_background_payload(
+            'png', tile_size=self.tile_size
+        ).tostring()
+        tiles = collections.OrderedDict()
+        for y, x in coordinates:
+            if (y, x) in stored:
+                tiles[(y, x)] = str(stored[(y, x)])
+            else:
+                tiles[(y, x)] = background
+        return tiles
 
     @classmethod
-    def get_tile_bounding_box(cls, x, y, z, maxzoom):
+    def get_tile_bounding_box(cls, x, y, z, maxzoom, tile_size=256):
         '''Calculates the bounding box of a layer tile.
 
         Parameters
@@ -805,6 +1153,8 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
             zoom level
         maxzoom: int
             maximal zoom level of layers belonging to the visualized experiment
+        tile_size: int, optional
+            number of pixels along each axis of a tile (default: ``256``)
 
         Returns
         -------
@@ -813,7 +1163,7 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
         '''
         # The extent of a tile of the current zoom level in mapobject
         # coordinates (i.e. coordinates on the highest zoom level)
-        size = 256 * 2 ** (maxzoom - z)
+        size = tile_size * 2 ** (maxzoom - z)
         # Coordinates of the top-left corner of the tile
         x0 = x * size
         y0 = y * size
@@ -916,8 +1266,11 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
         logger.debug('get mapobject outlines falling into tile')
         session = Session.object_session(self)
 
-        maxzoom = self.mapobject_type.experiment.pyramid_depth - 1
-        minx, miny, maxx, maxy = self.get_tile_bounding_box(x, y, z, maxzoom)
+        experiment = self.mapobject_type.experiment
+        maxzoom = experiment.pyramid_depth - 1
+        minx, miny, maxx, maxy = self.get_tile_bounding_box(
+            x, y, z, maxzoom, experiment.tile_size or 256
+        )
         tile = (
             'POLYGON(('
                 '{maxx} {maxy}, {minx} {maxy}, {minx} {miny}, {maxx} {miny}, '
@@ -24,6 +24,7 @@ from sqlalchemy.ext.hybrid import hybrid_property
 
 from tmlib.models.base import DirectoryModel, DateMixIn
 from tmlib.models.utils import remove_location_upon_delete
+from tmlib.models.layout import get_experiment_layout
 from tmlib.models.status import FileUploadStatus as fus
 from tmlib.utils import autocreate_directory_property
 
@@ -246,7 +247,15 @@ class Plate(DirectoryModel, DateMixIn):
     def offset(self):
         '''Tuple[int]: *y*, *x* coordinate of the top, left corner of the plate
         relative to the layer overview at the maximum zoom level
+
+        Note
+        ----
+        Delegates to the :class:`ExperimentLayout
+        <tmlib.models.layout.ExperimentLayout>` of the session if available.
         '''
+        layout = get_experiment_layout(self)
+        if layout is not None and layout.has_plate(self.id):
+            return layout.get_plate_offset(self.id)
         logger.debug('calculate plate offset')
         experiment = self.experiment
         plate_coordinate = zip(*np.where(experiment.plate_grid == self.id))[0]
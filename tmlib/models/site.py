@@ -20,6 +20,7 @@ from sqlalchemy.orm import relationship, backref
 from sqlalchemy import UniqueConstraint
 
 from tmlib.models.base import ExperimentModel, IdMixIn
+from tmlib.models.layout import get_experiment_layout
 
 
 logger = logging.getLogger(__name__)
@@ -135,7 +136,15 @@ class Site(ExperimentModel, IdMixIn):
     def offset(self):
         '''Tuple[int]: *y*, *x* coordinate of the top, left corner of the site
         relative to the layer overview at the maximum zoom level
+
+        Note
+        ----
+        Delegates to the :class:`ExperimentLayout
+        <tmlib.models.layout.ExperimentLayout>` of the session if available.
         '''
+        layout = get_experiment_layout(self)
+        if layout is not None and layout.has_site(self.id):
+            return layout.get_site_offset(self.id)
         logger.debug('calculate offset for site %d', self.id)
         well = self.well
         plate = well.plate
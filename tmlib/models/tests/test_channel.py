@@ -0,0 +1,167 @@
+import numpy as np
+import pytest
+
+from tmlib.image import PyramidTile
+from tmlib.models import channel as channel_module
+from tmlib.models.channel import Channel
+from tmlib.models.channel import ChannelLayer
+from tmlib.utils import LRUCache
+
+
+def _create_layer(min_intensity=None, max_intensity=None):
+    layer = ChannelLayer(channel_id=1, tpoint=0, zplane=0, bit_depth=16)
+    layer.min_intensity = min_intensity
+    layer.max_intensity = max_intensity
+    return layer
+
+
+def test_display_lut_defaults_to_full_range():
+    layer = _create_layer()
+    expected = PyramidTile.create_display_lut(0, 2**16 - 1)
+    np.testing.assert_array_equal(layer.display_lut, expected)
+
+
+def test_display_lut_lower_bound_only():
+    layer = _create_layer(min_intensity=1000)
+    expected = PyramidTile.create_display_lut(1000, 2**16 - 1)
+    np.testing.assert_array_equal(layer.display_lut, expected)
+    assert layer.display_lut[1000] == 0
+
+
+def test_display_lut_upper_bound_only():
+    layer = _create_layer(max_intensity=4000)
+    expected = PyramidTile.create_display_lut(0, 4000)
+    np.testing.assert_array_equal(layer.display_lut, expected)
+    assert layer.display_lut[4000] == 255
+
+
+def test_display_lut_follows_intensity_range():
+    layer = _create_layer(100, 1100)
+    lut = layer.display_lut
+    assert layer.display_lut is lut
+    layer.max_intensity = 2100
+    assert layer.display_lut is not lut
+    np.testing.assert_array_equal(
+        layer.display_lut, PyramidTile.create_display_lut(100, 2100)
+    )
+
+
+class _Store(object):
+
+    def __init__(self, tiles):
+        self.tiles = tiles
+        self.requests = list()
+
+    def get_tiles(self, z, coordinates):
+        self.requests.append((z, list(coordinates)))
+        return {
+            c: self.tiles[(z, ) + c] for c in coordinates
+            if (z, ) + c in self.tiles
+        }
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = LRUCache(10 * 1024**2)
+    monkeypatch.setattr(channel_module, '_tile_cache', cache)
+    return cache
+
+
+def _create_stored_layer(tiles, experiment_id=1, layer_id=3, bit_depth=8):
+    layer = ChannelLayer(
+        channel_id=2, tpoint=0, zplane=0, bit_depth=bit_depth,
+        codec='png' if bit_depth == 16 else 'jpeg'
+    )
+    layer.id = layer_id
+    layer.channel = Channel('c', 'w', bit_depth, experiment_id)
+    # Values that would otherwise be derived from the experiment
+    layer.__dict__['dimensions'] = [(1, 1), (2, 3)]
+    layer.__dict__['tile_size'] = 8
+    layer.__dict__['_tile_store'] = _Store(tiles)
+    return layer
+
+
+def _encode(array):
+    return PyramidTile(array).encode('png').tostring()
+
+
+def test_get_tiles_clips_viewport(cache):
+    layer = _create_stored_layer({(1, 0, 2): 'a', (1, 1, 2): 'b'})
+    tiles = layer.get_tiles(1, (-1, 5), (2, 10))
+    assert tiles.keys() == [(0, 2), (1, 2)]
+    assert tiles.values() == ['a', 'b']
+    assert layer._tile_store.requests == [(1, [(0, 2), (1, 2)])]
+
+
+def test_get_tiles_outside_of_layer(cache):
+    layer = _create_stored_layer({})
+    assert layer.get_tiles(1, (2, 4), (0, 3)) == {}
+    with pytest.raises(ValueError):
+        layer.get_tiles(2, (0, 1), (0, 1))
+
+
+def test_get_tiles_background_payload(cache):
+    layer = _create_stored_layer({(1, 0, 0): 'a'})
+    tiles = layer.get_tiles(1, (0, 1), (0, 2))
+    background = PyramidTile.get_background_payload('jpeg', None, 8)
+    assert tiles == {(0, 0): 'a', (0, 1): background.tostring()}
+
+
+def test_get_tiles_cache_hits(cache):
+    layer = _create_stored_layer({(1, 0, 0): 'a'})
+    layer.get_tiles(1, (0, 1), (0, 2))
+    tiles = layer.get_tiles(1, (0, 2), (0, 2))
+    assert tiles[(0, 0)] == 'a'
+    # Background tiles are cached as well
+    assert layer._tile_store.requests == [
+        (1, [(0, 0), (0, 1)]), (1, [(1, 0), (1, 1)])
+    ]
+
+
+def test_get_tiles_cache_key_includes_experiment(cache):
+    layer = _create_stored_layer({(1, 0, 0): 'a'}, experiment_id=1)
+    other_layer = _create_stored_layer({(1, 0, 0): 'b'}, experiment_id=2)
+    assert layer.get_tile(1, 0, 0) == 'a'
+    assert other_layer.get_tile(1, 0, 0) == 'b'
+
+
+def test_get_tiles_cache_key_includes_revision(cache):
+    layer = _create_stored_layer({(1, 0, 0): 'a'})
+    assert layer.get_tile(1, 0, 0) == 'a'
+    layer._tile_store.tiles[(1, 0, 0)] = 'b'
+    assert layer.get_tile(1, 0, 0) == 'a'
+    layer.revision = 1
+    assert layer.get_tile(1, 0, 0) == 'b'
+
+
+def test_get_tiles_decoded(cache):
+    array = np.arange(64, dtype=np.uint8).reshape(8, 8)
+    layer = _create_stored_layer({(1, 0, 0): _encode(array)})
+    layer.get_tiles(1, (0, 1), (0, 2))
+    tiles = layer.get_tiles(1, (0, 1), (0, 2), decode=True)
+    np.testing.assert_array_equal(tiles[(0, 0)].array, array)
+    assert tiles[(0, 1)].is_background
+    # Encoded pixels were cached by the first request
+    assert len(layer._tile_store.requests) == 1
+    decoded = layer.get_tiles(1, (0, 1), (0, 1), decode=True)
+    assert decoded[(0, 0)] is tiles[(0, 0)]
+
+
+def test_get_tiles_display(cache):
+    array = np.arange(64, dtype=np.uint16).reshape(8, 8) * 100
+    layer = _create_stored_layer(
+        {(1, 0, 0): _encode(array)}, bit_depth=16
+    )
+    layer.min_intensity = 0
+    layer.max_intensity = 6300
+    pixels = layer.get_tile(1, 0, 0)
+    lut = PyramidTile.create_display_lut(0, 6300)
+    expected = PyramidTile(array).map_to_display(lut).encode('jpeg')
+    assert pixels == expected.tostring()
+    assert layer.get_tile(1, 0, 1) == PyramidTile.get_background_payload(
+        'jpeg', tile_size=8
+    ).tostring()
+    # Changing the contrast doesn't require fetching tiles again
+    layer.max_intensity = 3000
+    assert layer.get_tile(1, 0, 0) != pixels
+    assert len(layer._tile_store.requests) == 2
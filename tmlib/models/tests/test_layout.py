@@ -0,0 +1,107 @@
+import pytest
+
+from tmlib.models.experiment import Experiment
+from tmlib.models.layout import ExperimentLayout
+from tmlib.models.plate import Plate
+from tmlib.models.site import Site
+from tmlib.models.well import Well
+
+
+# Wells of each plate with the number of sites along each axis and the size
+# of their sites. Wells differ in size and plates have empty rows and
+# columns.
+PLATES = [
+    [('A01', (2, 2), (10, 12)), ('A03', (1, 3), (10, 12)),
+     ('C02', (3, 1), (10, 12))],
+    [('B05', (2, 2), (10, 12))],
+    [('D01', (1, 1), (8, 9)), ('D02', (2, 1), (8, 9))],
+]
+
+
+@pytest.fixture
+def experiment():
+    # Instances aren't attached to a session, such that offsets are
+    # calculated by walking up the relationships.
+    experiment = Experiment(
+        1, 'cellvoyager', 96, 'basic', '/tmp', well_spacer_size=50,
+        vertical_site_displacement=3, horizontal_site_displacement=2
+    )
+    well_id = 10
+    site_id = 100
+    for plate_id, wells in enumerate(PLATES, 1):
+        plate = Plate('plate%d' % plate_id, experiment.id)
+        plate.id = plate_id
+        plate.experiment = experiment
+        for name, (n_rows, n_cols), (height, width) in wells:
+            well = Well(name, plate.id)
+            well.id = well_id
+            well.plate = plate
+            for y in range(n_rows):
+                for x in range(n_cols):
+                    site = Site(y, x, height, width, well.id)
+                    site.id = site_id
+                    site.well = well
+                    site_id += 1
+            well_id += 1
+    return experiment
+
+
+@pytest.fixture
+def layout(experiment):
+    plates = experiment.plates
+    wells = [w for p in plates for w in p.wells]
+    sites = [s for w in wells for s in w.sites]
+    layout = ExperimentLayout.__new__(ExperimentLayout)
+    layout._compute(experiment, plates, wells, sites)
+    return layout
+
+
+def _iterate_wells(experiment):
+    for plate in experiment.plates:
+        for well in plate.wells:
+            yield well
+
+
+def test_plate_offsets(experiment, layout):
+    for plate in experiment.plates:
+        assert layout.get_plate_offset(plate.id) == tuple(plate.offset)
+
+
+def test_plate_image_sizes(experiment, layout):
+    sizes = dict(zip(layout.plate_ids, layout.plate_image_sizes.tolist()))
+    for plate in experiment.plates:
+        assert tuple(sizes[plate.id]) == tuple(plate.image_size)
+
+
+def test_well_offsets(experiment, layout):
+    for well in _iterate_wells(experiment):
+        assert layout.get_well_offset(well.id) == tuple(well.offset)
+
+
+def test_well_image_sizes(experiment, layout):
+    sizes = dict(zip(layout.well_ids, layout.well_image_sizes.tolist()))
+    for well in _iterate_wells(experiment):
+        assert tuple(sizes[well.id]) == tuple(well.image_size)
+
+
+def test_well_dimensions(experiment, layout):
+    for well in _iterate_wells(experiment):
+        assert layout.get_well_dimensions(well.id) == tuple(well.dimensions)
+
+
+def test_site_offsets(experiment, layout):
+    for well in _iterate_wells(experiment):
+        for site in well.sites:
+            assert layout.get_site_offset(site.id) == tuple(site.offset)
+
+
+def test_site_wells_and_coordinates(experiment, layout):
+    sites = zip(
+        layout.site_ids.tolist(), layout.site_well_ids.tolist(),
+        layout.site_coordinates.tolist()
+    )
+    expected = {
+        s.id: (s.well_id, [s.y, s.x])
+        for w in _iterate_wells(experiment) for s in w.sites
+    }
+    assert {i: (w, c) for i, w, c in sites} == expected
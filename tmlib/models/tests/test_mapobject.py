@@ -0,0 +1,139 @@
+import collections
+
+import numpy as np
+import pytest
+import shapely.geometry
+
+import tmlib.models.mapobject as mapobject_module
+from tmlib.models.mapobject import MapobjectType
+from tmlib.models.mapobject import SegmentationLayer
+
+
+_Record = collections.namedtuple(
+    '_Record', ['mapobject_id', 'label', 'geom_polygon', 'size']
+)
+
+
+def _create_record(mapobject_id, label, x, y):
+    polygon = shapely.geometry.box(x, -(y + 3), x + 3, -y)
+    return _Record(mapobject_id, label, polygon, len(polygon.wkb))
+
+
+class _Query(object):
+
+    def __init__(self, result):
+        self._result = result
+
+    def filter_by(self, **kwargs):
+        return self
+
+    def order_by(self, *args):
+        return self
+
+    def one(self):
+        return self._result
+
+    def all(self):
+        return self._result
+
+
+# Serves the segmentation layer and the records of its segmentations
+class _Session(object):
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.records = list()
+        self.n_record_queries = 0
+
+    def object_session(self, instance):
+        return self
+
+    def query(self, *entities):
+        if entities[0] is SegmentationLayer:
+            return _Query(self.layer)
+        self.n_record_queries += 1
+        return _Query(list(self.records))
+
+
+class _Layer(object):
+
+    _format_fingerprint = staticmethod(SegmentationLayer._format_fingerprint)
+
+    def __init__(self, location):
+        self.id = 1
+        self.location = location
+        self.session = None
+
+    def get_label_image_filename(self, site_id):
+        return '%s/site_%d.npz' % (self.location, site_id)
+
+    def get_segmentations_fingerprint(self, site_id):
+        # Aggregates the same values as the database server
+        records = self.session.records
+        ids = [r.mapobject_id for r in records]
+        return self._format_fingerprint(
+            len(records), max(ids or [0]), sum(ids),
+            sum(r.label for r in records), sum(r.size for r in records)
+        )
+
+
+@pytest.fixture
+def session(tmpdir, monkeypatch):
+    layer = _Layer(str(tmpdir))
+    session = _Session(layer)
+    layer.session = session
+    monkeypatch.setattr(mapobject_module, 'Session', session)
+    return session
+
+
+def _get_label_image(y_offset=0, x_offset=0):
+    mapobject_type = MapobjectType('cells', 1)
+    return mapobject_type.get_label_image_per_site(
+        1, 0, 0, y_offset, x_offset, (10, 10), cache=True
+    )
+
+
+def test_format_fingerprint():
+    fingerprint = SegmentationLayer._format_fingerprint(2, 8, 15, 3, 200)
+    assert fingerprint == '2:8:15:3:200'
+
+
+def test_format_fingerprint_without_segmentations():
+    assert SegmentationLayer._format_fingerprint(0, 0, 0, 0, 0) == ''
+
+
+def test_label_image_cache_hit(session):
+    session.records = [_create_record(7, 1, 1, 1), _create_record(8, 2, 5, 5)]
+    array = _get_label_image()
+    assert session.n_record_queries == 1
+    assert set(np.unique(array)) == {0, 1, 2}
+    np.testing.assert_array_equal(_get_label_image(), array)
+    assert session.n_record_queries == 1
+
+
+def test_label_image_cache_invalidated_by_replaced_segmentations(session):
+    session.records = [_create_record(7, 1, 1, 1), _create_record(8, 2, 5, 5)]
+    _get_label_image()
+    # Segmentations of a site get replaced together with their mapobjects
+    session.records = [_create_record(9, 1, 1, 1), _create_record(10, 2, 2, 6)]
+    array = _get_label_image()
+    assert session.n_record_queries == 2
+    assert array[7, 3] == 2
+    assert array[6, 6] == 0
+
+
+def test_label_image_cache_invalidated_by_removed_segmentation(session):
+    session.records = [_create_record(7, 1, 1, 1), _create_record(8, 2, 5, 5)]
+    _get_label_image()
+    session.records = session.records[:1]
+    array = _get_label_image()
+    assert session.n_record_queries == 2
+    assert set(np.unique(array)) == {0, 1}
+
+
+def test_label_image_cache_invalidated_by_offset(session):
+    session.records = [_create_record(7, 1, 101, 201)]
+    _get_label_image(200, 100)
+    array = _get_label_image(201, 100)
+    assert session.n_record_queries == 2
+    assert array[0, 1] == 1
@@ -0,0 +1,104 @@
+from struct import unpack
+
+import numpy as np
+import pytest
+
+from tmlib.models.tile import ChannelLayerTile
+from tmlib.models.tile import calculate_pyramid_dimensions
+from tmlib.models.tile import calculate_pyramid_image_sizes
+
+
+def _create_tile(z, y, x, pixels):
+    tile = ChannelLayerTile(z=z, y=y, x=x, channel_layer_id=7)
+    tile._pixels = np.array(pixels, dtype=np.uint8)
+    return tile
+
+
+def test_write_copy_buffer():
+    tiles = [
+        _create_tile(3, 0, 1, [255, 216, 0]),
+        _create_tile(3, 2, 0, [1]),
+        _create_tile(4, 5, 6, [0, 10, 20, 30, 40])
+    ]
+    data = ChannelLayerTile._write_copy_buffer(tiles).read()
+
+    assert data[:11] == b'PGCOPY\n\xff\r\n\0'
+    assert unpack('!ii', data[11:19]) == (0, 0)
+    offset = 19
+    for tile in tiles:
+        n_fields = unpack('!h', data[offset:(offset + 2)])[0]
+        assert n_fields == 5
+        offset += 2
+        for value in (tile.channel_layer_id, tile.z, tile.y, tile.x):
+            assert unpack('!ii', data[offset:(offset + 8)]) == (4, value)
+            offset += 8
+        pixels = tile._pixels.tostring()
+        assert unpack('!i', data[offset:(offset + 4)])[0] == len(pixels)
+        offset += 4
+        assert data[offset:(offset + len(pixels))] == pixels
+        offset += len(pixels)
+    assert data[offset:] == b'\xff\xff'
+
+
+def test_write_copy_buffer_empty():
+    data = ChannelLayerTile._write_copy_buffer([]).read()
+    assert data == b'PGCOPY\n\xff\r\n\0' + b'\0' * 8 + b'\xff\xff'
+
+
+def test_write_copy_buffer_wrong_type():
+    with pytest.raises(TypeError):
+        ChannelLayerTile._write_copy_buffer([object()])
+
+
+class _RecordingConnection(object):
+
+    def __init__(self):
+        self.statements = list()
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+
+def test_bulk_add_chunks_tiles(monkeypatch):
+    monkeypatch.setattr(ChannelLayerTile, '_BULK_ADD_CHUNK_SIZE', 2)
+    tiles = [_create_tile(3, i, i + 1, [i]) for i in range(5)]
+    connection = _RecordingConnection()
+    ChannelLayerTile._bulk_add(connection, tiles)
+
+    assert len(connection.statements) == 3
+    for (sql, params), chunk in zip(
+            connection.statements, [tiles[0:2], tiles[2:4], tiles[4:5]]):
+        assert 'ON CONFLICT ON CONSTRAINT channel_layer_tiles_pkey' in sql
+        assert sql.count('(%s, %s, %s, %s, %s)') == len(chunk)
+        assert len(params) == 5 * len(chunk)
+        for j, tile in enumerate(chunk):
+            row = params[(j * 5):(j * 5 + 5)]
+            assert row[:4] == [tile.channel_layer_id, tile.z, tile.y, tile.x]
+            assert str(row[4].adapted) == tile._pixels.tostring()
+
+
+def test_bulk_add_empty():
+    connection = _RecordingConnection()
+    ChannelLayerTile._bulk_add(connection, [])
+    assert connection.statements == []
+
+
+def test_calculate_pyramid_image_sizes():
+    sizes = calculate_pyramid_image_sizes(1000, 600, 2, 256)
+    assert sizes == [(250, 150), (500, 300), (1000, 600)]
+
+
+def test_calculate_pyramid_image_sizes_rounds_up():
+    sizes = calculate_pyramid_image_sizes(3, 5, 2, 1)
+    assert sizes == [(1, 1), (1, 2), (2, 3), (3, 5)]
+
+
+def test_calculate_pyramid_image_sizes_single_tile():
+    # There is always at least one level below the base level
+    sizes = calculate_pyramid_image_sizes(100, 50, 2, 256)
+    assert sizes == [(50, 25), (100, 50)]
+
+
+def test_calculate_pyramid_dimensions():
+    dimensions = calculate_pyramid_dimensions(1000, 600, 2, 256)
+    assert dimensions == [(1, 1), (2, 2), (4, 3)]
@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import pytest
+
+from tmlib.models.tile import ChannelLayerTile
+from tmlib.models.tilestore import PackFileTileStore
+from tmlib.models.tilestore import TileRecord
+
+
+class _Layer(object):
+
+    def __init__(self, location):
+        self.id = 1
+        self.location = location
+        self.dimensions = [(1, 1), (2, 3)]
+
+
+@pytest.fixture
+def layer(tmpdir):
+    return _Layer(str(tmpdir.join('layer')))
+
+
+def _create_tile(z, y, x, pixels):
+    tile = ChannelLayerTile(z=z, y=y, x=x, channel_layer_id=1)
+    tile._pixels = np.array(pixels, dtype=np.uint8)
+    return tile
+
+
+def _write(layer, name, tiles=(), deleted=()):
+    with PackFileTileStore(None, layer, name=name) as store:
+        for t in tiles:
+            store.add(t)
+        for z, y, x in deleted:
+            store.delete(z, y, x)
+
+
+def _read(layer, z, coordinates):
+    store = PackFileTileStore(None, layer)
+    try:
+        tiles = store.get_tiles(z, coordinates)
+        return {k: str(v) for k, v in tiles.iteritems()}
+    finally:
+        store.close()
+
+
+def _pixels(values):
+    return np.array(values, dtype=np.uint8).tostring()
+
+
+def test_round_trip_several_writers(layer):
+    _write(layer, 'a', [
+        _create_tile(1, 0, 0, [1, 2]), _create_tile(0, 0, 0, [9])
+    ])
+    _write(layer, 'b', [_create_tile(1, 1, 2, [3, 4, 5])])
+    _write(layer, 'c', [_create_tile(1, 0, 1, [6])])
+    coordinates = [(y, x) for y in range(2) for x in range(3)]
+    assert _read(layer, 1, coordinates) == {
+        (0, 0): _pixels([1, 2]),
+        (1, 2): _pixels([3, 4, 5]),
+        (0, 1): _pixels([6]),
+    }
+    assert _read(layer, 0, [(0, 0)]) == {(0, 0): _pixels([9])}
+
+
+def test_round_trip_tile_records(layer):
+    _write(layer, 'a', [
+        TileRecord(1, 0, 2, _pixels([7, 8])), _create_tile(1, 1, 0, [4])
+    ])
+    assert _read(layer, 1, [(0, 2), (1, 0)]) == {
+        (0, 2): _pixels([7, 8]), (1, 0): _pixels([4])
+    }
+
+
+def test_round_trip_missing_level(layer):
+    _write(layer, 'a', [_create_tile(1, 0, 0, [1])])
+    assert _read(layer, 0, [(0, 0)]) == {}
+
+
+def test_later_writer_replaces_tile(layer):
+    _write(layer, 'a', [_create_tile(1, 0, 0, [1])])
+    _write(layer, 'b', [_create_tile(1, 0, 0, [2])])
+    assert _read(layer, 1, [(0, 0)]) == {(0, 0): _pixels([2])}
+
+
+def test_tombstone_hides_older_tile(layer):
+    _write(layer, 'a', [
+        _create_tile(1, 0, 0, [1]), _create_tile(1, 0, 1, [2])
+    ])
+    _write(layer, 'b', deleted=[(1, 0, 0)])
+    assert _read(layer, 1, [(0, 0), (0, 1)]) == {(0, 1): _pixels([2])}
+
+
+def test_tombstone_after_tile_of_same_writer(layer):
+    _write(layer, 'a', [_create_tile(1, 0, 0, [1])], deleted=[(1, 0, 0)])
+    assert _read(layer, 1, [(0, 0)]) == {}
+
+
+def test_reader_before_writer_is_closed(layer):
+    _write(layer, 'a', [_create_tile(1, 0, 0, [1])])
+    writer = PackFileTileStore(None, layer, name='b')
+    writer.add(_create_tile(1, 0, 1, [2]))
+    writer.flush()
+    # The segment of the writer doesn't exist yet
+    assert _read(layer, 1, [(0, 0), (0, 1)]) == {(0, 0): _pixels([1])}
+    writer.close()
+    assert _read(layer, 1, [(0, 0), (0, 1)]) == {
+        (0, 0): _pixels([1]), (0, 1): _pixels([2])
+    }
+
+
+def test_reader_keeps_index_until_closed(layer):
+    _write(layer, 'a', [_create_tile(1, 0, 0, [1])])
+    reader = PackFileTileStore(None, layer)
+    assert reader.get_tiles(1, [(0, 1)]) == {}
+    _write(layer, 'b', [_create_tile(1, 0, 1, [2])])
+    assert reader.get_tiles(1, [(0, 1)]) == {}
+    reader.close()
+    assert str(reader.get_tile(1, 0, 1)) == _pixels([2])
+    reader.close()
+
+
+def test_segment_with_same_time_as_index(layer):
+    _write(layer, 'a', [_create_tile(1, 0, 0, [1])])
+    assert _read(layer, 1, [(0, 1)]) == {}
+    _write(layer, 'b', [_create_tile(1, 0, 1, [2])])
+    # Simulates a coarse timestamp resolution of the file system
+    location = os.path.join(layer.location, 'z1')
+    mtime = os.path.getmtime(os.path.join(location, 'b.idx'))
+    os.utime(os.path.join(location, 'index.npy'), (mtime, mtime))
+    assert _read(layer, 1, [(0, 1)]) == {(0, 1): _pixels([2])}
+
+
+def test_clear(layer):
+    _write(layer, 'a', [_create_tile(1, 0, 0, [1])])
+    store = PackFileTileStore(None, layer)
+    assert store.get_tile(1, 0, 0) is not None
+    store.clear()
+    assert not os.path.exists(layer.location)
+    assert _read(layer, 1, [(0, 0)]) == {}
@@ -36,11 +36,82 @@ from tmlib.models.base import DistributedExperimentModel
 logger = logging.getLogger(__name__)
 
 
+def calculate_pyramid_image_sizes(height, width, zoom_factor, tile_size):
+    '''Calculates the size of the image at each level of a pyramid. Lower
+    levels get added until the image fits into a single tile, such that a
+    pyramid always has at least one level below the base level.
+
+    Parameters
+    ----------
+    height: int
+        number of pixels along the vertical axis at the base level
+    width: int
+        number of pixels along the horizontal axis at the base level
+    zoom_factor: int
+        factor by which resolution increases per level
+    tile_size: int
+        number of pixels along each axis of a tile
+
+    Returns
+    -------
+    List[Tuple[int]]
+        number of pixels along the vertical and horizontal axis at each
+        level; levels are sorted from the lowest to the highest resolution
+    '''
+    levels = [(height, width)]
+    while True:
+        height = int(np.ceil(np.float(height) / zoom_factor))
+        width = int(np.ceil(np.float(width) / zoom_factor))
+        levels.append((height, width))
+        if height <= tile_size and width <= tile_size:
+            break
+    return list(reversed(levels))
+
+
+def calculate_pyramid_dimensions(height, width, zoom_factor, tile_size):
+    '''Calculates the number of tiles at each level of a pyramid (see
+    :func:`calculate_pyramid_image_sizes
+    <tmlib.models.tile.calculate_pyramid_image_sizes>`).
+
+    Parameters
+    ----------
+    height: int
+        number of pixels along the vertical axis at the base level
+    width: int
+        number of pixels along the horizontal axis at the base level
+    zoom_factor: int
+        factor by which resolution increases per level
+    tile_size: int
+        number of pixels along each axis of a tile
+
+    Returns
+    -------
+    List[Tuple[int]]
+        number of tiles along the vertical and horizontal axis at each
+        level; levels are sorted from the lowest to the highest resolution
+    '''
+    sizes = calculate_pyramid_image_sizes(
+        height, width, zoom_factor, tile_size
+    )
+    return [
+        (
+            int(np.ceil(np.float(h) / tile_size)),
+            int(np.ceil(np.float(w) / tile_size))
+        )
+        for h, w in sizes
+    ]
+
+
 class ChannelLayerTile(DistributedExperimentModel):
 
     '''A *channel layer tile* is a component of an image pyramid. Each tile
     holds a single 2D 8-bit pixel plane with pre-defined dimensions.
 
+    Tiles that only consist of background pixels, e.g. in spacer regions
+    between wells and plates, are not stored. A missing tile is equivalent to
+    an empty tile (see :meth:`get_tile
+    <tmlib.models.channel.ChannelLayer.get_tile>`).
+
     '''
 
     __tablename__ = 'channel_layer_tiles'
@@ -53,6 +124,10 @@ class ChannelLayerTile(DistributedExperimentModel):
 
     __distribute_by__ = 'y'
 
+    #: int: maximal number of tiles that get inserted with a single statement
+    #: (see :meth:`_bulk_add`)
+    _BULK_ADD_CHUNK_SIZE = 100
+
     _pixels = Column('pixels', BYTEA)
 
     #: int: zero-based zoom level index
@@ -73,7 +148,8 @@ class ChannelLayerTile(DistributedExperimentModel):
     #: int: ID of parent channel layer
     channel_layer_id = Column(Integer, nullable=False)
 
-    def __init__(self, z, y, x, channel_layer_id, pixels=None):
+    def __init__(self, z, y, x, channel_layer_id, pixels=None, codec='jpeg',
+            quality=None):
         '''
         Parameters
         ----------
@@ -87,17 +163,33 @@ class ChannelLayerTile(DistributedExperimentModel):
             ID of the parent channel pyramid
         pixels: tmlib.image.PyramidTile, optional
             pixels array (default: ``None``)
+        codec: str, optional
+            name of the codec that should be used to encode `pixels`
+            (default: ``"jpeg"``)
+        quality: int, optional
+            quality of the encoding (defaults to the default quality of
+            `codec`)
+
+        Note
+        ----
+        The codec of the parent
+        :class:`ChannelLayer <tmlib.models.channel.ChannelLayer>` should be
+        used for all of its tiles.
         '''
         self.y = y
         self.x = x
         self.z = z
         self.channel_layer_id = channel_layer_id
+        self._codec = codec
+        self._quality = quality
         self.pixels = pixels
 
     @hybrid_property
     def pixels(self):
         '''tmlib.image.PyramidTile: pixel data and metadata'''
         # TODO: consider creating a custom SQLAlchemy column type
+        # NOTE: The codec is detected upon decoding, such that tiles of layers
+        # with different codecs can be read the same way.
         metadata = PyramidTileMetadata(
             z=self.z, y=self.y, x=self.x,
             channel_layer_id=self.channel_layer_id
@@ -117,7 +209,10 @@ class ChannelLayerTile(DistributedExperimentModel):
         # colocate tiles and mapobjects on the same shards to improve
         # performance of combined spatial queries.
         if value is not None:
-            self._pixels = value.jpeg_encode()
+            # Instances loaded from the database don't get initialized.
+            codec = getattr(self, '_codec', 'jpeg')
+            quality = getattr(self, '_quality', None)
+            self._pixels = value.encode(codec, quality)
         else:
             self._pixels = None
 
@@ -139,10 +234,86 @@ class ChannelLayerTile(DistributedExperimentModel):
         })
 
     @classmethod
-    def _bulk_ingest(cls, connection, instances):
-        # TODO: figure out how to COPY the binary pixel data
+    def _write_copy_buffer(cls, instances):
+        '''Writes tiles into a buffer in PostgreSQL binary COPY format.
+
+        Parameters
+        ----------
+        instances: List[tmlib.models.tile.ChannelLayerTile]
+            tiles
+
+        Returns
+        -------
+        io.BytesIO
+            buffer positioned at the beginning of the data
+        '''
+        f = BytesIO()
+        # Signature, flags field and length of header extension area
+        f.write(pack('!11sii', b'PGCOPY\n\xff\r\n\0', 0, 0))
         for obj in instances:
-            cls._add(connection, obj)
+            if not isinstance(obj, cls):
+                raise TypeError('Object must have type %s' % cls.__name__)
+            pixels = obj._pixels.tostring()
+            # Number of fields followed by length and value of each field
+            f.write(pack(
+                '!hiiiiiiiii', 5,
+                4, obj.channel_layer_id, 4, obj.z, 4, obj.y, 4, obj.x,
+                len(pixels)
+            ))
+            f.write(pixels)
+        # File trailer
+        f.write(pack('!h', -1))
+        f.seek(0)
+        return f
+
+    @classmethod
+    def _bulk_ingest(cls, connection, instances):
+        if not instances:
+            return
+        columns = ('channel_layer_id', 'z', 'y', 'x', 'pixels')
+        f = cls._write_copy_buffer(instances)
+        connection.copy_expert(
+            'COPY %s (%s) FROM STDIN WITH BINARY' % (
+                cls.__table__.name, ', '.join(columns)
+            ),
+            f
+        )
+        f.close()
+
+    @classmethod
+    def _bulk_add(cls, connection, instances):
+        '''Adds multiple records in the database, i.e. either inserts the
+        records or updates them in case they already exist.
+        Tiles are inserted with multi-row ``INSERT ... VALUES ... ON CONFLICT``
+        statements of up to :attr:`_BULK_ADD_CHUNK_SIZE` tiles each, which
+        are routed by the distributed database like single-row inserts.
+
+        Parameters
+        ----------
+        connection: tmlib.models.utils.ExperimentConnection
+            experiment-specific database connection
+        instances: List[tmlib.models.tile.ChannelLayerTile]
+            tiles
+        '''
+        n = cls._BULK_ADD_CHUNK_SIZE
+        for i in range(0, len(instances), n):
+            chunk = instances[i:(i + n)]
+            values = list()
+            for obj in chunk:
+                if not isinstance(obj, cls):
+                    raise TypeError('Object must have type %s' % cls.__name__)
+                values.extend([
+                    obj.channel_layer_id, obj.z, obj.y, obj.x,
+                    psycopg2.Binary(obj._pixels.tostring())
+                ])
+            connection.execute('''
+                INSERT INTO channel_layer_tiles AS t (
+                    channel_layer_id, z, y, x, pixels
+                )
+                VALUES %s
+                ON CONFLICT ON CONSTRAINT channel_layer_tiles_pkey
+                DO UPDATE SET pixels = EXCLUDED.pixels
+            ''' % ', '.join(['(%s, %s, %s, %s, %s)'] * len(chunk)), values)
 
     def __repr__(self):
         return '<%s(z=%r, y=%r, x=%r, channel_layer_id=%r)>' % (
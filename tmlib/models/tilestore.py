@@ -0,0 +1,507 @@
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Storage backends for the encoded pixels of
+:class:`ChannelLayerTile <tmlib.models.tile.ChannelLayerTile>` instances.
+
+Tiles are either stored in the ``channel_layer_tiles`` database table
+(:class:`DatabaseTileStore <tmlib.models.tilestore.DatabaseTileStore>`) or in
+append-only pack files on the shared file system
+(:class:`PackFileTileStore <tmlib.models.tilestore.PackFileTileStore>`).
+The backend is selected per layer via :attr:`tile_backend
+<tmlib.models.channel.ChannelLayer.tile_backend>`.
+Tiles of previous runs that became empty get deleted from a store, since
+empty tiles are not stored.
+Raster tiles of a :class:`SegmentationLayer
+<tmlib.models.mapobject.SegmentationLayer>` are always stored in pack files
+as :class:`TileRecord <tmlib.models.tilestore.TileRecord>` instances.
+'''
+import os
+import mmap
+import socket
+import logging
+import collections
+from abc import ABCMeta
+from abc import abstractmethod
+import numpy as np
+
+from tmlib.models.tile import ChannelLayerTile
+from tmlib.models.utils import delete_location
+
+logger = logging.getLogger(__name__)
+
+#: Model-neutral tile for a :class:`PackFileTileStore
+#: <tmlib.models.tilestore.PackFileTileStore>`: zero-based zoom level, row
+#: and column index and encoded pixels
+TileRecord = collections.namedtuple('TileRecord', ['z', 'y', 'x', 'pixels'])
+
+
+class TileStore(object):
+
+    '''Abstract base class for a store of pyramid tiles of a
+    :class:`ChannelLayer <tmlib.models.channel.ChannelLayer>`.
+
+    Tiles are added to a buffer and written in bulk once the buffer is full
+    or when the store gets closed. Deletions of tiles are buffered the same
+    way and applied after buffered tiles have been written.
+    '''
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, session, layer, assume_clean_state=False, name=None,
+            buffer_size=1000):
+        '''
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        layer: tmlib.models.channel.ChannelLayer
+            channel layer whose tiles are stored
+        assume_clean_state: bool, optional
+            assume that tiles don't exist yet, which allows inserting them
+            directly rather than updating potentially existing ones
+            (default: ``False``)
+        name: str, optional
+            name of the writer that is unique among concurrent writers
+            (defaults to host name and process ID)
+        buffer_size: int, optional
+            number of tiles that should be written at once
+            (default: ``1000``)
+        '''
+        self._session = session
+        self.layer_id = layer.id
+        self.assume_clean_state = assume_clean_state
+        if name is None:
+            name = '%s-%d' % (socket.gethostname(), os.getpid())
+        self.name = name
+        self._buffer_size = buffer_size
+        self._tiles = list()
+        self._deleted = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, except_type, except_value, except_trace):
+        if except_value is None:
+            self.flush()
+        self.close()
+
+    def add(self, tile):
+        '''Adds a tile to the store.
+
+        Parameters
+        ----------
+        tile: Union[tmlib.models.tile.ChannelLayerTile, tmlib.models.tilestore.TileRecord]
+            tile with encoded pixels; records are only supported by stores
+            that write pack files
+        '''
+        self._tiles.append(tile)
+        if len(self._tiles) >= self._buffer_size:
+            self.flush()
+
+    def delete(self, z, y, x):
+        '''Deletes a tile from the store. This is required when a tile that
+        was created by a previous run only consists of background pixels now,
+        because empty tiles are not stored and would otherwise keep their
+        previous pixels.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y: int
+            zero-based row index
+        x: int
+            zero-based column index
+
+        Note
+        ----
+        Deleting a tile that doesn't exist has no effect.
+        '''
+        self._deleted.append((z, y, x))
+        if len(self._deleted) >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        '''Writes all buffered tiles and applies buffered deletions.'''
+        if self._tiles:
+            logger.debug('write %d tiles', len(self._tiles))
+            self._write(self._tiles)
+            self._tiles = list()
+        if self._deleted:
+            logger.debug('delete %d tiles', len(self._deleted))
+            self._delete(self._deleted)
+            self._deleted = list()
+
+    def close(self):
+        '''Releases resources held by the store.'''
+        pass
+
+    @abstractmethod
+    def _write(self, tiles):
+        pass
+
+    @abstractmethod
+    def _delete(self, coordinates):
+        pass
+
+    @abstractmethod
+    def get_tiles(self, z, coordinates):
+        '''Gets the encoded pixels of several tiles of the same zoom level.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        coordinates: List[Tuple[int]]
+            row, column coordinates of tiles
+
+        Returns
+        -------
+        Dict[Tuple[int], buffer]
+            encoded pixels of each existing tile hashable by row, column
+            coordinates; tiles that only consist of background pixels are
+            not stored
+        '''
+        pass
+
+    def get_tile(self, z, y, x):
+        '''Gets the encoded pixels of a single tile.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y: int
+            zero-based row index
+        x: int
+            zero-based column index
+
+        Returns
+        -------
+        Union[buffer, None]
+            encoded pixels or ``None`` if the tile doesn't exist
+        '''
+        return self.get_tiles(z, [(y, x)]).get((y, x))
+
+    @abstractmethod
+    def clear(self):
+        '''Removes all tiles of the layer.'''
+        pass
+
+
+class DatabaseTileStore(TileStore):
+
+    '''Store that keeps tiles in the distributed ``channel_layer_tiles``
+    table.
+    '''
+
+    def _write(self, tiles):
+        if self.assume_clean_state:
+            self._session.bulk_ingest(tiles)
+        else:
+            self._session.add_all(tiles)
+
+    def _delete(self, coordinates):
+        # Tiles are distributed by row, such that each statement only
+        # affects a single shard.
+        columns = collections.defaultdict(list)
+        for z, y, x in coordinates:
+            columns[(z, y)].append(x)
+        for (z, y), x in columns.iteritems():
+            self._session.query(ChannelLayerTile).\
+                filter(
+                    ChannelLayerTile.channel_layer_id == self.layer_id,
+                    ChannelLayerTile.z == z,
+                    ChannelLayerTile.y == y,
+                    ChannelLayerTile.x.in_(x)
+                ).\
+                delete(synchronize_session=False)
+
+    def get_tiles(self, z, coordinates):
+        if len(coordinates) == 0:
+            return dict()
+        rows = [c[0] for c in coordinates]
+        cols = [c[1] for c in coordinates]
+        # Requested tiles usually form a contiguous block, so filtering by
+        # range and discarding superfluous tiles client-side is cheaper than
+        # a large IN list of tuples.
+        wanted = set(tuple(c) for c in coordinates)
+        records = self._session.query(
+                ChannelLayerTile.y, ChannelLayerTile.x,
+                ChannelLayerTile._pixels
+            ).\
+            filter(
+                ChannelLayerTile.channel_layer_id == self.layer_id,
+                ChannelLayerTile.z == z,
+                ChannelLayerTile.y.between(min(rows), max(rows)),
+                ChannelLayerTile.x.between(min(cols), max(cols))
+            ).\
+            all()
+        return {
+            (r.y, r.x): r._pixels for r in records if (r.y, r.x) in wanted
+        }
+
+    def clear(self):
+        self._session.query(ChannelLayerTile).\
+            filter_by(channel_layer_id=self.layer_id).\
+            delete()
+
+
+class PackFileTileStore(TileStore):
+
+    '''Store that appends tiles to pack files on the shared file system.
+
+    Each writer creates one pack file per zoom level, which holds the
+    concatenated encoded pixels of its tiles, together with an index segment
+    that records *y*, *x*, offset and length of each tile. Upon the first read
+    of a zoom level, segments get consolidated into a dense index with one
+    entry per tile position, which is memory-mapped, such that the bytes of
+    a tile can be served from the memory-mapped pack file without copying.
+
+    Deleted tiles are recorded in the index segment with zero length, which
+    hides tiles at the same position in segments of writers whose names sort
+    before the name of the deleting writer.
+
+    Any layer that provides :attr:`location` and :attr:`dimensions` can be
+    stored this way, which is also used for raster tiles of a
+    :class:`SegmentationLayer <tmlib.models.mapobject.SegmentationLayer>`.
+    Tiles can be added either as :class:`ChannelLayerTile
+    <tmlib.models.tile.ChannelLayerTile>` or as :class:`TileRecord
+    <tmlib.models.tilestore.TileRecord>` instances.
+
+    Note
+    ----
+    Concurrent writers must use different names. Zoom levels must be
+    completely written before they are read.
+    '''
+
+    #: numpy.dtype: record of an index segment
+    SEGMENT_DTYPE = np.dtype([
+        ('y', '<i4'), ('x', '<i4'), ('offset', '<i8'), ('length', '<i4')
+    ])
+
+    #: numpy.dtype: entry of the dense index of a zoom level; `length` is
+    #: zero for missing tiles
+    INDEX_DTYPE = np.dtype([
+        ('pack', '<i4'), ('offset', '<i8'), ('length', '<i4')
+    ])
+
+    def __init__(self, session, layer, assume_clean_state=False, name=None,
+            buffer_size=1000):
+        super(PackFileTileStore, self).__init__(
+            session, layer, assume_clean_state, name, buffer_size
+        )
+        self.location = layer.location
+        self._dimensions = layer.dimensions
+        self._writers = dict()
+        self._levels = dict()
+        self._packs = dict()
+
+    def _get_level_location(self, z):
+        return os.path.join(self.location, 'z%d' % z)
+
+    def _get_writer(self, z):
+        if z not in self._writers:
+            location = self._get_level_location(z)
+            if not os.path.exists(location):
+                try:
+                    os.makedirs(location)
+                except OSError:
+                    # Directory may have been created concurrently
+                    if not os.path.isdir(location):
+                        raise
+            filename = os.path.join(location, '%s.pack' % self.name)
+            logger.debug('open pack file: %s', filename)
+            self._writers[z] = (open(filename, 'wb'), list())
+        return self._writers[z]
+
+    def _write(self, tiles):
+        for t in tiles:
+            f, records = self._get_writer(t.z)
+            if isinstance(t, TileRecord):
+                pixels = t.pixels
+            else:
+                pixels = t._pixels.tostring()
+            records.append((t.y, t.x, f.tell(), len(pixels)))
+            f.write(pixels)
+
+    def _delete(self, coordinates):
+        # A record without bytes is a tombstone (see get_tiles()).
+        for z, y, x in coordinates:
+            f, records = self._get_writer(z)
+            records.append((y, x, f.tell(), 0))
+
+    def close(self):
+        for z, (f, records) in self._writers.iteritems():
+            f.close()
+            # The segment gets written last and atomically, such that a
+            # segment only exists once the pack file is complete.
+            location = self._get_level_location(z)
+            filename = os.path.join(location, '%s.idx' % self.name)
+            tmp_filename = '%s.%s.tmp' % (filename, os.getpid())
+            with open(tmp_filename, 'wb') as fs:
+                np.array(records, dtype=self.SEGMENT_DTYPE).tofile(fs)
+            os.rename(tmp_filename, filename)
+        self._writers = dict()
+        for mm, f in self._packs.itervalues():
+            mm.close()
+            f.close()
+        self._packs = dict()
+        self._levels = dict()
+
+    def _consolidate(self, z):
+        '''Merges the index segments of a zoom level into a dense index.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        '''
+        location = self._get_level_location(z)
+        names = sorted(
+            f[:-4] for f in os.listdir(location) if f.endswith('.idx')
+        )
+        logger.debug(
+            'consolidate %d index segments of zoom level %d', len(names), z
+        )
+        index = np.zeros(self._dimensions[z], dtype=self.INDEX_DTYPE)
+        for i, name in enumerate(names):
+            segment = np.fromfile(
+                os.path.join(location, '%s.idx' % name),
+                dtype=self.SEGMENT_DTYPE
+            )
+            positions = (segment['y'], segment['x'])
+            index['pack'][positions] = i
+            index['offset'][positions] = segment['offset']
+            index['length'][positions] = segment['length']
+        # Readers may consolidate concurrently; each one writes the same
+        # content and replaces the files atomically.
+        suffix = '%s-%d.tmp' % (socket.gethostname(), os.getpid())
+        packs_filename = os.path.join(location, 'packs.txt')
+        with open('%s.%s' % (packs_filename, suffix), 'w') as f:
+            f.write('\n'.join(names))
+        os.rename('%s.%s' % (packs_filename, suffix), packs_filename)
+        index_filename = os.path.join(location, 'index.npy')
+        with open('%s.%s' % (index_filename, suffix), 'wb') as f:
+            np.save(f, index)
+        os.rename('%s.%s' % (index_filename, suffix), index_filename)
+
+    def _open_level(self, z):
+        '''Opens the memory-mapped index of a zoom level.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+
+        Returns
+        -------
+        Tuple[numpy.memmap, List[str]]
+            dense index and names of pack files, or ``None`` if no tiles
+            were written for the zoom level
+        '''
+        if z in self._levels:
+            return self._levels[z]
+        location = self._get_level_location(z)
+        if not os.path.exists(location):
+            self._levels[z] = None
+            return None
+        index_filename = os.path.join(location, 'index.npy')
+        segment_mtimes = [
+            os.path.getmtime(os.path.join(location, f))
+            for f in os.listdir(location) if f.endswith('.idx')
+        ]
+        # Segments written within the timestamp resolution of the file
+        # system after consolidation have the same time as the index.
+        if (not os.path.exists(index_filename) or
+                os.path.getmtime(index_filename) <=
+                max(segment_mtimes + [0])):
+            self._consolidate(z)
+        index = np.load(index_filename, mmap_mode='r')
+        with open(os.path.join(location, 'packs.txt')) as f:
+            names = f.read().split('\n')
+        self._levels[z] = (index, names)
+        return self._levels[z]
+
+    def _get_pack(self, z, name):
+        key = (z, name)
+        if key not in self._packs:
+            filename = os.path.join(
+                self._get_level_location(z), '%s.pack' % name
+            )
+            f = open(filename, 'rb')
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._packs[key] = (mm, f)
+        return self._packs[key][0]
+
+    def get_tiles(self, z, coordinates):
+        level = self._open_level(z)
+        if level is None:
+            return dict()
+        index, names = level
+        tiles = dict()
+        for y, x in coordinates:
+            entry = index[y, x]
+            if entry['length'] == 0:
+                continue
+            mm = self._get_pack(z, names[entry['pack']])
+            tiles[(y, x)] = buffer(
+                mm, int(entry['offset']), int(entry['length'])
+            )
+        return tiles
+
+    def clear(self):
+        self.close()
+        delete_location(self.location)
+
+
+#: Dict[str, type]: implementations of
+#: :class:`TileStore <tmlib.models.tilestore.TileStore>` hashable by name
+TILE_STORE_BACKENDS = {
+    'database': DatabaseTileStore,
+    'packfile': PackFileTileStore
+}
+
+
+def create_tile_store(session, layer_id, assume_clean_state=False, name=None):
+    '''Creates a store for the tiles of a channel layer using the backend of
+    the layer.
+
+    Parameters
+    ----------
+    session: tmlib.models.utils.ExperimentSession
+        experiment-specific database session
+    layer_id: int
+        ID of the :class:`ChannelLayer <tmlib.models.channel.ChannelLayer>`
+    assume_clean_state: bool, optional
+        assume that tiles don't exist yet (default: ``False``)
+    name: str, optional
+        name of the writer that is unique among concurrent writers
+
+    Returns
+    -------
+    tmlib.models.tilestore.TileStore
+        store
+    '''
+    from tmlib.models.channel import ChannelLayer
+    layer = session.query(ChannelLayer).get(layer_id)
+    backend = layer.tile_backend or 'database'
+    if backend not in TILE_STORE_BACKENDS:
+        raise ValueError('Unknown tile store backend "%s".' % backend)
+    logger.debug('use "%s" tile store for layer %d', backend, layer_id)
+    return TILE_STORE_BACKENDS[backend](
+        session, layer, assume_clean_state, name
+    )
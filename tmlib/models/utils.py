@@ -575,6 +575,41 @@ class _SQLAlchemy_Session(object):
         with connection.connection.cursor() as c:
             cls._bulk_ingest(c, instances)
 
+    def bulk_ingest_frame(self, model, data, **kwargs):
+        '''Ingests the rows of a data frame into the table of a distributed
+        model class in bulk without creating model instances.
+
+        Parameters
+        ----------
+        model: class
+            distributed model class derived from
+            :class:`DistributedExperimentModel
+            <tmlib.models.base.DistributedExperimentModel>` that implements
+            ``_bulk_ingest_frame()``
+        data: pandas.DataFrame
+            data that should be ingested; the expected layout depends on
+            `model`
+        **kwargs: dict
+            additional model-specific arguments (see e.g.
+            :meth:`FeatureValues._bulk_ingest_frame
+            <tmlib.models.feature.FeatureValues._bulk_ingest_frame>`)
+        '''
+        if not issubclass(model, DistributedExperimentModel):
+            raise TypeError(
+                'Bulk ingestion is only supported for model classes derived '
+                'from "%s"' % DistributedExperimentModel.__name__
+            )
+        if not hasattr(model, '_bulk_ingest_frame'):
+            raise TypeError(
+                'Model class "%s" doesn\'t support ingestion of data frames.'
+                % model.__name__
+            )
+        if data.empty:
+            return
+        connection = self._session.get_bind()
+        with connection.connection.cursor() as c:
+            model._bulk_ingest_frame(c, data, **kwargs)
+
     def add(self, instance):
         '''Adds an instance of a model class.
 
@@ -591,7 +626,7 @@ class _SQLAlchemy_Session(object):
         else:
             self._session.add(instance)
 
-    def add_all(self, instance):
+    def add_all(self, instances):
         '''Adds multiple instances of a model class.
 
         Parameters
@@ -602,6 +637,11 @@ class _SQLAlchemy_Session(object):
         Warning
         -------
         Assumes that all instances are of the same model class.
+
+        Note
+        ----
+        Distributed model classes may implement a ``_bulk_add`` method to
+        add all instances at once. Otherwise instances are added one by one.
         '''
         if len(instances) == 0:
             return
@@ -610,10 +650,13 @@ class _SQLAlchemy_Session(object):
         if isinstance(inst, DistributedExperimentModel):
             connection = self._session.get_bind()
             with connection.connection.cursor() as c:
-                for i in instances:
-                    cls._add(c, i)
+                if hasattr(cls, '_bulk_add'):
+                    cls._bulk_add(c, instances)
+                else:
+                    for i in instances:
+                        cls._add(c, i)
         else:
-            self._session.add_all(instance)
+            self._session.add_all(instances)
 
 class _Session(object):
 
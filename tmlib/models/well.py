@@ -25,6 +25,7 @@ from sqlalchemy.orm import relationship, backref
 
 from tmlib import utils
 from tmlib.models.base import ExperimentModel, DateMixIn, IdMixIn
+from tmlib.models.layout import get_experiment_layout
 
 
 logger = logging.getLogger(__name__)
@@ -202,7 +203,15 @@ class Well(ExperimentModel, DateMixIn, IdMixIn):
     def offset(self):
         '''Tuple[int]: *y*, *x* coordinate of the top, left corner of the site
         relative to the layer overview at the maximum zoom level
+
+        Note
+        ----
+        Delegates to the :class:`ExperimentLayout
+        <tmlib.models.layout.ExperimentLayout>` of the session if available.
         '''
+        layout = get_experiment_layout(self)
+        if layout is not None and layout.has_well(self.id):
+            return layout.get_well_offset(self.id)
         logger.debug('calculate offset of well %d', self.id)
         plate = self.plate
         n_rows = plate.nonempty_rows.index(self.y)
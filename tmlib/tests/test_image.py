@@ -0,0 +1,298 @@
+import cv2
+import numpy as np
+import pytest
+import shapely.geometry
+import skimage.draw
+
+from tmlib.image import ChannelImage
+from tmlib.image import IllumstatsContainer
+from tmlib.image import IllumstatsImage
+from tmlib.image import Image
+from tmlib.image import ImagePreprocessor
+from tmlib.image import PyramidTile
+from tmlib.image import SegmentationImage
+from tmlib.metadata import ChannelImageMetadata
+from tmlib.metadata import IllumstatsImageMetadata
+
+
+def _extract_polygons(array, y_offset=0, x_offset=0):
+    image = SegmentationImage(array.astype(np.int32))
+    return dict(image.extract_polygons(y_offset, x_offset))
+
+
+def test_extract_polygons_object_removed_by_opening():
+    # The object vanishes upon morphological opening, such that no contour
+    # gets traced. It's represented by a square around its centroid.
+    array = np.zeros((10, 10))
+    array[3, 4:6] = 1
+    polygons = _extract_polygons(array)
+    assert polygons[1].bounds == (3, -4, 5, -2)
+
+
+def test_extract_polygons_object_removed_by_opening_with_offset():
+    array = np.zeros((10, 10))
+    array[3, 4:6] = 1
+    polygons = _extract_polygons(array, y_offset=100, x_offset=200)
+    assert polygons[1].bounds == (203, -104, 205, -102)
+
+
+def test_extract_polygons_single_pixel_object():
+    # The contour of a single pixel doesn't have enough coordinates for a
+    # polygon. It's represented by a square around the center of its
+    # bounding box.
+    array = np.zeros((10, 10))
+    array[5, 6] = 1
+    polygons = _extract_polygons(array)
+    assert polygons[1].bounds == (5, -6, 7, -4)
+
+
+def test_extract_polygons_fallbacks_keep_all_objects():
+    array = np.zeros((10, 10))
+    array[3, 4:6] = 1
+    array[6:9, 1:4] = 2
+    array[5, 8] = 3
+    polygons = _extract_polygons(array)
+    assert sorted(polygons) == [1, 2, 3]
+    assert polygons[2].bounds == (1, -8, 3, -6)
+
+
+def _create_from_polygons_with_skimage(polygons, y_offset, x_offset,
+        dimensions):
+    # Previous implementation, which rasterized polygons one by one
+    array = np.zeros(dimensions, dtype=np.int32)
+    for label, poly in polygons:
+        coordinates = np.array(poly.exterior.coords).astype(int)
+        x, y = np.split(coordinates, 2, axis=1)
+        y *= -1
+        x -= x_offset
+        y -= y_offset
+        y, x = skimage.draw.polygon(y, x, dimensions)
+        array[y, x] = label
+    return array
+
+
+POLYGONS = [
+    (1, shapely.geometry.box(102, -208, 107, -203)),
+    (2, shapely.geometry.Polygon([
+        (115, -201), (118, -204), (115, -207), (112, -204)
+    ])),
+    (3, shapely.geometry.Polygon([(103, -211), (110, -211), (103, -218)]))
+]
+
+
+def test_create_from_polygons_rectangle():
+    image = SegmentationImage.create_from_polygons(
+        POLYGONS[:1], 200, 100, (20, 20)
+    )
+    expected = np.zeros((20, 20), dtype=np.int32)
+    expected[3:9, 2:8] = 1
+    np.testing.assert_array_equal(image.array, expected)
+
+
+def test_create_from_polygons_matches_skimage_within_contours():
+    image = SegmentationImage.create_from_polygons(
+        POLYGONS, 200, 100, (20, 20)
+    )
+    expected = _create_from_polygons_with_skimage(
+        POLYGONS, 200, 100, (20, 20)
+    )
+    # Pixels on the contour now belong to the object, all others are equal
+    contours = image.extract_outlines() > 0
+    assert np.all(image.array[~contours] == expected[~contours])
+    assert np.all(expected[expected > 0] == image.array[expected > 0])
+    for label, _ in POLYGONS:
+        area = np.sum(image.array == label)
+        expected_area = np.sum(expected == label)
+        n_contour_pixels = np.sum(contours & (image.array == label))
+        assert expected_area <= area <= expected_area + n_contour_pixels
+
+
+def _create_gradient(dtype, step=1):
+    # Smooth content, such that lossy codecs reproduce it closely
+    values = np.add.outer(np.arange(64), np.arange(64)) * step
+    return values.astype(dtype)
+
+
+@pytest.mark.parametrize('dtype,step', [(np.uint8, 2), (np.uint16, 500)])
+def test_encode_png_round_trip(dtype, step):
+    array = _create_gradient(dtype, step)
+    buf = PyramidTile(array).encode('png')
+    tile = PyramidTile.create_from_binary(buf.tostring())
+    assert tile.array.dtype == dtype
+    np.testing.assert_array_equal(tile.array, array)
+
+
+@pytest.mark.parametrize('codec', ['jpeg', 'webp'])
+def test_encode_lossy_round_trip(codec):
+    array = _create_gradient(np.uint8)
+    buf = PyramidTile(array).encode(codec)
+    tile = PyramidTile.create_from_binary(buf.tostring())
+    assert tile.array.dtype == np.uint8
+    assert tile.dimensions == array.shape
+    diff = np.abs(tile.array.astype(np.int32) - array.astype(np.int32))
+    assert np.mean(diff) <= 2
+
+
+@pytest.mark.parametrize('codec', ['jpeg', 'webp'])
+def test_encode_lossy_quality(codec):
+    array = np.random.RandomState(0).randint(0, 256, (64, 64))
+    tile = PyramidTile(array.astype(np.uint8))
+    assert len(tile.encode(codec, 10)) < len(tile.encode(codec, 95))
+
+
+def test_encode_display_mapped_high_bit_depth_tile():
+    array = _create_gradient(np.uint16, 500)
+    lut = PyramidTile.create_display_lut(0, 2**16 - 1)
+    buf = PyramidTile(array).map_to_display(lut).encode('jpeg')
+    tile = PyramidTile.create_from_binary(buf.tostring())
+    assert tile.array.dtype == np.uint8
+
+
+def test_encode_unknown_codec():
+    tile = PyramidTile(_create_gradient(np.uint8))
+    with pytest.raises(ValueError):
+        tile.encode('gif')
+
+
+def test_register_codec(monkeypatch):
+    monkeypatch.setattr(PyramidTile, 'CODECS', dict(PyramidTile.CODECS))
+    PyramidTile.register_codec(
+        'jpg', '.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY, 90
+    )
+    assert PyramidTile.CODECS['jpg']['quality'] == 90
+    tile = PyramidTile(_create_gradient(np.uint8))
+    buf = tile.encode('jpg')
+    assert buf.tostring() == tile.encode('jpeg', 90).tostring()
+
+
+def test_create_display_lut_bounds():
+    lut = PyramidTile.create_display_lut(100, 1100)
+    assert lut.dtype == np.uint8
+    assert lut.shape == (2**16,)
+    assert np.all(lut[:101] == 0)
+    assert np.all(lut[1100:] == 255)
+    assert lut[600] == 127
+
+
+def test_create_display_lut_monotonic():
+    lut = PyramidTile.create_display_lut(100, 1100)
+    assert np.all(np.diff(lut.astype(np.int32)) >= 0)
+
+
+def test_create_display_lut_full_range():
+    lut = PyramidTile.create_display_lut(0, 2**16 - 1)
+    assert lut[0] == 0
+    assert lut[2**16 - 1] == 255
+
+
+def test_create_display_lut_adjacent_bounds():
+    lut = PyramidTile.create_display_lut(10, 11)
+    assert lut[10] == 0
+    assert np.all(lut[11:] == 255)
+
+
+@pytest.mark.parametrize('lower,upper', [(10, 10), (11, 10)])
+def test_create_display_lut_invalid_bounds(lower, upper):
+    with pytest.raises(ValueError):
+        PyramidTile.create_display_lut(lower, upper)
+
+
+def test_map_to_display():
+    lut = PyramidTile.create_display_lut(100, 1100)
+    array = np.array([[0, 100, 600], [1100, 5000, 2**16 - 1]], np.uint16)
+    tile = PyramidTile(array).map_to_display(lut)
+    assert tile.array.dtype == np.uint8
+    np.testing.assert_array_equal(tile.array, [[0, 0, 127], [255, 255, 255]])
+
+
+def test_map_to_display_uint8():
+    lut = PyramidTile.create_display_lut(100, 1100)
+    tile = PyramidTile(_create_gradient(np.uint8))
+    assert tile.map_to_display(lut) is tile
+
+
+def _create_channel_image():
+    random = np.random.RandomState(1)
+    array = random.randint(200, 3000, (40, 50)).astype(np.uint16)
+    metadata = ChannelImageMetadata(
+        channel_id=1, site_id=1, cycle_id=1, tpoint=0, zplane=0
+    )
+    metadata.y_shift = 2
+    metadata.x_shift = -1
+    metadata.top_residue = 3
+    metadata.bottom_residue = 1
+    metadata.left_residue = 0
+    metadata.right_residue = 2
+    return ChannelImage(array, metadata)
+
+
+def _create_stats():
+    y, x = np.mgrid[0:40, 0:50]
+    mean = 2.8 + 0.002 * y + 0.001 * x
+    std = 0.2 + 0.001 * x
+    return IllumstatsContainer(
+        IllumstatsImage(mean, IllumstatsImageMetadata(1)),
+        IllumstatsImage(std, IllumstatsImageMetadata(1)),
+        {}
+    )
+
+
+def _preprocess_in_steps(image, stats, clip_range, crop):
+    # Previous path: correct, then rescale, then shift and crop
+    md = image.metadata
+    array = image.array
+    if stats is not None:
+        array = Image._correct_illumination(
+            array, stats.mean.array, stats.std.array
+        )
+    if clip_range is not None:
+        array = Image._map_to_uint8(array, *clip_range)
+    return Image._shift_and_crop(
+        array, md.y_shift, md.x_shift, md.bottom_residue, md.top_residue,
+        md.right_residue, md.left_residue, crop
+    )
+
+
+def _assert_matches_steps(stats, clip_range, crop):
+    expected = _preprocess_in_steps(
+        _create_channel_image(), stats, clip_range, crop
+    )
+    preprocessor = ImagePreprocessor(stats, clip_range, align=True, crop=crop)
+    image = preprocessor.process(_create_channel_image())
+    assert image.array.dtype == expected.dtype
+    assert image.array.shape == expected.shape
+    # Intermediate results are no longer truncated to integers
+    diff = image.array.astype(np.int64) - expected.astype(np.int64)
+    assert np.max(np.abs(diff)) <= 1
+    return image
+
+
+@pytest.mark.parametrize('crop', [True, False])
+def test_image_preprocessor_matches_steps(crop):
+    image = _assert_matches_steps(_create_stats(), (300, 2800), crop)
+    md = image.metadata
+    assert md.is_corrected and md.is_rescaled and md.is_aligned
+
+
+def test_image_preprocessor_matches_steps_without_stats():
+    image = _assert_matches_steps(None, (300, 2800), True)
+    assert not image.metadata.is_corrected
+
+
+def test_image_preprocessor_matches_steps_without_clip_range():
+    image = _assert_matches_steps(_create_stats(), None, True)
+    assert image.array.dtype == np.uint16
+    assert not image.metadata.is_rescaled
+
+
+def test_image_preprocessor_aligned_shape():
+    preprocessor = ImagePreprocessor(align=True)
+    image = preprocessor.process(_create_channel_image())
+    assert image.dimensions == (36, 48)
+
+
+def test_image_preprocessor_channel_mismatch():
+    image = _create_channel_image()
+    image.metadata.channel_id = 2
+    with pytest.raises(ValueError):
+        ImagePreprocessor(_create_stats()).process(image)
@@ -0,0 +1,67 @@
+from tmlib.utils import LRUCache
+
+
+def test_lru_cache_evicts_least_recently_put():
+    cache = LRUCache(max_bytes=30)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    cache.put('c', 3, 10)
+    cache.put('d', 4, 10)
+    assert 'a' not in cache
+    assert [cache.get(k) for k in ('b', 'c', 'd')] == [2, 3, 4]
+    assert cache.n_bytes == 30
+
+
+def test_lru_cache_get_marks_most_recently_used():
+    cache = LRUCache(max_bytes=30)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    cache.put('c', 3, 10)
+    cache.get('a')
+    cache.put('d', 4, 10)
+    assert 'b' not in cache
+    assert 'a' in cache
+    cache.put('e', 5, 10)
+    assert 'c' not in cache
+    assert 'a' in cache
+
+
+def test_lru_cache_evicts_until_size_bound_is_respected():
+    cache = LRUCache(max_bytes=30)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    cache.put('c', 3, 10)
+    cache.put('d', 4, 25)
+    assert len(cache) == 1
+    assert cache.get('d') == 4
+    assert cache.n_bytes == 25
+
+
+def test_lru_cache_replaces_value_of_existing_key():
+    cache = LRUCache(max_bytes=30)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    cache.put('a', 3, 15)
+    assert cache.get('a') == 3
+    assert cache.n_bytes == 25
+    cache.put('c', 4, 10)
+    assert 'b' not in cache
+    assert cache.n_bytes == 25
+
+
+def test_lru_cache_skips_values_larger_than_size_bound():
+    cache = LRUCache(max_bytes=30)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 31)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.n_bytes == 10
+
+
+def test_lru_cache_clear():
+    cache = LRUCache(max_bytes=30)
+    cache.put('a', 1, 10)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.n_bytes == 0
+    assert cache.get('a', 'missing') == 'missing'
@@ -21,6 +21,8 @@ import datetime
 import re
 import os
 import inspect
+import threading
+import collections
 from decorator import decorator
 from types import *
 import logging
@@ -522,6 +524,98 @@ class autocreate_directory_property(object):
         return value
 
 
+class LRUCache(object):
+
+    '''Thread-safe mapping with a memory budget that evicts the least
+    recently used items once the total size of the cached values exceeds
+    the budget.
+
+    Examples
+    --------
+    .. code:: python
+
+        from tmlib.utils import LRUCache
+
+        cache = LRUCache(max_bytes=1024**3)
+        cache.put('a', array, array.nbytes)
+        if 'a' in cache:
+            array = cache.get('a')
+    '''
+
+    def __init__(self, max_bytes):
+        '''
+        Parameters
+        ----------
+        max_bytes: int
+            maximal total size of cached values in bytes
+        '''
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def get(self, key, default=None):
+        '''Gets a cached value and marks it as most recently used.
+
+        Parameters
+        ----------
+        key: hashable
+            key of the value
+        default: optional
+            value that should be returned if `key` is not cached
+            (default: ``None``)
+
+        Returns
+        -------
+        cached value or `default`
+        '''
+        with self._lock:
+            if key not in self._items:
+                return default
+            value, size = self._items.pop(key)
+            self._items[key] = (value, size)
+            return value
+
+    def put(self, key, value, size):
+        '''Caches a value and evicts least recently used values until the
+        budget is respected. A value that is larger than the budget itself
+        doesn't get cached.
+
+        Parameters
+        ----------
+        key: hashable
+            key of the value
+        value:
+            value that should be cached
+        size: int
+            size of `value` in bytes
+        '''
+        with self._lock:
+            if key in self._items:
+                self.n_bytes -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                k, (v, s) = self._items.popitem(last=False)
+                self.n_bytes -= s
+
+    def clear(self):
+        '''Removes all cached values.'''
+        with self._lock:
+            self._items.clear()
+            self.n_bytes = 0
+
+
 def same_docstring_as(ref_func):
     '''Decorator function that sets the docstring of the decorate function
     to the one of `ref_func`.
@@ -19,6 +19,7 @@ from collections import defaultdict
 import tmlib.models as tm
 from tmlib.utils import notimplemented
 from tmlib.utils import same_docstring_as
+from tmlib.image import ImagePreprocessor
 from tmlib.errors import NotSupportedError
 from sqlalchemy.orm.exc import NoResultFound
 from tmlib.errors import JobDescriptionError
@@ -193,9 +194,11 @@ class ImageRegistrator(WorkflowStepAPI):
                         'No illumination statistics file found for channel %d'
                         % reference_file.channel_id
                     )
-                reference_stats = illumstats_file.get()
+                reference_preprocessor = ImagePreprocessor(
+                    illumstats_file.get()
+                )
 
-                target_stats = dict()
+                target_preprocessors = dict()
                 for cycle_id, tids in target_file_ids.iteritems():
                     target_file = session.query(tm.ChannelImageFile).get(tids[0])
                     try:
@@ -213,7 +216,9 @@ class ImageRegistrator(WorkflowStepAPI):
                             'channel %d'
                             % target_file.channel_id
                         )
-                    target_stats[cycle_id] = illumstats_file.get()
+                    target_preprocessors[cycle_id] = ImagePreprocessor(
+                        illumstats_file.get()
+                    )
 
             for i, rid in enumerate(reference_file_ids):
                 reference_file = session.query(tm.ChannelImageFile).get(rid)
@@ -222,7 +227,9 @@ class ImageRegistrator(WorkflowStepAPI):
                 reference_img = reference_file.get()
                 if batch['illumcorr']:
                     logger.debug('correct reference image')
-                    reference_img = reference_img.correct(reference_stats)
+                    reference_img = reference_preprocessor.process(
+                        reference_img
+                    )
                 y_shifts = list()
                 x_shifts = list()
                 for cycle_id, tids in target_file_ids.iteritems():
@@ -232,7 +239,9 @@ class ImageRegistrator(WorkflowStepAPI):
                     target_img = target_file.get()
                     if batch['illumcorr']:
                         logger.debug('correct target image')
-                        target_img = target_img.correct(target_stats[cycle_id])
+                        target_img = target_preprocessors[cycle_id].process(
+                            target_img
+                        )
 
                     y, x = reg.calculate_shift(
                         target_img.array, reference_img.array
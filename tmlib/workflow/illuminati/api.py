@@ -14,25 +14,34 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import time
+import hashlib
 import logging
 import numpy as np
+import cv2
 import collections
 import itertools
+import threading
+from multiprocessing.pool import ThreadPool
 import shapely.geometry
 import psycopg2
 import sqlalchemy.orm
 from sqlalchemy import func
+from sqlalchemy import and_
 from sqlalchemy.orm.exc import NoResultFound
 from gc3libs.quantity import Duration
 from gc3libs.quantity import Memory
 
 import tmlib.models as tm
 from tmlib.utils import flatten, notimplemented, create_partitions
+from tmlib.utils import LRUCache
 from tmlib.image import PyramidTile
 from tmlib.image import Image
+from tmlib.image import ImagePreprocessor
 from tmlib.errors import DataIntegrityError
 from tmlib.errors import WorkflowError
 from tmlib.models.utils import delete_location
+from tmlib.models.tilestore import create_tile_store
 from tmlib.workflow.api import WorkflowStepAPI
 from tmlib.workflow.jobs import RunJob
 from tmlib.workflow.jobs import SingleRunPhase
@@ -43,9 +52,82 @@ from tmlib.workflow import register_step_api
 logger = logging.getLogger(__name__)
 
 
+class _WorkerPool(object):
+
+    '''Pool of threads for concurrent creation of tiles within a job.
+
+    Extraction, downsampling and encoding of tiles is done by *NumPy* and
+    *OpenCV*, which release the GIL, such that threads can make use of
+    multiple cores while the main thread writes tiles to the database.
+    '''
+
+    def __init__(self, n):
+        '''
+        Parameters
+        ----------
+        n: int
+            number of worker threads; no threads are started if `n` is ``1``
+        '''
+        self._n = max(1, n)
+        self._pool = None
+
+    def __enter__(self):
+        if self._n > 1:
+            logger.debug('start pool of %d worker threads', self._n)
+            self._pool = ThreadPool(self._n)
+        return self
+
+    def __exit__(self, except_type, except_value, except_trace):
+        if self._pool is not None:
+            if except_value is None:
+                self._pool.close()
+            else:
+                self._pool.terminate()
+            self._pool.join()
+
+    def imap(self, func, iterable):
+        '''Applies a function to each element of an iterable.
+
+        Parameters
+        ----------
+        func: function
+            function that should be applied; must be thread-safe
+        iterable: iterable
+            arguments
+
+        Returns
+        -------
+        iterator
+            return values of `func` in the order of `iterable`
+        '''
+        if self._pool is None:
+            return itertools.imap(func, iterable)
+        return self._pool.imap(func, iterable)
+
+
 @register_step_api('illuminati')
 class PyramidBuilder(WorkflowStepAPI):
 
+    #: int: maximal number of tiles of a lower zoom level for which the tiles
+    #: of the next higher level are loaded with a single query
+    _LOWER_LEVEL_CHUNK_SIZE = 1000
+
+    #: Dict[str, float]: default estimates of the duration in seconds of the
+    #: elementary operations of a job: reading and preprocessing an image
+    #: file, inserting pixels of an additional overlapping image into a base
+    #: tile, creating and encoding a non-empty tile, fetching and decoding a
+    #: tile of the next higher zoom level and skipping an empty tile;
+    #: these are rough estimates for 256 x 256 JPEG tiles on a single core
+    #: rather than measurements and can be overridden via the "image_cost"
+    #: and "tile_cost" batch arguments
+    _COSTS = {
+        'image': 0.5,
+        'overlap': 0.1,
+        'tile': 0.02,
+        'child': 0.005,
+        'empty': 0.0005
+    }
+
     def __init__(self, experiment_id):
         '''
         Parameters
@@ -54,6 +136,15 @@ class PyramidBuilder(WorkflowStepAPI):
             ID of the processed experiment
         '''
         super(PyramidBuilder, self).__init__(experiment_id)
+        #: bool: whether existing channel layers and their tiles should be
+        #: kept upon deletion of previous job output (incremental mode)
+        self.keep_layers = False
+        #: Dict[str, float]: estimated duration in seconds of the elementary
+        #: operations of a job (see :attr:`_COSTS`)
+        self.costs = dict(self._COSTS)
+        #: int: number of threads that a job uses for creation of tiles
+        #: (set to the number of cores allocated to the job)
+        self.cores = 1
 
     def create_run_batches(self, args):
         '''Creates job descriptions for parallel computing.
@@ -89,9 +180,13 @@ class PyramidBuilder(WorkflowStepAPI):
                     'Number of wells must be the same for each plate!'
                 )
 
+        self.costs = self._get_costs(args)
+
         logger.info('create job descriptions')
         logger.debug('create descriptions for "run" jobs')
         job_count = 0
+        # Pack files of different runs must not overwrite each other
+        build = time.strftime('%Y%m%d%H%M%S')
         with tm.utils.ExperimentSession(self.experiment_id) as session:
             experiment = session.query(tm.Experiment).one()
             count = 0
@@ -107,11 +202,20 @@ class PyramidBuilder(WorkflowStepAPI):
                 tpoints = [r.tpoint for r in results]
                 for t, z in itertools.product(tpoints, zplanes):
                     logger.info('create layer for tpoint %d, zplane %d', t, z)
-                    image_files = session.query(tm.ChannelImageFile.id).\
-                        filter_by(channel_id=channel.id, tpoint=t, zplane=z).\
-                        order_by(tm.ChannelImageFile.site_id).\
+                    image_files = session.query(
+                            tm.ChannelImageFile.id, tm.Site.y, tm.Site.x,
+                            tm.Well.name.label('well_name'),
+                            tm.Well.plate_id
+                        ).\
+                        join(tm.Site).\
+                        join(tm.Well).\
+                        filter(
+                            tm.ChannelImageFile.channel_id == channel.id,
+                            tm.ChannelImageFile.tpoint == t,
+                            tm.ChannelImageFile.zplane == z
+                        ).\
                         all()
-                    image_file_ids = [f.id for f in image_files]
+                    image_file_ids = self._sort_image_files(image_files)
                     layer = session.get_or_create(
                         tm.ChannelLayer, channel_id=channel.id,
                         tpoint=t, zplane=z
@@ -163,8 +267,27 @@ class PyramidBuilder(WorkflowStepAPI):
                         clip_max = 2**layer.channel.bit_depth - 1
                         clip_min = 0
 
+                    if (args.incremental and layer.id is not None and
+                            layer.tile_backend != args.tile_backend):
+                        logger.info('remove tiles of previous tile backend')
+                        create_tile_store(session, layer.id).clear()
                     layer.max_intensity = clip_max
                     layer.min_intensity = clip_min
+                    layer.codec = args.codec
+                    layer.quality = args.quality
+                    layer.tile_backend = args.tile_backend
+                    layer.bit_depth = 8
+                    if args.bit_depth == 16:
+                        if layer.channel.bit_depth > 8:
+                            # Intensities are kept at original bit depth and
+                            # clipped and rescaled only upon display.
+                            layer.bit_depth = 16
+                            if args.codec != 'png':
+                                logger.info('encode 16-bit tiles as PNG')
+                                layer.codec = 'png'
+                                layer.quality = None
+                        else:
+                            logger.info('channel has 8-bit images')
 
                     if count == 0:
                         logger.info('calculate size of pyramid base level')
@@ -176,30 +299,176 @@ class PyramidBuilder(WorkflowStepAPI):
                     count += 1
                     n_levels = experiment.pyramid_depth
                     max_zoomlevel_index = n_levels - 1
-                    for index, level in enumerate(reversed(range(n_levels))):
+                    # Fingerprints are recorded in any case, such that a
+                    # subsequent incremental run can determine which tiles
+                    # need to be recreated.
+                    fingerprints = self._calculate_fingerprints(
+                        session, layer, args
+                    )
+                    dirty_tiles = None
+                    if args.incremental:
+                        dirty_tiles = self._find_dirty_tiles(
+                            layer, fingerprints
+                        )
+                        if dirty_tiles is None:
+                            create_tile_store(session, layer.id).clear()
+                    self._save_fingerprints(layer, fingerprints, pending=True)
+                    if dirty_tiles is not None:
+                        n_dirty = len(dirty_tiles[max_zoomlevel_index])
+                        logger.info(
+                            'recreate %d tiles at pyramid base level', n_dirty
+                        )
+                        if n_dirty == 0:
+                            logger.info('layer is up to date')
+                            continue
+                    # Work is distributed such that jobs have roughly the same
+                    # estimated duration at each level, rather than the same
+                    # number of images or tiles, because many tiles are empty
+                    # and the number of overlapping images varies.
+                    tile_costs = self._estimate_tile_costs(layer)
+                    image_costs = self._estimate_image_costs(
+                        layer, image_file_ids, tile_costs[max_zoomlevel_index]
+                    )
+                    if args.job_duration is not None:
+                        target_cost = float(args.job_duration)
+                    else:
+                        target_cost = args.batch_size * np.median(
+                            image_costs.values() or [self.costs['image']]
+                        )
+                    logger.info(
+                        'target duration of jobs: %d seconds', target_cost
+                    )
+                    # Jobs of lower levels may need to be sized differently,
+                    # because their duration is dominated by database access
+                    # rather than processing of images.
+                    if args.lower_level_job_duration is not None:
+                        lower_target_cost = float(
+                            args.lower_level_job_duration
+                        )
+                    else:
+                        lower_target_cost = target_cost
+                    # A preview gets built first from downsampled images,
+                    # such that the upper levels of the pyramid can already
+                    # be browsed while the full resolution levels are built.
+                    # Tiles of the preview get overwritten afterwards.
+                    preview_level = None
+                    if args.preview_factor is not None:
+                        if args.incremental:
+                            logger.info('skip preview in incremental mode')
+                        else:
+                            preview_level = self._get_preview_level(
+                                layer, args.preview_factor
+                            )
+                    depth = min(args.sub_pyramid_depth, max_zoomlevel_index)
+                    phases = self._get_run_phases(
+                        n_levels, depth, preview_level
+                    )
+                    for index, level, preview, update in phases:
+                        if preview and level == preview_level:
+                            preview_batches = self._create_preview_batches(
+                                layer, preview_level, target_cost
+                            )
+                            logger.info(
+                                'create %d jobs for preview at pyramid '
+                                'level %d', len(preview_batches), level
+                            )
+                            for blocks, block_file_ids in preview_batches:
+                                job_count += 1
+                                yield {
+                                    'id': job_count,
+                                    'outputs': {},
+                                    'layer_id': layer.id,
+                                    'level': level,
+                                    'index': index,
+                                    'preview': True,
+                                    'blocks': blocks,
+                                    'image_file_ids': block_file_ids,
+                                    'align': args.align,
+                                    'illumcorr': args.illumcorr,
+                                    'build': build
+                                }
+                            continue
+                        elif preview:
+                            batches = self._create_lower_level_batches(
+                                layer, level, tile_costs, lower_target_cost
+                            )
+                            for batch in batches:
+                                job_count += 1
+                                yield {
+                                    'id': job_count,
+                                    'layer_id': layer.id,
+                                    'level': level,
+                                    'index': index,
+                                    'tile_ranges': batch,
+                                    'build': build
+                                }
+                            continue
                         logger.info('create batches for pyramid level %d', level)
                         # The layer "level" increases from top to bottom.
                         # We build the layer bottom-up, therefore, the "index"
                         # decreases from top to bottom.
-                        if level == max_zoomlevel_index:
+                        if level == max_zoomlevel_index and depth > 0:
+                            # For the base level, batches are composed of
+                            # square blocks of tiles, which span the tiles of
+                            # the subsequent "depth" levels.
+                            block_batches = self._create_sub_pyramid_batches(
+                                layer, image_file_ids, depth, target_cost,
+                                tile_costs, dirty_tiles
+                            )
+                            logger.info(
+                                'create %d jobs for sub-pyramids',
+                                len(block_batches)
+                            )
+                            for blocks, block_file_ids in block_batches:
+                                job_count += 1
+                                yield {
+                                    'id': job_count,
+                                    'outputs': {},
+                                    'layer_id': layer.id,
+                                    'level': level,
+                                    'index': index,
+                                    'depth': depth,
+                                    'blocks': blocks,
+                                    'image_file_ids': block_file_ids,
+                                    'align': args.align,
+                                    'illumcorr': args.illumcorr,
+                                    'image_cache_size': args.image_cache_size,
+                                    'incremental': dirty_tiles is not None,
+                                    'update': update,
+                                    'build': build
+                                }
+                            continue
+                        elif level == max_zoomlevel_index:
                             # For the base level, batches are composed of
                             # image files, which will get chopped into tiles.
-                            batch_size = args.batch_size
-                            batches = self._create_batches(
-                                image_file_ids, batch_size
+                            empty_tiles = list()
+                            if dirty_tiles is not None:
+                                image_file_ids = self._select_image_files(
+                                    layer, image_file_ids,
+                                    dirty_tiles[max_zoomlevel_index]
+                                )
+                                empty_tiles = self._find_empty_tiles(
+                                    dirty_tiles[max_zoomlevel_index],
+                                    fingerprints
+                                )
+                            batches = self._create_balanced_batches(
+                                image_file_ids,
+                                [image_costs[fid] for fid in image_file_ids],
+                                target_cost
                             )
+                            if empty_tiles and not batches:
+                                batches = [[]]
                         else:
                             # For the subsequent levels, batches are composed of
                             # tiles of the previous, next higher level.
-                            # Therefore, the batch size needs to be adjusted.
-                            if index == 1:
-                                batch_size *= 25
-                            else:
-                                batch_size /= 4
-                            batches = self._create_batches(
-                                np.arange(np.prod(layer.dimensions[level])),
-                                batch_size
+                            batches = self._create_lower_level_batches(
+                                layer, level, tile_costs, lower_target_cost,
+                                dirty_tiles
                             )
+                        logger.info(
+                            'create %d jobs for pyramid level %d',
+                            len(batches), level
+                        )
 
                         for batch in batches:
                             job_count += 1
@@ -215,23 +484,746 @@ class PyramidBuilder(WorkflowStepAPI):
                                     'level': level,
                                     'index': index,
                                     'image_file_ids': batch,
+                                    'empty_tiles': empty_tiles,
                                     'align': args.align,
-                                    'illumcorr': args.illumcorr
+                                    'illumcorr': args.illumcorr,
+                                    'image_cache_size': args.image_cache_size,
+                                    'incremental': dirty_tiles is not None,
+                                    'update': update,
+                                    'build': build
                                 }
+                                # Only the first job deletes them.
+                                empty_tiles = list()
                             else:
-                                rows = np.arange(layer.dimensions[level][0])
-                                cols = np.arange(layer.dimensions[level][1])
-                                coordinates = np.array(
-                                    list(itertools.product(rows, cols))
-                                )[batch].tolist()
                                 yield {
                                     'id': job_count,
                                     'layer_id': layer.id,
                                     'level': level,
                                     'index': index,
-                                    'coordinates': coordinates
+                                    'tile_ranges': batch,
+                                    'incremental': dirty_tiles is not None,
+                                    'update': update,
+                                    'build': build
                                 }
 
+    @staticmethod
+    def _sort_image_files(image_files):
+        '''Sorts image files along a serpentine walk over the rows of the
+        site grid, such that the images at the top and left of an image are
+        usually processed shortly before the image itself.
+
+        Parameters
+        ----------
+        image_files: List[Tuple[Union[int, str]]]
+            ID of each image file together with the *y*, *x* coordinate of
+            its site, the name of the well and the ID of the plate
+
+        Returns
+        -------
+        List[int]
+            sorted IDs of image files
+        '''
+        # Row and column of wells are not stored in the database, but are
+        # encoded in the name of the well.
+        well_coordinates = {
+            name: tm.Well.map_name_to_coordinate(name)
+            for name in {f.well_name for f in image_files}
+        }
+        rows = collections.defaultdict(list)
+        for f in image_files:
+            well_y, well_x = well_coordinates[f.well_name]
+            rows[(f.plate_id, well_y, f.y)].append((well_x, f.x, f.id))
+        image_file_ids = list()
+        for i, key in enumerate(sorted(rows)):
+            row = sorted(rows[key])
+            if i % 2 == 1:
+                row = reversed(row)
+            image_file_ids.extend([f[2] for f in row])
+        return image_file_ids
+
+    @staticmethod
+    def _get_fingerprints_filename(layer, pending=False):
+        if pending:
+            return os.path.join(layer.location, 'fingerprints.pending.npy')
+        return os.path.join(layer.location, 'fingerprints.npy')
+
+    def _save_fingerprints(self, layer, fingerprints, pending=False):
+        '''Saves fingerprints of base tiles of a layer.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        fingerprints: numpy.ndarray[numpy.int64]
+            fingerprint of each tile at the maximum zoom level
+        pending: bool, optional
+            whether the fingerprints belong to a run that hasn't completed
+            yet (default: ``False``)
+        '''
+        filename = self._get_fingerprints_filename(layer, pending)
+        location = os.path.dirname(filename)
+        if not os.path.exists(location):
+            os.makedirs(location)
+        np.save(filename, fingerprints)
+
+    def _calculate_fingerprints(self, session, layer, args):
+        '''Calculates a fingerprint for each tile at the base of the pyramid
+        from the inputs that determine its pixels: IDs of intersecting image
+        files, their alignment (if images get aligned), intensity range,
+        illumination statistics (if images get corrected), encoding and
+        storage backend.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        args: tmlib.workflow.illuminati.args.IlluminatiBatchArguments
+            step-specific arguments
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int64]
+            fingerprint of each tile at the maximum zoom level; zero for tiles
+            that don't intersect with any image
+        '''
+        logger.debug('calculate fingerprints of base tiles')
+        settings = [
+            layer.codec, layer.quality, layer.tile_backend, layer.bit_depth,
+            args.align, args.illumcorr
+        ]
+        if not layer.is_high_bit_depth:
+            # Intensities of 16-bit tiles are only clipped upon display.
+            settings.extend([layer.min_intensity, layer.max_intensity])
+        if args.illumcorr:
+            stats_file = session.query(tm.IllumstatsFile.id).\
+                filter_by(channel_id=layer.channel_id).\
+                first()
+            settings.append(stats_file.id if stats_file is not None else None)
+        inputs = dict()
+        if args.align:
+            records = session.query(
+                    tm.ChannelImageFile.id,
+                    tm.Site.top_residue, tm.Site.bottom_residue,
+                    tm.Site.left_residue, tm.Site.right_residue,
+                    tm.SiteShift.y, tm.SiteShift.x
+                ).\
+                join(tm.Site).\
+                outerjoin(tm.SiteShift, and_(
+                    tm.SiteShift.site_id == tm.Site.id,
+                    tm.SiteShift.cycle_id == tm.ChannelImageFile.cycle_id
+                )).\
+                filter(
+                    tm.ChannelImageFile.channel_id == layer.channel_id,
+                    tm.ChannelImageFile.tpoint == layer.tpoint,
+                    tm.ChannelImageFile.zplane == layer.zplane
+                )
+            inputs = {r.id: tuple(r) for r in records}
+        fingerprints = np.zeros(layer.dimensions[-1], dtype=np.int64)
+        tile_map = layer.base_tile_coordinate_to_image_file_map
+        for (y, x), fids in tile_map.iteritems():
+            key = repr((settings, sorted(inputs.get(f, f) for f in fids)))
+            # Use 60 bits, such that fingerprints are positive integers
+            fingerprints[y, x] = int(hashlib.sha1(key).hexdigest()[:15], 16)
+        return fingerprints
+
+    def _find_dirty_tiles(self, layer, fingerprints):
+        '''Determines tiles whose inputs changed since the previous run by
+        comparing fingerprints of base tiles.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        fingerprints: numpy.ndarray[numpy.int64]
+            fingerprint of each tile at the maximum zoom level for the
+            current run
+
+        Returns
+        -------
+        Union[Dict[int, Set[Tuple[int]]], None]
+            row, column coordinates of tiles that need to be recreated per
+            zoom level or ``None`` in case the whole layer needs to be rebuilt
+
+        Note
+        ----
+        Fingerprints of a run replace those of the previous run only once all
+        jobs have completed (see :meth:`collect_job_output
+        <tmlib.workflow.illuminati.api.PyramidBuilder.collect_job_output>`).
+        '''
+        filename = self._get_fingerprints_filename(layer)
+        if not os.path.exists(filename):
+            logger.info('no fingerprints of a previous run: rebuild layer')
+            return None
+        previous_fingerprints = np.load(filename)
+        if previous_fingerprints.shape != fingerprints.shape:
+            logger.info('size of layer changed: rebuild layer')
+            return None
+        # Tiles that no longer intersect with any image are dirty as well.
+        # They end up empty and get deleted together with empty tiles of
+        # lower levels that were created from them.
+        changed = previous_fingerprints != fingerprints
+        max_zoomlevel_index = len(layer.dimensions) - 1
+        dirty_tiles = {
+            max_zoomlevel_index: set(
+                (int(y), int(x)) for y, x in zip(*np.where(changed))
+            )
+        }
+        # Tiles of lower levels need to be recreated in case any of the tiles
+        # they are created from changed.
+        zoom_factor = layer.zoom_factor
+        for level in reversed(range(max_zoomlevel_index)):
+            dirty_tiles[level] = set(
+                (y / zoom_factor, x / zoom_factor)
+                for y, x in dirty_tiles[level + 1]
+            )
+        return dirty_tiles
+
+    @staticmethod
+    def _find_empty_tiles(tiles, fingerprints):
+        '''Determines dirty base tiles from which all images were removed.
+        These tiles aren't created from any image and need to be deleted
+        explicitly.
+
+        Parameters
+        ----------
+        tiles: Set[Tuple[int]]
+            row, column coordinates of dirty tiles at the maximum zoom level
+        fingerprints: numpy.ndarray[numpy.int64]
+            fingerprint of each tile at the maximum zoom level for the
+            current run
+
+        Returns
+        -------
+        List[List[int]]
+            sorted row, column coordinates of tiles
+        '''
+        return sorted([y, x] for y, x in tiles if fingerprints[y, x] == 0)
+
+    def _select_image_files(self, layer, image_file_ids, tiles):
+        '''Selects image files from which given base tiles get created.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        image_file_ids: List[int]
+            IDs of image files belonging to `layer`
+        tiles: Set[Tuple[int]]
+            row, column coordinates of tiles at the maximum zoom level
+
+        Returns
+        -------
+        List[int]
+            IDs of image files in the order of `image_file_ids`
+        '''
+        # Tiles that overlap several images are created from only one of
+        # them (see ChannelLayer.map_image_to_base_tiles()).
+        sites = {s.file_id: s for s in layer.site_grid.itervalues()}
+        selected_ids = list()
+        for fid in image_file_ids:
+            mappings = layer.map_image_to_base_tiles(sites[fid])
+            if any((m['y'], m['x']) in tiles for m in mappings):
+                selected_ids.append(fid)
+        return selected_ids
+
+    @staticmethod
+    def _sum_blocks(values, block_size, shape):
+        '''Sums values of a 2D array over square blocks.
+
+        Parameters
+        ----------
+        values: numpy.ndarray
+            2D array
+        block_size: int
+            number of rows and columns of a block
+        shape: Tuple[int]
+            number of blocks along the vertical and horizontal axis; blocks
+            that extend beyond `values` are padded with zeros
+
+        Returns
+        -------
+        numpy.ndarray
+            2D array with given `shape`
+        '''
+        n_rows, n_cols = shape
+        padded = np.zeros(
+            (n_rows * block_size, n_cols * block_size), dtype=values.dtype
+        )
+        h = min(values.shape[0], padded.shape[0])
+        w = min(values.shape[1], padded.shape[1])
+        padded[:h, :w] = values[:h, :w]
+        return padded.reshape(n_rows, block_size, n_cols, block_size).\
+            sum(axis=(1, 3))
+
+    def _get_costs(self, args):
+        '''Gets estimates of the duration of the elementary operations of a
+        job.
+
+        Parameters
+        ----------
+        args: tmlib.workflow.illuminati.args.IlluminatiBatchArguments
+            step-specific arguments
+
+        Returns
+        -------
+        Dict[str, float]
+            estimated duration in seconds of each operation
+
+        See also
+        --------
+        :attr:`_COSTS <tmlib.workflow.illuminati.api.PyramidBuilder._COSTS>`
+        '''
+        costs = dict(self._COSTS)
+        if args.image_cost is not None:
+            if not args.image_cost > 0:
+                raise ValueError('Argument "image_cost" must be positive.')
+            costs['image'] = args.image_cost
+        if args.tile_cost is not None:
+            if not args.tile_cost > 0:
+                raise ValueError('Argument "tile_cost" must be positive.')
+            # Operations on tiles are assumed to scale alike.
+            factor = args.tile_cost / self._COSTS['tile']
+            for name in ('overlap', 'tile', 'child', 'empty'):
+                costs[name] = self._COSTS[name] * factor
+        logger.debug('estimated duration of operations: %s', costs)
+        return costs
+
+    def _estimate_tile_costs(self, layer):
+        '''Estimates the duration of creating each tile of the pyramid.
+        Tiles of the base level are empty when they don't intersect with any
+        image. Tiles of lower levels are empty when all their child tiles at
+        the next higher level are empty.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+
+        Returns
+        -------
+        Dict[int, numpy.ndarray[numpy.float64]]
+            estimated duration in seconds for each tile of each zoom level
+
+        See also
+        --------
+        :attr:`costs <tmlib.workflow.illuminati.api.PyramidBuilder.costs>`
+        '''
+        max_zoomlevel_index = len(layer.dimensions) - 1
+        tile_map = layer.base_tile_coordinate_to_image_file_map
+        # Costs were calibrated for tiles of 256 x 256 pixels and scale with
+        # the number of pixels per tile.
+        scale = (layer.tile_size / 256.0) ** 2
+        tile_cost = self.costs['tile'] * scale
+        overlap_cost = self.costs['overlap'] * scale
+        child_cost = self.costs['child'] * scale
+        costs = dict()
+        costs[max_zoomlevel_index] = np.full(
+            layer.dimensions[max_zoomlevel_index], self.costs['empty']
+        )
+        non_empty = np.zeros(layer.dimensions[max_zoomlevel_index], bool)
+        for (y, x), fids in tile_map.iteritems():
+            non_empty[y, x] = True
+            costs[max_zoomlevel_index][y, x] = (
+                tile_cost + overlap_cost * (len(fids) - 1)
+            )
+        for level in reversed(range(max_zoomlevel_index)):
+            n_children = self._sum_blocks(
+                non_empty.astype(np.int64), layer.zoom_factor,
+                layer.dimensions[level]
+            )
+            non_empty = n_children > 0
+            costs[level] = np.where(
+                non_empty,
+                tile_cost + child_cost * n_children,
+                self.costs['empty']
+            )
+        return costs
+
+    def _estimate_image_costs(self, layer, image_file_ids, base_tile_costs):
+        '''Estimates the duration of creating the base tiles of each image.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        image_file_ids: List[int]
+            IDs of image files belonging to `layer`
+        base_tile_costs: numpy.ndarray[numpy.float64]
+            estimated duration in seconds for each tile of the base level
+
+        Returns
+        -------
+        Dict[int, float]
+            estimated duration in seconds hashable by image file ID
+        '''
+        sites = {s.file_id: s for s in layer.site_grid.itervalues()}
+        costs = dict()
+        for fid in image_file_ids:
+            costs[fid] = self.costs['image'] + sum(
+                base_tile_costs[m['y'], m['x']]
+                for m in layer.map_image_to_base_tiles(sites[fid])
+            )
+        return costs
+
+    @staticmethod
+    def _partition_by_cost(costs, target_cost):
+        '''Partitions a sequence of items into contiguous ranges of roughly
+        equal cost, such that the cost of a range approximates `target_cost`.
+
+        Parameters
+        ----------
+        costs: List[float]
+            cost of each item
+        target_cost: float
+            targeted cost of a range
+
+        Returns
+        -------
+        List[Tuple[int]]
+            zero-based index of the first and one past the last item of each
+            range
+        '''
+        n_items = len(costs)
+        if n_items == 0:
+            return list()
+        costs = np.asarray(costs, dtype=np.float64)
+        total_cost = costs.sum()
+        n = int(np.ceil(total_cost / max(target_cost, 1e-10)))
+        n = min(max(n, 1), n_items)
+        # Each item is assigned to the range in which the midpoint of its
+        # cost interval falls.
+        midpoints = np.cumsum(costs) - costs / 2.0
+        assignments = np.minimum(
+            (midpoints * n / max(total_cost, 1e-10)).astype(np.int64), n - 1
+        )
+        boundaries = np.searchsorted(assignments, np.arange(1, n)).tolist()
+        starts = [0] + boundaries
+        stops = boundaries + [n_items]
+        return [(a, b) for a, b in zip(starts, stops) if b > a]
+
+    def _create_balanced_batches(self, items, costs, target_cost):
+        '''Partitions items into contiguous batches of roughly equal cost.
+        The order of items is preserved, which keeps neighbouring items in the
+        same batch.
+
+        Parameters
+        ----------
+        items: list
+            items that should be partitioned
+        costs: List[float]
+            cost of each item
+        target_cost: float
+            targeted cost of a batch
+
+        Returns
+        -------
+        List[list]
+            batches of items
+        '''
+        return [
+            items[start:stop]
+            for start, stop in self._partition_by_cost(costs, target_cost)
+        ]
+
+    @staticmethod
+    def _compress_tile_ranges(indices):
+        '''Compresses sorted linear indices of tiles into ranges of
+        consecutive indices.
+
+        Parameters
+        ----------
+        indices: numpy.ndarray[numpy.int64]
+            sorted row-major indices of tiles
+
+        Returns
+        -------
+        List[List[int]]
+            index of the first and one past the last tile of each range
+        '''
+        if len(indices) == 0:
+            return list()
+        breaks = np.where(np.diff(indices) != 1)[0] + 1
+        starts = np.concatenate([[0], breaks])
+        stops = np.concatenate([breaks, [len(indices)]])
+        return [
+            [int(indices[a]), int(indices[b - 1]) + 1]
+            for a, b in zip(starts, stops)
+        ]
+
+    @staticmethod
+    def _expand_tile_ranges(tile_ranges, n_cols):
+        '''Expands ranges of linear indices of tiles into coordinates.
+
+        Parameters
+        ----------
+        tile_ranges: List[List[int]]
+            index of the first and one past the last tile of each range in
+            row-major order
+        n_cols: int
+            number of columns of the zoom level
+
+        Returns
+        -------
+        List[Tuple[int]]
+            row, column coordinates of tiles
+        '''
+        return [
+            divmod(i, n_cols)
+            for start, stop in tile_ranges for i in xrange(start, stop)
+        ]
+
+    def _create_lower_level_batches(self, layer, level, tile_costs,
+            target_cost, dirty_tiles=None):
+        '''Partitions the tiles of a zoom level below the base level into
+        batches. Tiles are described by ranges of their linear row-major
+        index, which get expanded by the job.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        level: int
+            zero-based zoom level index
+        tile_costs: Dict[int, numpy.ndarray[numpy.float64]]
+            estimated duration in seconds for each tile of each zoom level
+        target_cost: float
+            targeted estimated duration of a batch in seconds
+        dirty_tiles: Dict[int, Set[Tuple[int]]], optional
+            coordinates of tiles that need to be recreated per zoom level
+            (default: all tiles)
+
+        Returns
+        -------
+        List[List[List[int]]]
+            index of the first and one past the last tile of each range of
+            each batch
+        '''
+        n_cols = layer.dimensions[level][1]
+        costs = tile_costs[level].ravel()
+        if dirty_tiles is None:
+            return [
+                [[start, stop]]
+                for start, stop in self._partition_by_cost(costs, target_cost)
+            ]
+        indices = np.array(sorted(
+            y * n_cols + x for y, x in dirty_tiles[level]
+        ), dtype=np.int64)
+        return [
+            self._compress_tile_ranges(indices[start:stop])
+            for start, stop in self._partition_by_cost(
+                costs[indices], target_cost
+            )
+        ]
+
+    @staticmethod
+    def _map_blocks_to_image_files(layer, block_size):
+        '''Maps square blocks of tiles at the base level to intersecting
+        images.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        block_size: int
+            number of base tiles along each axis of a block
+
+        Returns
+        -------
+        Dict[Tuple[int], Set[int]]
+            IDs of image files hashable by row, column index of blocks
+        '''
+        tile_map = layer.base_tile_coordinate_to_image_file_map
+        block_file_map = collections.defaultdict(set)
+        for (y, x), fids in tile_map.iteritems():
+            block_file_map[(y / block_size, x / block_size)].update(fids)
+        return block_file_map
+
+    @staticmethod
+    def _get_preview_level(layer, factor):
+        '''Determines the zoom level of the preview.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        factor: int
+            factor by which images get downsampled for the preview
+
+        Returns
+        -------
+        int
+            zero-based zoom level index
+
+        Raises
+        ------
+        tmlib.errors.WorkflowError
+            when `factor` is not a power of the zoom factor
+        '''
+        zoom_factor = layer.zoom_factor
+        n = int(round(np.log(factor) / np.log(zoom_factor)))
+        if n < 1 or zoom_factor ** n != factor:
+            raise WorkflowError(
+                'Preview factor must be a power of the zoom factor %d.'
+                % zoom_factor
+            )
+        return max(len(layer.dimensions) - 1 - n, 0)
+
+    @staticmethod
+    def _get_run_phases(n_levels, depth, preview_level=None):
+        '''Determines the sequential runs of the "run" phase and the zoom
+        level that gets built by each of them.
+
+        Parameters
+        ----------
+        n_levels: int
+            number of zoom levels
+        depth: int
+            number of levels below the base level that get built as part of
+            the sub-pyramids of the base level
+        preview_level: int, optional
+            zero-based index of the zoom level of the preview
+            (default: ``None``)
+
+        Returns
+        -------
+        List[Tuple[Union[int, bool]]]
+            index of the run, zero-based zoom level index, whether the level
+            belongs to the preview and whether tiles of the preview need to be
+            updated
+
+        Note
+        ----
+        The preview levels get their own runs before those of the base level,
+        because levels above the base level can only be built once all
+        jobs of the base level completed. Building the preview concurrently
+        with the base level would therefore not make the upper levels
+        browseable any earlier.
+        '''
+        max_zoomlevel_index = n_levels - 1
+        phases = list()
+        if preview_level is not None:
+            for level in reversed(range(preview_level + 1)):
+                phases.append((len(phases), level, True, False))
+        # Levels that are built in memory as part of the sub-pyramids of the
+        # base level don't get their own sequential run.
+        levels = list(reversed(range(n_levels)))
+        levels = levels[:1] + levels[(depth + 1):]
+        for index, level in enumerate(levels, len(phases)):
+            # Tiles of the preview need to be updated. Jobs visit every tile
+            # of these levels, such that preview tiles that end up empty get
+            # deleted.
+            update = (
+                preview_level is not None and
+                preview_level >= level - (
+                    depth if level == max_zoomlevel_index else 0
+                )
+            )
+            phases.append((index, level, False, update))
+        return phases
+
+    def _create_preview_batches(self, layer, preview_level, target_cost):
+        '''Partitions the tiles of the preview level into batches.
+        Tiles that don't intersect with any image are empty and don't need
+        to be processed.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        preview_level: int
+            zero-based index of the zoom level of the preview
+        target_cost: float
+            targeted estimated duration of a batch in seconds
+
+        Returns
+        -------
+        List[Tuple[List[List[int]], List[int]]]
+            row and column index of each tile of a batch and the IDs of image
+            files intersecting with any of the tiles
+        '''
+        max_zoomlevel_index = len(layer.dimensions) - 1
+        block_size = layer.zoom_factor ** (max_zoomlevel_index - preview_level)
+        block_file_map = self._map_blocks_to_image_files(layer, block_size)
+        blocks = sorted(block_file_map.keys())
+        # Reading images dominates, downsampled images are tiny.
+        costs = [
+            self.costs['image'] * len(block_file_map[b]) for b in blocks
+        ]
+        batches = list()
+        for block_batch in self._create_balanced_batches(
+                blocks, costs, target_cost):
+            fids = set()
+            for block in block_batch:
+                fids.update(block_file_map[block])
+            batches.append((
+                [list(block) for block in block_batch], sorted(fids)
+            ))
+        return batches
+
+    def _create_sub_pyramid_batches(self, layer, image_file_ids, depth,
+            target_cost, tile_costs, dirty_tiles=None):
+        '''Partitions the base level of the pyramid into square blocks of
+        tiles, which can be processed independently down `depth` zoom levels.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        image_file_ids: List[int]
+            IDs of image files belonging to `layer`
+        depth: int
+            number of zoom levels below the base level that should be created
+            from a block
+        target_cost: float
+            targeted estimated duration of a batch in seconds
+        tile_costs: Dict[int, numpy.ndarray[numpy.float64]]
+            estimated duration in seconds for each tile of each zoom level
+        dirty_tiles: Dict[int, Set[Tuple[int]]], optional
+            coordinates of tiles that need to be recreated per zoom level;
+            only blocks that contain any of these tiles are processed
+            (default: all blocks)
+
+        Returns
+        -------
+        List[Tuple[List[List[int]], List[int]]]
+            row and column index of each block of a batch and the IDs of image
+            files intersecting with any of the blocks
+        '''
+        block_size = layer.zoom_factor ** depth
+        block_file_map = self._map_blocks_to_image_files(layer, block_size)
+        # Blocks correspond to tiles of the lowest level of sub-pyramids.
+        block_level = len(layer.dimensions) - 1 - depth
+        n_block_rows, n_block_cols = layer.dimensions[block_level]
+        block_costs = np.zeros((n_block_rows, n_block_cols))
+        for level in range(block_level, len(layer.dimensions)):
+            block_costs += self._sum_blocks(
+                tile_costs[level], layer.zoom_factor ** (level - block_level),
+                (n_block_rows, n_block_cols)
+            )
+        # Every block has to be processed, even if it doesn't contain any image,
+        # because tiles of lower levels are required for the subsequent runs.
+        blocks = list(itertools.product(
+            range(n_block_rows), range(n_block_cols)
+        ))
+        if dirty_tiles is not None:
+            blocks = [b for b in blocks if b in dirty_tiles[block_level]]
+        costs = [
+            block_costs[b] + self.costs['image'] * len(block_file_map[b])
+            for b in blocks
+        ]
+        batches = list()
+        for block_batch in self._create_balanced_batches(
+                blocks, costs, target_cost):
+            fids = set()
+            for block in block_batch:
+                fids.update(block_file_map[block])
+            batches.append((
+                [list(block) for block in block_batch], sorted(fids)
+            ))
+        return batches
+
     def delete_previous_job_output(self):
         '''Deletes all instances of
         :class:`ChannelLayer <tmlib.models.layer.ChannelLayer>` and
@@ -245,9 +1237,14 @@ class PyramidBuilder(WorkflowStepAPI):
         :class:`Site <tmlib.models.site.Site>`.
         '''
         with tm.utils.ExperimentSession(self.experiment_id, False) as session:
-            logger.info('delete existing channel layers')
-            session.query(tm.ChannelLayerTile).delete()
-            session.query(tm.ChannelLayer).delete()
+            if self.keep_layers:
+                logger.info('keep existing channel layers')
+            else:
+                logger.info('delete existing channel layers')
+                for layer in session.query(tm.ChannelLayer):
+                    delete_location(layer.location)
+                session.query(tm.ChannelLayerTile).delete()
+                session.query(tm.ChannelLayer).delete()
             logger.info('delete existing static mapobject types')
             session.query(tm.Mapobject).delete()
             session.query(tm.MapobjectType).delete()
@@ -324,9 +1321,14 @@ class PyramidBuilder(WorkflowStepAPI):
             )
 
             for j in job_ids:
+                command = self._build_run_command(j, verbosity)
+                if cores:
+                    # Jobs use the allocated cores for concurrent creation of
+                    # tiles.
+                    command.extend(['--cores', str(cores)])
                 job = RunJob(
                     step_name=self.step_name,
-                    arguments=self._build_run_command(j, verbosity),
+                    arguments=command,
                     output_dir=self.log_location,
                     job_id=j,
                     index=index,
@@ -353,9 +1355,144 @@ class PyramidBuilder(WorkflowStepAPI):
 
         return job_collection
 
+    def _load_illumstats(self, session, layer, batch):
+        '''Loads illumination statistics for the channel of `layer` in case
+        images should be corrected for illumination artifacts.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        batch: dict
+            job description
+
+        Returns
+        -------
+        Union[tmlib.image.IllumstatsContainer, None]
+            illumination statistics or ``None`` if images should not be
+            corrected
+
+        Raises
+        ------
+        tmlib.errors.WorkflowError
+            when no illumination statistics were calculated for the channel
+        '''
+        if batch['align']:
+            logger.info('align images between cycles')
+        if not batch['illumcorr']:
+            return None
+        logger.info('correct images for illumination artifacts')
+        try:
+            logger.debug('load illumination statistics')
+            stats_file = session.query(tm.IllumstatsFile).\
+                filter_by(channel_id=layer.channel_id).\
+                one()
+        except NoResultFound:
+            raise WorkflowError(
+                'No illumination statistics file found for channel %d'
+                % layer.channel_id
+            )
+        return stats_file.get()
+
+    def _create_preprocessor(self, session, layer, batch):
+        '''Creates a preprocessor, which prepares images for tiling, i.e.
+        corrects them for illumination artifacts, aligns them and rescales
+        them to 8-bit as requested by `batch`. Images of layers with 16-bit
+        tiles keep their original bit depth.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        layer: tmlib.models.channel.ChannelLayer
+            processed channel layer
+        batch: dict
+            job description
+
+        Returns
+        -------
+        tmlib.image.ImagePreprocessor
+            preprocessor
+        '''
+        stats = self._load_illumstats(session, layer, batch)
+        if layer.is_high_bit_depth:
+            clip_range = None
+        else:
+            clip_range = (layer.min_intensity, layer.max_intensity)
+        return ImagePreprocessor(
+            stats, clip_range=clip_range, align=batch['align'], crop=False
+        )
+
+    def _preprocess_image(self, image_file, preprocessor):
+        '''Loads an image and prepares it for tiling.
+
+        Parameters
+        ----------
+        image_file: tmlib.models.file.ChannelImageFile
+            file containing the image
+        preprocessor: tmlib.image.ImagePreprocessor
+            preprocessor for images of the processed channel
+
+        Returns
+        -------
+        tmlib.image.ChannelImage
+            preprocessed image with the bit depth of the layer's tiles
+        '''
+        return preprocessor.process(image_file.get())
+
+    @staticmethod
+    def _create_image_cache(batch):
+        '''Creates a cache for preprocessed images.
+
+        Parameters
+        ----------
+        batch: dict
+            job description
+
+        Returns
+        -------
+        tmlib.utils.LRUCache
+            cache with the memory budget requested by `batch`
+        '''
+        max_bytes = batch.get('image_cache_size', 1000) * 1024**2
+        logger.debug('cache up to %d MB of images', max_bytes / 1024**2)
+        return LRUCache(max_bytes)
+
+    def _get_preprocessed_image(self, cache, image_file, preprocessor):
+        '''Gets a preprocessed image from the cache or loads and preprocesses
+        it and adds it to the cache.
+
+        Parameters
+        ----------
+        cache: tmlib.utils.LRUCache
+            cache of preprocessed images
+        image_file: tmlib.models.file.ChannelImageFile
+            file containing the image
+        preprocessor: tmlib.image.ImagePreprocessor
+            preprocessor for images of the processed channel
+
+        Returns
+        -------
+        tmlib.image.ChannelImage
+            preprocessed image with the bit depth of the layer's tiles
+        '''
+        image = cache.get(image_file.id)
+        if image is None:
+            image = self._preprocess_image(image_file, preprocessor)
+            cache.put(image_file.id, image, image.array.nbytes)
+        else:
+            logger.debug('use cached image %d', image_file.id)
+        return image
+
     def _create_maxzoom_level_tiles(self, batch, assume_clean_state):
         exp_id = self.experiment_id
-        with tm.utils.ExperimentSession(exp_id, transaction=False) as session:
+        with tm.utils.ExperimentSession(exp_id, transaction=False) as session, \
+                self._create_tile_store(
+                    session, batch, assume_clean_state
+                ) as store, \
+                _WorkerPool(self.cores) as pool:
             layer = session.query(tm.ChannelLayer).get(batch['layer_id'])
             logger.info(
                 'process layer: channel=%s, zplane=%d, tpoint=%d',
@@ -363,50 +1500,46 @@ class PyramidBuilder(WorkflowStepAPI):
             )
             logger.info('create tiles at zoom level %d', batch['level'])
 
-            if batch['illumcorr']:
-                logger.info('correct images for illumination artifacts')
-                try:
-                    logger.debug('load illumination statistics')
-                    image_file = session.query(tm.ChannelImageFile).get(
-                        batch['image_file_ids'][0]
-                    )
-                    stats_file = session.query(tm.IllumstatsFile).\
-                        filter_by(channel_id=layer.channel_id).\
-                        one()
-                except NoResultFound:
-                    raise WorkflowError(
-                        'No illumination statistics file found for channel %d'
-                        % layer.channel_id
-                    )
-                stats = stats_file.get()
-            else:
-                stats = None
-
-            if batch['align']:
-                logger.info('align images between cycles')
-
-            clip_min = layer.min_intensity
-            clip_max = layer.max_intensity
+            preprocessor = self._create_preprocessor(session, layer, batch)
+            layer_id = layer.id
+            codec = layer.codec
+            quality = layer.quality
+            # Neighbouring images are required for tiles that overlap
+            # multiple images. Image files are ordered such that neighbours
+            # have usually been processed shortly before.
+            cache = self._create_image_cache(batch)
 
             for fid in batch['image_file_ids']:
                 file = session.query(tm.ChannelImageFile).get(fid)
                 logger.info('process image %d', file.id)
                 tiles = layer.map_image_to_base_tiles(file)
                 image_store = dict()
-                image = file.get()
-                if batch['illumcorr']:
-                    logger.debug('correct image')
-                    image = image.correct(stats)
-                if batch['align']:
-                    logger.debug('align image')
-                    image = image.align(crop=False)
-                if not image.is_uint8:
-                    image = image.clip(clip_min, clip_max)
-                    image = image.scale(clip_min, clip_max)
-                image_store[file.id] = image
-
-                extra_file_map = layer.map_base_tile_to_images(file.site)
+                image_store[file.id] = self._get_preprocessed_image(
+                    cache, file, preprocessor
+                )
+
+                site = layer.site_grid[file.site_id]
+                extra_file_map = layer.map_base_tile_to_images(site)
+                # Load images that contain overlapping pixels upfront, such
+                # that tiles can be created without database access.
+                file_coordinate = np.array((site.y, site.x))
+                image_size = (site.height, site.width)
+                extra_file_coordinates = dict()
                 for t in tiles:
+                    for efid in extra_file_map[t['y'], t['x']]:
+                        if efid in image_store:
+                            continue
+                        extra_file = session.query(tm.ChannelImageFile).\
+                            get(efid)
+                        image_store[efid] = self._get_preprocessed_image(
+                            cache, extra_file, preprocessor
+                        )
+                        extra_site = layer.site_grid[extra_file.site_id]
+                        extra_file_coordinates[efid] = np.array((
+                            extra_site.y, extra_site.x
+                        ))
+
+                def create_tile(t):
                     level = batch['level']
                     row = t['y']
                     column = t['x']
@@ -420,36 +1553,17 @@ class PyramidBuilder(WorkflowStepAPI):
                     # Determine files that contain overlapping pixels,
                     # i.e. pixels falling into the currently processed tile
                     # that are not contained by the file.
-                    file_coordinate = np.array((file.site.y, file.site.x))
                     extra_file_ids = extra_file_map[row, column]
                     if len(extra_file_ids) > 0:
                         logger.debug('tile overlaps multiple images')
                     for efid in extra_file_ids:
-                        extra_file = session.query(tm.ChannelImageFile).\
-                            get(efid)
-                        if extra_file.id not in image_store:
-                            image = extra_file.get()
-                            if batch['illumcorr']:
-                                logger.debug('correct image')
-                                image = image.correct(stats)
-                            if batch['align']:
-                                logger.debug('align image')
-                                image = image.align(crop=False)
-                            if not image.is_uint8:
-                                image = image.clip(clip_min, clip_max)
-                                image = image.scale(clip_min, clip_max)
-                            image_store[extra_file.id] = image
-
-                        extra_file_coordinate = np.array((
-                            extra_file.site.y, extra_file.site.x
-                        ))
-
+                        extra_file_coordinate = extra_file_coordinates[efid]
                         condition = file_coordinate > extra_file_coordinate
-                        pixels = image_store[extra_file.id]
+                        pixels = image_store[efid]
                         if all(condition):
                             logger.debug('insert pixels from top left image')
-                            y = file.site.image_size[0] - abs(t['y_offset'])
-                            x = file.site.image_size[1] - abs(t['x_offset'])
+                            y = image_size[0] - abs(t['y_offset'])
+                            x = image_size[1] - abs(t['x_offset'])
                             height = abs(t['y_offset'])
                             width = abs(t['x_offset'])
                             subtile = PyramidTile(
@@ -458,7 +1572,7 @@ class PyramidBuilder(WorkflowStepAPI):
                             tile.insert(subtile, 0, 0)
                         elif condition[0] and not condition[1]:
                             logger.debug('insert pixels from top image')
-                            y = file.site.image_size[0] - abs(t['y_offset'])
+                            y = image_size[0] - abs(t['y_offset'])
                             height = abs(t['y_offset'])
                             if t['x_offset'] < 0:
                                 x = 0
@@ -474,7 +1588,7 @@ class PyramidBuilder(WorkflowStepAPI):
                             tile.insert(subtile, 0, x_offset)
                         elif not condition[0] and condition[1]:
                             logger.debug('insert pixels from left image')
-                            x = file.site.image_size[1] - abs(t['x_offset'])
+                            x = image_size[1] - abs(t['x_offset'])
                             width = abs(t['x_offset'])
                             if t['y_offset'] < 0:
                                 y = 0
@@ -493,87 +1607,485 @@ class PyramidBuilder(WorkflowStepAPI):
                                 'Tile shouldn\'t be in this batch!'
                             )
 
-                    channel_layer_tile = tm.ChannelLayerTile(
-                        channel_layer_id=layer.id,
-                        z=level, y=row, x=column, pixels=tile
+                    if tile.is_background:
+                        # Empty tiles are not stored (see get_tile()).
+                        logger.debug('skip background tile')
+                        return ((row, column), None)
+                    return ((row, column), tm.ChannelLayerTile(
+                        channel_layer_id=layer_id,
+                        z=level, y=row, x=column, pixels=tile,
+                        codec=codec, quality=quality
+                    ))
+
+                # Tiles get extracted and encoded by worker threads, while
+                # the main thread writes them to the database.
+                iterator = pool.imap(create_tile, tiles)
+                for (row, column), channel_layer_tile in iterator:
+                    if channel_layer_tile is not None:
+                        store.add(channel_layer_tile)
+                    else:
+                        self._delete_empty_tile(
+                            store, batch['level'], row, column
+                        )
+
+            for row, column in batch.get('empty_tiles', []):
+                self._delete_empty_tile(store, batch['level'], row, column)
+
+    def _create_preview_tiles(self, batch, assume_clean_state):
+        exp_id = self.experiment_id
+        with tm.utils.ExperimentSession(exp_id, transaction=False) as session, \
+                self._create_tile_store(
+                    session, batch, assume_clean_state
+                ) as store, \
+                _WorkerPool(self.cores) as pool:
+            layer = session.query(tm.ChannelLayer).get(batch['layer_id'])
+            logger.info(
+                'process layer: channel=%s, zplane=%d, tpoint=%d',
+                layer.channel.name, layer.zplane, layer.tpoint
+            )
+            level = batch['level']
+            logger.info('create preview tiles at zoom level %d', level)
+            preprocessor = self._create_preprocessor(session, layer, batch)
+            tile_size = layer.tile_size
+            n_base_rows, n_base_cols = layer.dimensions[-1]
+            factor = layer.zoom_factor ** (len(layer.dimensions) - 1 - level)
+
+            image_files = session.query(tm.ChannelImageFile).\
+                filter(tm.ChannelImageFile.id.in_(batch['image_file_ids'])).\
+                all()
+            sites = [layer.site_grid[f.site_id] for f in image_files]
+
+            def downsample_image(item):
+                image_file, site = item
+                logger.debug('downsample image %d', image_file.id)
+                pixels = self._preprocess_image(image_file, preprocessor).array
+                height = max(int(round(site.height / float(factor))), 1)
+                width = max(int(round(site.width / float(factor))), 1)
+                # NOTE: OpenCV uses (x, y) instead of (y, x)
+                pixels = cv2.resize(
+                    pixels, (width, height), interpolation=cv2.INTER_AREA
+                )
+                return (
+                    int(round(site.y_offset / float(factor))),
+                    int(round(site.x_offset / float(factor))),
+                    pixels
+                )
+
+            # Each image is read only once. Downsampled images are small, such
+            # that all images of the batch can be kept in memory.
+            # Images are sorted such that pixels of images at the bottom
+            # and/or right get precedence in case neighbouring images overlap.
+            regions = sorted(
+                pool.imap(downsample_image, zip(image_files, sites)),
+                key=lambda r: r[:2]
+            )
+
+            tiles = dict()
+            coordinates = [tuple(b) for b in batch['blocks']]
+            for row, column in coordinates:
+                logger.debug(
+                    'create tile: z=%d, y=%d, x=%d', level, row, column
+                )
+                # Tiles at the lower and right border of the layer are
+                # smaller, like the ones created from the next higher level.
+                height = min(factor, n_base_rows - row * factor) * \
+                    tile_size / factor
+                width = min(factor, n_base_cols - column * factor) * \
+                    tile_size / factor
+                y = row * tile_size
+                x = column * tile_size
+                tile = np.zeros((height, width), dtype=layer.dtype)
+                for iy, ix, pixels in regions:
+                    y_start = max(iy, y)
+                    y_end = min(iy + pixels.shape[0], y + height)
+                    x_start = max(ix, x)
+                    x_end = min(ix + pixels.shape[1], x + width)
+                    if y_start >= y_end or x_start >= x_end:
+                        continue
+                    tile[(y_start-y):(y_end-y), (x_start-x):(x_end-x)] = \
+                        pixels[(y_start-iy):(y_end-iy),
+                               (x_start-ix):(x_end-ix)]
+                if tile.any():
+                    tiles[(row, column)] = tile
+            self._encode_and_store_tiles(
+                layer, level, tiles, store, pool, coordinates
+            )
+
+    def _create_sub_pyramid_tiles(self, batch, assume_clean_state):
+        exp_id = self.experiment_id
+        with tm.utils.ExperimentSession(exp_id, transaction=False) as session, \
+                self._create_tile_store(
+                    session, batch, assume_clean_state
+                ) as store, \
+                _WorkerPool(self.cores) as pool:
+            layer = session.query(tm.ChannelLayer).get(batch['layer_id'])
+            logger.info(
+                'process layer: channel=%s, zplane=%d, tpoint=%d',
+                layer.channel.name, layer.zplane, layer.tpoint
+            )
+            level = batch['level']
+            depth = batch['depth']
+            logger.info(
+                'create tiles at zoom levels %d to %d', level, level - depth
+            )
+            preprocessor = self._create_preprocessor(session, layer, batch)
+            tile_size = layer.tile_size
+            zoom_factor = layer.zoom_factor
+            block_size = zoom_factor ** depth
+
+            # Pixel region of each image at the maximum zoom level.
+            # Images are sorted such that pixels of images at the bottom and/or
+            # right get precedence in case neighbouring images overlap.
+            image_files = session.query(tm.ChannelImageFile).\
+                filter(tm.ChannelImageFile.id.in_(batch['image_file_ids'])).\
+                all()
+            regions = dict()
+            for f in image_files:
+                site = layer.site_grid[f.site_id]
+                regions[f.id] = (
+                    site.y_offset, site.x_offset, site.height, site.width
+                )
+            image_files = sorted(image_files, key=lambda f: regions[f.id][:2])
+
+            def find_intersecting_files(files, y, x, height, width):
+                return [
+                    f for f in files
+                    if regions[f.id][0] < y + height and
+                    regions[f.id][0] + regions[f.id][2] > y and
+                    regions[f.id][1] < x + width and
+                    regions[f.id][1] + regions[f.id][3] > x
+                ]
+
+            block_files = list()
+            for by, bx in batch['blocks']:
+                block_length = block_size * tile_size
+                block_files.append(find_intersecting_files(
+                    image_files, by * block_length, bx * block_length,
+                    block_length, block_length
+                ))
+
+            mosaic = np.zeros(
+                (zoom_factor * tile_size, zoom_factor * tile_size),
+                dtype=layer.dtype
+            )
+            # Images at the border of blocks are also required for the
+            # neighbouring blocks.
+            cache = self._create_image_cache(batch)
+            for i, (by, bx) in enumerate(batch['blocks']):
+                logger.info('process block: y=%d, x=%d', by, bx)
+                image_store = dict()
+
+                tiles = dict()
+                rows = range(
+                    by * block_size,
+                    min((by + 1) * block_size, layer.dimensions[level][0])
+                )
+                cols = range(
+                    bx * block_size,
+                    min((bx + 1) * block_size, layer.dimensions[level][1])
+                )
+                coordinates = list(itertools.product(rows, cols))
+                for row, column in coordinates:
+                    y = row * tile_size
+                    x = column * tile_size
+                    files = find_intersecting_files(
+                        block_files[i], y, x, tile_size, tile_size
                     )
-                    session.add(channel_layer_tile)
+                    if len(files) == 0:
+                        # Tiles at maxzoom level are not created in case they
+                        # don't fall into a region occupied by an image.
+                        continue
+                    logger.debug(
+                        'create tile: z=%d, y=%d, x=%d', level, row, column
+                    )
+                    tile = np.zeros((tile_size, tile_size), dtype=layer.dtype)
+                    for f in files:
+                        if f.id not in image_store:
+                            image_store[f.id] = self._get_preprocessed_image(
+                                cache, f, preprocessor
+                            )
+                        pixels = image_store[f.id].array
+                        iy, ix, ih, iw = regions[f.id]
+                        y_start = max(iy, y)
+                        y_end = min(iy + ih, y + tile_size)
+                        x_start = max(ix, x)
+                        x_end = min(ix + iw, x + tile_size)
+                        tile[(y_start-y):(y_end-y), (x_start-x):(x_end-x)] = \
+                            pixels[(y_start-iy):(y_end-iy),
+                                   (x_start-ix):(x_end-ix)]
+                    if tile.any():
+                        tiles[(row, column)] = tile
+                self._encode_and_store_tiles(
+                    layer, level, tiles, store, pool, coordinates
+                )
+
+                # Cascade down the pyramid within the block without having to
+                # store and reload the tiles of the previous level.
+                for j in range(1, depth + 1):
+                    z = level - j
+                    n = block_size / zoom_factor ** j
+                    rows = range(
+                        by * n, min((by + 1) * n, layer.dimensions[z][0])
+                    )
+                    cols = range(
+                        bx * n, min((bx + 1) * n, layer.dimensions[z][1])
+                    )
+                    lower_tiles = dict()
+                    coordinates = list(itertools.product(rows, cols))
+                    for row, column in coordinates:
+                        pre_coordinates = \
+                            layer.calc_coordinates_of_next_higher_level(
+                                z, row, column
+                            )
+                        if not any(c in tiles for c in pre_coordinates):
+                            # All children are empty, so is the tile.
+                            continue
+                        logger.debug(
+                            'create tile: z=%d, y=%d, x=%d', z, row, column
+                        )
+                        tile = self._downsample_mosaic(
+                            mosaic, row, column, pre_coordinates, tiles,
+                            zoom_factor, tile_size
+                        )
+                        if tile.any():
+                            lower_tiles[(row, column)] = tile
+                    self._encode_and_store_tiles(
+                        layer, z, lower_tiles, store, pool, coordinates
+                    )
+                    tiles = lower_tiles
+
+    @staticmethod
+    def _delete_empty_tile(store, level, row, column):
+        '''Deletes a tile that only consists of background pixels from the
+        store, unless the store is in a clean state. Empty tiles are not
+        stored, such that a tile created by a previous run or by the preview
+        would otherwise keep its previous pixels.
+
+        Parameters
+        ----------
+        store: tmlib.models.tilestore.TileStore
+            store for tiles
+        level: int
+            zero-based zoom level index
+        row: int
+            zero-based row index
+        column: int
+            zero-based column index
+        '''
+        if store.assume_clean_state:
+            return
+        logger.debug('delete empty tile: z=%d, y=%d, x=%d', level, row, column)
+        store.delete(level, row, column)
+
+    @staticmethod
+    def _encode_and_store_tiles(layer, level, tiles, store, pool,
+            coordinates=None):
+        '''Encodes tiles concurrently and adds them to the database.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            parent channel layer
+        level: int
+            zero-based zoom level index of `tiles`
+        tiles: Dict[Tuple[int], numpy.ndarray]
+            pixels of non-empty tiles hashable by row, column coordinates
+        store: tmlib.models.tilestore.TileStore
+            store for tiles
+        pool: tmlib.workflow.illuminati.api._WorkerPool
+            pool of threads for encoding
+        coordinates: List[Tuple[int]], optional
+            row, column coordinates of all processed tiles; those that are
+            not contained in `tiles` are empty and get deleted
+            (see :meth:`_delete_empty_tile
+            <tmlib.workflow.illuminati.api.PyramidBuilder._delete_empty_tile>`)
+        '''
+        layer_id = layer.id
+        codec = layer.codec
+        quality = layer.quality
+
+        def encode_tile(item):
+            (row, column), array = item
+            return tm.ChannelLayerTile(
+                channel_layer_id=layer_id,
+                z=level, y=row, x=column, pixels=PyramidTile(array),
+                codec=codec, quality=quality
+            )
+
+        for channel_layer_tile in pool.imap(encode_tile, tiles.iteritems()):
+            store.add(channel_layer_tile)
+        for row, column in coordinates or list():
+            if (row, column) not in tiles:
+                PyramidBuilder._delete_empty_tile(store, level, row, column)
 
+    @staticmethod
+    def _create_tile_store(session, batch, assume_clean_state):
+        '''Creates a store for the tiles created by a job.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        batch: dict
+            job description
+        assume_clean_state: bool
+            assume that output of previous runs has already been cleaned up
+
+        Returns
+        -------
+        tmlib.models.tilestore.TileStore
+            store using the backend of the processed layer
+        '''
+        # Pack files are named after the run and the job, which makes them
+        # unique among concurrent jobs of the same phase and lets tiles of
+        # later runs and later jobs of the same run (e.g. of the full
+        # resolution levels over those of the preview) take precedence.
+        if batch.get('incremental', False) or batch.get('update', False):
+            # Tiles of previous runs or of the preview get updated.
+            assume_clean_state = False
+        return create_tile_store(
+            session, batch['layer_id'], assume_clean_state,
+            name='%s-job%06d' % (batch.get('build', ''), batch['id'])
+        )
 
     def _create_lower_zoom_level_tiles(self, batch, assume_clean_state):
         exp_id = self.experiment_id
-        with tm.utils.ExperimentSession(exp_id, transaction=False) as session:
+        with tm.utils.ExperimentSession(exp_id, transaction=False) as session, \
+                self._create_tile_store(
+                    session, batch, assume_clean_state
+                ) as store, \
+                _WorkerPool(self.cores) as pool:
             layer = session.query(tm.ChannelLayer).get(batch['layer_id'])
             logger.info('processing layer for channel %s', layer.channel.name)
             level = batch['level']
             logger.info('creating tiles at zoom level %d', batch['level'])
             layer_id = layer.id
             zoom_factor = layer.zoom_factor
+            tile_size = layer.tile_size
+            codec = layer.codec
+            quality = layer.quality
+            dtype = layer.dtype
 
-            for coordinates in batch['coordinates']:
-                row = coordinates[0]
-                column = coordinates[1]
-                pre_coordinates = layer.calc_coordinates_of_next_higher_level(
-                    level, row, column
-                )
+            # The mosaic of higher level tiles gets assembled in a
+            # preallocated buffer, which is reused for each tile created by
+            # the same thread.
+            buffers = threading.local()
+
+            def create_tile(coordinates):
+                row, column = coordinates
                 logger.debug(
                     'creating tile: z=%d, y=%d, x=%d', level, row, column
                 )
-                # Build the mosaic by loading required higher level tiles
-                # (created in a previous run) and stitching them together
-                pre_rows = np.unique([c[0] for c in pre_coordinates])
-                pre_cols = np.unique([c[1] for c in pre_coordinates])
-                for i, r in enumerate(pre_rows):
-                    for j, c in enumerate(pre_cols):
-                        pre_tile = session.query(tm.ChannelLayerTile).\
-                            filter_by(
-                                channel_layer_id=layer_id, z=level+1, y=r, x=c
-                            ).\
-                            one_or_none()
-                        if pre_tile is not None:
-                            pre_tile = pre_tile.pixels
-                        else:
-                            # Tiles at maxzoom level might not exist in
-                            # case they did not fall into a region of
-                            # the map occupied by an image.
-                            # They must exist at the lower zoom levels,
-                            # though, for subsampling.
-                            if batch['index'] > 1:
-                                raise ValueError(
-                                    'Tile "%d-%d-%d" was not created.'
-                                    % (level+1, r, c)
-                                )
-                            logger.debug(
-                                'tile "%d-%d-%d" missing',
-                                 batch['level']+1, r, c
-                            )
-                            pre_tile = PyramidTile.create_as_background()
-                        # We have to temporally treat it as an "image",
-                        # since a tile can per definition not be larger
-                        # than 256x256 pixels.
-                        # FIXME: This can be done more efficiently using
-                        # a predefined array instead of these loops.
-                        img = Image(pre_tile.array)
-                        if j == 0:
-                            row_img = img
-                        else:
-                            row_img = row_img.join(img, 'x')
-                    if i == 0:
-                        mosaic_img = row_img
-                    else:
-                        mosaic_img = mosaic_img.join(row_img, 'y')
-                # Create the tile at the current level by downsampling
-                # the mosaic image, which is composed of the 4 tiles
-                # of the next higher zoom level
-                tile = PyramidTile(mosaic_img.shrink(zoom_factor).array)
-                channel_layer_tile = tm.ChannelLayerTile(
+                # Tiles that only consist of background pixels are not
+                # stored. Missing children are therefore treated as empty
+                # and a tile whose children are all empty is empty as well.
+                children = {
+                    (r, c): PyramidTile.create_from_buffer(
+                        pre_tiles[(r, c)]
+                    ).array
+                    for r, c in pre_coordinates[(row, column)]
+                    if (r, c) in pre_tiles
+                }
+                if not children:
+                    logger.debug('skip background tile')
+                    return ((row, column), None)
+                if not hasattr(buffers, 'mosaic'):
+                    buffers.mosaic = np.zeros(
+                        (zoom_factor * tile_size, zoom_factor * tile_size),
+                        dtype=dtype
+                    )
+                array = self._downsample_mosaic(
+                    buffers.mosaic, row, column, pre_coordinates[(row, column)],
+                    children, zoom_factor, tile_size
+                )
+                if not array.any():
+                    return ((row, column), None)
+                return ((row, column), tm.ChannelLayerTile(
                     channel_layer_id=layer_id,
-                    z=level, y=row, x=column, pixels=tile
+                    z=level, y=row, x=column, pixels=PyramidTile(array),
+                    codec=codec, quality=quality
+                ))
+
+            coordinates = self._expand_tile_ranges(
+                batch['tile_ranges'], layer.dimensions[level][1]
+            )
+            for i in xrange(0, len(coordinates), self._LOWER_LEVEL_CHUNK_SIZE):
+                chunk = coordinates[i:(i + self._LOWER_LEVEL_CHUNK_SIZE)]
+                pre_coordinates = {
+                    (row, column): layer.calc_coordinates_of_next_higher_level(
+                        level, row, column
+                    )
+                    for row, column in chunk
+                }
+                # Load all required higher level tiles (created in a previous
+                # run) at once.
+                pre_tiles = store.get_tiles(
+                    level+1, list(itertools.chain(*pre_coordinates.values()))
                 )
-                session.add(channel_layer_tile)
+                # Tiles get decoded, downsampled and encoded by worker threads,
+                # while the main thread writes them to the database.
+                iterator = pool.imap(create_tile, chunk)
+                for (row, column), channel_layer_tile in iterator:
+                    if channel_layer_tile is not None:
+                        store.add(channel_layer_tile)
+                    else:
+                        self._delete_empty_tile(store, level, row, column)
+
+    @staticmethod
+    def _downsample_mosaic(mosaic, row, column, pre_coordinates, children,
+            zoom_factor, tile_size):
+        '''Assembles the tiles of the next higher zoom level that represent
+        a given tile in a preallocated mosaic buffer and downsamples it.
+
+        Parameters
+        ----------
+        mosaic: numpy.ndarray
+            buffer with `zoom_factor` times `tile_size` pixels along each axis;
+            gets overwritten
+        row: int
+            zero-based row index of the tile at the current zoom level
+        column: int
+            zero-based column index of the tile at the current zoom level
+        pre_coordinates: List[Tuple[int]]
+            row, column coordinates of tiles at the next higher zoom level
+        children: Dict[Tuple[int], numpy.ndarray]
+            pixels of tiles at the next higher zoom level hashable by row,
+            column coordinates; missing tiles are treated as background
+        zoom_factor: int
+            factor by which resolution increases per pyramid level
+        tile_size: int
+            maximal number of pixels along each axis of a tile
+
+        Returns
+        -------
+        numpy.ndarray
+            pixels of the tile at the current zoom level with the data type
+            of `mosaic`
+        '''
+        mosaic[:] = 0
+        height = 0
+        width = 0
+        for r, c in pre_coordinates:
+            y = (r - row * zoom_factor) * tile_size
+            x = (c - column * zoom_factor) * tile_size
+            if (r, c) in children:
+                pixels = children[(r, c)]
+                h, w = pixels.shape
+                mosaic[y:(y+h), x:(x+w)] = pixels
+            else:
+                # Background pixels are already zero.
+                h, w = tile_size, tile_size
+            height = max(height, y + h)
+            width = max(width, x + w)
+        # NOTE: OpenCV uses (x, y) instead of (y, x)
+        return cv2.resize(
+            mosaic[:height, :width],
+            (width / zoom_factor, height / zoom_factor),
+            interpolation=cv2.INTER_AREA
+        )
 
     def run_job(self, batch, assume_clean_state=False):
-        '''Creates 8-bit grayscale JPEG layer tiles.
+        '''Creates 8-bit or 16-bit grayscale layer tiles.
 
         Parameters
         ----------
@@ -582,11 +2094,46 @@ class PyramidBuilder(WorkflowStepAPI):
         assume_clean_state: bool, optional
             assume that output of previous runs has already been cleaned up
         '''
-        if batch['index'] == 0:
+        if batch.get('preview', False):
+            self._create_preview_tiles(batch, assume_clean_state)
+        elif batch.get('depth', 0) > 0:
+            self._create_sub_pyramid_tiles(batch, assume_clean_state)
+        elif 'image_file_ids' in batch:
             self._create_maxzoom_level_tiles(batch, assume_clean_state)
         else:
             self._create_lower_zoom_level_tiles(batch, assume_clean_state)
 
+    @staticmethod
+    def _create_bounding_polygon(offset, image_size):
+        '''Creates the polygon that outlines a rectangular object of the
+        experiment layout, such as a plate, well or site.
+
+        Parameters
+        ----------
+        offset: Tuple[int]
+            *y*, *x* coordinate of the top, left corner of the object
+        image_size: Tuple[int]
+            number of pixels along the vertical and horizontal axis
+
+        Returns
+        -------
+        shapely.geometry.Polygon
+            polygon in map coordinates
+        '''
+        # First element: x axis
+        # Second element: inverted (!) y axis
+        # We further subtract one pixel such that the polygon
+        # defines the exact boundary of the objects. This is
+        # crucial for testing whether other objects intersect with
+        # the border.
+        ul = (offset[1] + 1, -1 * (offset[0] + 1))
+        ll = (ul[0], ul[1] - (image_size[0] - 3))
+        ur = (ul[0] + image_size[1] - 3, ul[1])
+        lr = (ll[0] + image_size[1] - 3, ll[1])
+        # Closed circle with coordinates sorted counter-clockwise
+        contour = np.array([ur, ul, ll, lr, ur])
+        return shapely.geometry.Polygon(contour)
+
     def collect_job_output(self, batch):
         '''Creates :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
         instances for :class:`Site <tmlib.models.site.Site>`,
@@ -603,11 +2150,28 @@ class PyramidBuilder(WorkflowStepAPI):
         batch: dict
             job description
         '''
-        mapobject_mappings = {
-            'Plates': tm.Plate, 'Wells': tm.Well, 'Sites': tm.Site
-        }
-        for name, cls in mapobject_mappings.iteritems():
-            with tm.utils.ExperimentSession(self.experiment_id, transaction=False) as session:
+        with tm.utils.ExperimentSession(self.experiment_id, transaction=False) as session:
+            # Offsets of all plates, wells and sites are computed at once,
+            # such that no model instances need to be loaded.
+            logger.info('load experiment layout')
+            layout = tm.ExperimentLayout(session)
+            # We need to account for the "multiplexing" edge case for sites.
+            mapobject_mappings = [
+                ('Plates', tm.Plate, zip(
+                    layout.plate_ids.tolist(), layout.plate_offsets.tolist(),
+                    layout.plate_image_sizes.tolist()
+                )),
+                ('Wells', tm.Well, zip(
+                    layout.well_ids.tolist(), layout.well_offsets.tolist(),
+                    layout.well_image_sizes.tolist()
+                )),
+                ('Sites', tm.Site, zip(
+                    layout.site_ids.tolist(),
+                    layout.aligned_site_offsets.tolist(),
+                    layout.aligned_site_image_sizes.tolist()
+                ))
+            ]
+            for name, cls, objects in mapobject_mappings:
                 logger.info(
                     'create static mapobject type "%s" for reference type "%s"',
                     name, cls.__name__
@@ -620,54 +2184,53 @@ class PyramidBuilder(WorkflowStepAPI):
                 segmentation_layer = session.get_or_create(
                     tm.SegmentationLayer, mapobject_type_id=mapobject_type_id
                 )
-
-                logger.info('create individual mapobjects of type "%s"', name)
-                segmentations = dict()
-                for obj in session.query(cls):
-                    logger.debug(
-                        'create mapobject for reference object #%d', obj.id
-                    )
-                    if name == 'Sites':
-                        # We need to account for the "multiplexing" edge case.
-                        offset = obj.aligned_offset
-                        image_size = obj.aligned_image_size
-                    else:
-                        offset = obj.offset
-                        image_size = obj.image_size
-                    # First element: x axis
-                    # Second element: inverted (!) y axis
-                    # We further subtract one pixel such that the polygon
-                    # defines the exact boundary of the objects. This is
-                    # crucial for testing whether other objects intersect with
-                    # the border.
-                    ul = (offset[1] + 1, -1 * (offset[0] + 1))
-                    ll = (ul[0], ul[1] - (image_size[0] - 3))
-                    ur = (ul[0] + image_size[1] - 3, ul[1])
-                    lr = (ll[0] + image_size[1] - 3, ll[1])
-                    # Closed circle with coordinates sorted counter-clockwise
-                    contour = np.array([ur, ul, ll, lr, ur])
-                    polygon = shapely.geometry.Polygon(contour)
-                    segmentations[obj.id] = {
-                        'segmentation_layer_id': segmentation_layer.id,
-                        'polygon': polygon
-                    }
+                segmentation_layer_id = segmentation_layer.id
 
                 logger.debug('delete existing mapobjects of type "%s"', name)
                 session.query(tm.Mapobject).\
                     filter_by(mapobject_type_id=mapobject_type_id).\
                     delete()
-                logger.debug('add new mapobjects of type "%s"', name)
-                for key, value in segmentations.iteritems():
-                    mapobject = tm.Mapobject(
+
+                logger.info(
+                    'add %d mapobjects of type "%s"', len(objects), name
+                )
+                mapobjects = [
+                    tm.Mapobject(
                         partition_key=key, mapobject_type_id=mapobject_type_id
                     )
-                    session.add(mapobject)
-                    session.flush()
-                    logger.debug('add mapobject #%d', mapobject.id)
-                    mapobject_segmentation = tm.MapobjectSegmentation(
-                        partition_key=key, mapobject_id=mapobject.id,
-                        geom_polygon=value['polygon'],
-                        geom_centroid=value['polygon'].centroid,
-                        segmentation_layer_id=value['segmentation_layer_id'],
+                    for key, offset, image_size in objects
+                ]
+                # IDs of all mapobjects get reserved with a single query.
+                session.bulk_ingest(mapobjects)
+
+                logger.info(
+                    'add segmentations for mapobjects of type "%s"', name
+                )
+                mapobject_segmentations = list()
+                for i, (key, offset, image_size) in enumerate(objects):
+                    polygon = self._create_bounding_polygon(offset, image_size)
+                    mapobject_segmentations.append(
+                        tm.MapobjectSegmentation(
+                            partition_key=key,
+                            mapobject_id=mapobjects[i].id,
+                            geom_polygon=polygon,
+                            geom_centroid=polygon.centroid,
+                            segmentation_layer_id=segmentation_layer_id
+                        )
+                    )
+                session.bulk_ingest(mapobject_segmentations)
+
+        with tm.utils.ExperimentSession(self.experiment_id) as session:
+            # All jobs completed successfully, such that fingerprints of the
+            # current run can replace those of the previous run.
+            for layer in session.query(tm.ChannelLayer):
+                filename = self._get_fingerprints_filename(layer, pending=True)
+                if os.path.exists(filename):
+                    logger.debug(
+                        'record fingerprints of channel layer %d', layer.id
+                    )
+                    os.rename(
+                        filename, self._get_fingerprints_filename(layer)
                     )
-                    session.add(mapobject_segmentation)
+                    # Cached tiles of the previous revision are outdated.
+                    layer.revision = (layer.revision or 0) + 1
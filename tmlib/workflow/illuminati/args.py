@@ -25,7 +25,43 @@ class IlluminatiBatchArguments(BatchArguments):
 
     batch_size = Argument(
         type=int, default=100, flag='batch-size', short_flag='b',
-        help='number of image files that should be processed per job'
+        help='''approximate number of image files that should be processed per
+            job; jobs of lower zoom levels are sized to take roughly as long
+        '''
+    )
+
+    job_duration = Argument(
+        type=int, flag='job-duration',
+        help='''targeted duration of a job in seconds; work of each zoom level
+            gets distributed across jobs based on an estimate of the
+            duration of creating each tile (defaults to the estimated
+            duration of processing "batch_size" image files)
+        '''
+    )
+
+    lower_level_job_duration = Argument(
+        type=int, flag='lower-level-job-duration',
+        help='''targeted duration in seconds of a job that creates tiles of a
+            zoom level below the base level from tiles of the next higher
+            level (defaults to the targeted duration of base level jobs)
+        '''
+    )
+
+    image_cost = Argument(
+        type=float, flag='image-cost',
+        help='''estimated duration in seconds of reading and preprocessing an
+            image file; can be calibrated with the durations of base level
+            jobs of a previous run (defaults to 0.5)
+        '''
+    )
+
+    tile_cost = Argument(
+        type=float, flag='tile-cost',
+        help='''estimated duration in seconds of creating and encoding a tile
+            of 256 x 256 pixels; can be calibrated with the durations of
+            lower level jobs of a previous run, estimates of the other
+            operations on tiles are scaled accordingly (defaults to 0.02)
+        '''
     )
 
     align = Argument(
@@ -57,6 +93,73 @@ class IlluminatiBatchArguments(BatchArguments):
         '''
     )
 
+    incremental = Argument(
+        type=bool, default=False,
+        help='''whether existing channel layers should be updated rather than
+            rebuilt, i.e. only tiles whose input images, alignment or
+            intensity range changed since the previous run get recreated
+        '''
+    )
+
+    image_cache_size = Argument(
+        type=int, default=1000, flag='image-cache-size',
+        help='''maximal amount of memory in megabytes that a job should use
+            for caching of preprocessed images
+        '''
+    )
+
+    codec = Argument(
+        type=str, default='jpeg', choices={'jpeg', 'webp', 'png'},
+        help='''codec that should be used to encode tiles; "png" is lossless
+        '''
+    )
+
+    bit_depth = Argument(
+        type=int, default=8, choices={8, 16}, flag='bit-depth',
+        help='''bit depth of tiles; 16-bit tiles keep intensities of 16-bit
+            images at original bit depth and get encoded as PNG, such that
+            intensities are only clipped and rescaled upon display and the
+            contrast can be changed without rebuilding the pyramid
+        '''
+    )
+
+    tile_backend = Argument(
+        type=str, default='database', choices={'database', 'packfile'},
+        flag='tile-backend',
+        help='''backend that should store tiles; "packfile" writes tiles to
+            append-only pack files on the shared file system rather than
+            to the database
+        '''
+    )
+
+    quality = Argument(
+        type=int,
+        help='''quality of the encoding of tiles; in the range [0, 100] for
+            "jpeg" and "webp" and compression level in the range [0, 9]
+            for "png" (defaults to 95 for "jpeg" and "webp" and to 3 for "png")
+        '''
+    )
+
+    preview_factor = Argument(
+        type=int, flag='preview-factor',
+        help='''factor by which images should be downsampled to build a
+            preview of the pyramid, e.g. 16; the preview level and the levels
+            above it are built first directly from downsampled images, such
+            that the pyramid can be browsed before the full resolution levels
+            are complete; must be a power of the zoom factor
+            (by default no preview is built)
+        '''
+    )
+
+    sub_pyramid_depth = Argument(
+        type=int, default=0, flag='sub-pyramid-depth',
+        help='''number of zoom levels below the base level that should be
+            built in memory by the same job as the base level; base level
+            tiles are processed in blocks of 2^depth x 2^depth tiles
+            (by default each level is created in a separate run)
+        '''
+    )
+
 @register_step_submission_args('illuminati')
 class IlluminatiSubmissionArguments(SubmissionArguments):
 
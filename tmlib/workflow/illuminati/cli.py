@@ -16,6 +16,8 @@
 import logging
 
 from tmlib.utils import assert_type
+from tmlib.workflow import climethod
+from tmlib.workflow.args import Argument
 from tmlib.workflow.cli import WorkflowStepCLI
 
 logger = logging.getLogger(__name__)
@@ -35,3 +37,31 @@ class Illuminati(WorkflowStepCLI):
         '''
         super(Illuminati, self).__init__(api_instance, verbosity)
 
+    @climethod(help=WorkflowStepCLI.init.help)
+    def init(self):
+        # In incremental mode, existing channel layers and their tiles are
+        # kept, such that only tiles whose inputs changed get recreated.
+        self.api_instance.keep_layers = self._batch_args.incremental
+        super(Illuminati, self).init()
+
+    @climethod(
+        help='runs an invidiual batch job on the local machine',
+        job_id=Argument(
+            type=int, help='ID of the job that should be run',
+            flag='job', short_flag='j'
+        ),
+        assume_clean_state=Argument(
+            type=bool,
+            help='assume that previous outputs have been cleaned up',
+            flag='assume-clean-state', default=False
+        ),
+        cores=Argument(
+            type=int, default=1,
+            help='number of cores that should be used for creation of tiles'
+        )
+    )
+    def run(self, job_id, assume_clean_state, cores):
+        # Cores allocated to a job are only known upon submission, therefore
+        # they are not part of the job description.
+        self.api_instance.cores = cores
+        super(Illuminati, self).run(job_id, assume_clean_state)
@@ -0,0 +1,281 @@
+import collections
+
+import numpy as np
+import pytest
+
+from tmlib.workflow.illuminati.api import PyramidBuilder
+from tmlib.workflow.illuminati.api import _WorkerPool
+
+
+def test_partition_by_cost_empty():
+    assert PyramidBuilder._partition_by_cost([], 1.0) == []
+
+
+def test_partition_by_cost_zero_total_cost():
+    assert PyramidBuilder._partition_by_cost([0, 0, 0], 1.0) == [(0, 3)]
+
+
+def test_partition_by_cost_target_exceeds_total_cost():
+    assert PyramidBuilder._partition_by_cost([1, 2, 3], 100.0) == [(0, 3)]
+
+
+def test_partition_by_cost_dominant_item():
+    ranges = PyramidBuilder._partition_by_cost([1, 90, 1, 1, 1], 30.0)
+    assert ranges == [(0, 1), (1, 2), (2, 5)]
+
+
+def test_partition_by_cost_one_range_per_item():
+    ranges = PyramidBuilder._partition_by_cost([1, 1, 1, 1], 1.0)
+    assert ranges == [(0, 1), (1, 2), (2, 3), (3, 4)]
+
+
+def test_partition_by_cost_ranges_are_contiguous():
+    costs = [3, 0, 5, 1, 1, 0, 0, 8, 2, 4]
+    ranges = PyramidBuilder._partition_by_cost(costs, 6.0)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(costs)
+    for (start, stop), (next_start, _) in zip(ranges[:-1], ranges[1:]):
+        assert start < stop == next_start
+
+
+def _round_trip(coordinates, n_cols):
+    indices = np.array(
+        sorted(y * n_cols + x for y, x in coordinates), dtype=np.int64
+    )
+    tile_ranges = PyramidBuilder._compress_tile_ranges(indices)
+    return tile_ranges, PyramidBuilder._expand_tile_ranges(tile_ranges, n_cols)
+
+
+def test_tile_ranges_empty():
+    tile_ranges, coordinates = _round_trip([], 3)
+    assert tile_ranges == []
+    assert coordinates == []
+
+
+def test_tile_ranges_single_tile():
+    tile_ranges, coordinates = _round_trip([(1, 1)], 3)
+    assert tile_ranges == [[4, 5]]
+    assert coordinates == [(1, 1)]
+
+
+def test_tile_ranges_gaps():
+    tiles = [(0, 0), (0, 1), (0, 2), (1, 2), (1, 3), (2, 1)]
+    tile_ranges, coordinates = _round_trip(tiles, 4)
+    assert tile_ranges == [[0, 3], [6, 8], [9, 10]]
+    assert coordinates == tiles
+
+
+def test_tile_ranges_row_wraparound():
+    tiles = [(0, 1), (0, 2), (1, 0), (1, 1)]
+    tile_ranges, coordinates = _round_trip(tiles, 3)
+    assert tile_ranges == [[1, 5]]
+    assert coordinates == tiles
+
+
+_Args = collections.namedtuple('_Args', ['align', 'illumcorr'])
+
+
+class _Layer(object):
+
+    def __init__(self, location, tile_map):
+        self.id = 1
+        self.location = location
+        self.base_tile_coordinate_to_image_file_map = tile_map
+        self.dimensions = [(1, 1), (2, 2), (3, 4)]
+        self.zoom_factor = 2
+        self.channel_id = 1
+        self.tpoint = 0
+        self.zplane = 0
+        self.codec = 'jpeg'
+        self.quality = None
+        self.tile_backend = 'database'
+        self.bit_depth = 8
+        self.min_intensity = 0
+        self.max_intensity = 1000
+
+    @property
+    def is_high_bit_depth(self):
+        return self.bit_depth == 16
+
+
+class _Store(object):
+
+    def __init__(self, assume_clean_state=False):
+        self.assume_clean_state = assume_clean_state
+        self.deleted = list()
+
+    def delete(self, z, y, x):
+        self.deleted.append((z, y, x))
+
+
+_TILE_MAP = {(0, 0): [1], (0, 1): [1, 2], (1, 1): [3], (2, 2): [4]}
+
+
+@pytest.fixture
+def builder():
+    # Fingerprints don't depend on the state of the builder
+    return PyramidBuilder.__new__(PyramidBuilder)
+
+
+def _calculate_fingerprints(builder, layer):
+    return builder._calculate_fingerprints(None, layer, _Args(False, False))
+
+
+def _find_dirty_tiles(builder, tmpdir, previous_tile_map, tile_map):
+    layer = _Layer(str(tmpdir), previous_tile_map)
+    builder._save_fingerprints(layer, _calculate_fingerprints(builder, layer))
+    layer = _Layer(str(tmpdir), tile_map)
+    fingerprints = _calculate_fingerprints(builder, layer)
+    return builder._find_dirty_tiles(layer, fingerprints), fingerprints
+
+
+def test_calculate_fingerprints(builder, tmpdir):
+    fingerprints = _calculate_fingerprints(
+        builder, _Layer(str(tmpdir), _TILE_MAP)
+    )
+    assert fingerprints.shape == (3, 4)
+    assert set(zip(*np.nonzero(fingerprints))) == set(_TILE_MAP)
+    assert np.all(fingerprints >= 0)
+    assert len(set(fingerprints[fingerprints > 0])) == len(_TILE_MAP)
+
+
+def test_calculate_fingerprints_depend_on_intensity_range(builder, tmpdir):
+    layer = _Layer(str(tmpdir), _TILE_MAP)
+    fingerprints = _calculate_fingerprints(builder, layer)
+    layer.max_intensity = 2000
+    changed = _calculate_fingerprints(builder, layer) != fingerprints
+    assert set(zip(*np.nonzero(changed))) == set(_TILE_MAP)
+
+
+def test_calculate_fingerprints_high_bit_depth(builder, tmpdir):
+    # Intensities of 16-bit tiles are only clipped upon display
+    layer = _Layer(str(tmpdir), _TILE_MAP)
+    layer.bit_depth = 16
+    fingerprints = _calculate_fingerprints(builder, layer)
+    layer.max_intensity = 2000
+    np.testing.assert_array_equal(
+        _calculate_fingerprints(builder, layer), fingerprints
+    )
+
+
+def test_find_dirty_tiles_without_previous_run(builder, tmpdir):
+    layer = _Layer(str(tmpdir), _TILE_MAP)
+    fingerprints = _calculate_fingerprints(builder, layer)
+    assert builder._find_dirty_tiles(layer, fingerprints) is None
+
+
+def test_find_dirty_tiles_size_changed(builder, tmpdir):
+    layer = _Layer(str(tmpdir), _TILE_MAP)
+    builder._save_fingerprints(layer, _calculate_fingerprints(builder, layer))
+    layer.dimensions = [(1, 1), (2, 3), (3, 5)]
+    fingerprints = np.zeros((3, 5), dtype=np.int64)
+    assert builder._find_dirty_tiles(layer, fingerprints) is None
+
+
+def test_find_dirty_tiles_unchanged(builder, tmpdir):
+    dirty_tiles, _ = _find_dirty_tiles(builder, tmpdir, _TILE_MAP, _TILE_MAP)
+    assert dirty_tiles == {0: set(), 1: set(), 2: set()}
+
+
+def test_find_dirty_tiles_image_changed(builder, tmpdir):
+    tile_map = dict(_TILE_MAP)
+    tile_map[(1, 1)] = [5]
+    dirty_tiles, fingerprints = _find_dirty_tiles(
+        builder, tmpdir, _TILE_MAP, tile_map
+    )
+    assert dirty_tiles == {0: {(0, 0)}, 1: {(0, 0)}, 2: {(1, 1)}}
+    assert PyramidBuilder._find_empty_tiles(dirty_tiles[2], fingerprints) == []
+
+
+def test_find_dirty_tiles_image_added(builder, tmpdir):
+    tile_map = dict(_TILE_MAP)
+    tile_map[(2, 3)] = [6]
+    tile_map[(2, 2)] = [4, 6]
+    dirty_tiles, fingerprints = _find_dirty_tiles(
+        builder, tmpdir, _TILE_MAP, tile_map
+    )
+    assert dirty_tiles == {0: {(0, 0)}, 1: {(1, 1)}, 2: {(2, 2), (2, 3)}}
+    assert PyramidBuilder._find_empty_tiles(dirty_tiles[2], fingerprints) == []
+
+
+def test_find_dirty_tiles_image_removed(builder, tmpdir):
+    tile_map = dict(_TILE_MAP)
+    del tile_map[(1, 1)]
+    tile_map[(0, 1)] = [2]
+    del tile_map[(2, 2)]
+    dirty_tiles, fingerprints = _find_dirty_tiles(
+        builder, tmpdir, _TILE_MAP, tile_map
+    )
+    assert dirty_tiles == {
+        0: {(0, 0)}, 1: {(0, 0), (1, 1)}, 2: {(0, 1), (1, 1), (2, 2)}
+    }
+    empty_tiles = PyramidBuilder._find_empty_tiles(
+        dirty_tiles[2], fingerprints
+    )
+    assert empty_tiles == [[1, 1], [2, 2]]
+
+
+def test_delete_empty_tile():
+    store = _Store()
+    PyramidBuilder._delete_empty_tile(store, 2, 1, 1)
+    assert store.deleted == [(2, 1, 1)]
+
+
+def test_delete_empty_tile_clean_state():
+    store = _Store(assume_clean_state=True)
+    PyramidBuilder._delete_empty_tile(store, 2, 1, 1)
+    assert store.deleted == []
+
+
+def test_encode_and_store_tiles_deletes_empty_tiles(tmpdir):
+    store = _Store()
+    layer = _Layer(str(tmpdir), _TILE_MAP)
+    with _WorkerPool(1) as pool:
+        PyramidBuilder._encode_and_store_tiles(
+            layer, 1, {}, store, pool, [(0, 0), (1, 1)]
+        )
+    assert store.deleted == [(1, 0, 0), (1, 1, 1)]
+
+
+def test_get_run_phases():
+    phases = PyramidBuilder._get_run_phases(6, 2)
+    assert phases == [
+        (0, 5, False, False), (1, 2, False, False),
+        (2, 1, False, False), (3, 0, False, False)
+    ]
+
+
+def test_get_run_phases_without_sub_pyramids():
+    phases = PyramidBuilder._get_run_phases(3, 0)
+    assert phases == [
+        (0, 2, False, False), (1, 1, False, False), (2, 0, False, False)
+    ]
+
+
+def test_get_run_phases_with_preview():
+    phases = PyramidBuilder._get_run_phases(6, 2, preview_level=1)
+    assert phases == [
+        (0, 1, True, False), (1, 0, True, False),
+        (2, 5, False, False), (3, 2, False, False),
+        (4, 1, False, True), (5, 0, False, True)
+    ]
+
+
+def test_get_run_phases_with_preview_within_sub_pyramids():
+    phases = PyramidBuilder._get_run_phases(6, 2, preview_level=3)
+    assert phases == [
+        (0, 3, True, False), (1, 2, True, False),
+        (2, 1, True, False), (3, 0, True, False),
+        (4, 5, False, True), (5, 2, False, True),
+        (6, 1, False, True), (7, 0, False, True)
+    ]
+
+
+def test_get_run_phases_levels_are_built_after_preview():
+    # Tiles of the full build must be written after those of the preview
+    phases = PyramidBuilder._get_run_phases(8, 3, preview_level=2)
+    preview = {level: index for index, level, p, _ in phases if p}
+    for index, level, p, update in phases:
+        if not p and level in preview:
+            assert index > preview[level]
+            assert update
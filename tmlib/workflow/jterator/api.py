@@ -18,9 +18,12 @@ import re
 import sys
 import shutil
 import logging
+import threading
+import Queue
 import subprocess
 import numpy as np
 import pandas as pd
+import itertools
 import collections
 import shapely.geometry
 import shapely.ops
@@ -35,10 +38,15 @@ from gc3libs.quantity import Duration, Memory
 import tmlib.models as tm
 from tmlib.utils import autocreate_directory_property
 from tmlib.utils import flatten
+from tmlib.image import ImagePreprocessor
+from tmlib.image import PyramidTile
 from tmlib.readers import TextReader
 from tmlib.readers import ImageReader
 from tmlib.writers import TextWriter
+from tmlib.writers import ImageWriter
 from tmlib.models.types import ST_GeomFromText
+from tmlib.models.tilestore import PackFileTileStore
+from tmlib.models.tilestore import TileRecord
 from tmlib.workflow.api import WorkflowStepAPI
 from tmlib.errors import PipelineDescriptionError
 from tmlib.errors import JobDescriptionError
@@ -58,6 +66,10 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
 
     '''Class for running image analysis pipelines.'''
 
+    #: int: maximal number of sites that are buffered between the stages of
+    #: a pipelined job, in addition to the site each stage is working on
+    _PIPELINE_QUEUE_SIZE = 1
+
     def __init__(self, experiment_id, pipeline_description=None,
             handles_descriptions=None):
         '''
@@ -218,7 +230,8 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 yield {
                     'id': j + 1,  # job IDs are one-based!
                     'site_ids': batch,
-                    'plot': args.plot
+                    'plot': args.plot,
+                    'pipelined': args.pipelined
                 }
 
     def delete_previous_job_output(self):
@@ -238,6 +251,19 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 filter(tm.Mapobject.mapobject_type_id.in_(mapobject_type_ids)).\
                 delete()
 
+            # Run jobs write raster tiles of the base level, so tiles of
+            # previous runs need to be removed beforehand.
+            logger.info('delete existing raster tiles')
+            segmentation_layers = session.query(tm.SegmentationLayer).\
+                filter(
+                    tm.SegmentationLayer.mapobject_type_id.in_(
+                        mapobject_type_ids
+                    )
+                ).\
+                all()
+            for layer in segmentation_layers:
+                tm.utils.delete_location(layer.location)
+
     def _load_pipeline_input(self, site_id):
         logger.info('load pipeline inputs')
         # Use an in-memory store for pipeline data and only insert outputs
@@ -304,6 +330,8 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                     stats = stats_file.get()
                 else:
                     stats = None
+                # Images get shifted and cropped!
+                preprocessor = ImagePreprocessor(stats, align=True, crop=True)
 
                 logger.info('load images for channel "%s"', ch.name)
                 image_files = session.query(tm.ChannelImageFile).\
@@ -313,10 +341,10 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                     logger.info('load image %d', f.id)
                     img = f.get()
                     if ch.correct:
-                        logger.info('correct image %d', f.id)
-                        img = img.correct(stats)
-                    logger.debug('align image %d', f.id)
-                    img = img.align()  # shifted and cropped!
+                        logger.info('correct and align image %d', f.id)
+                    else:
+                        logger.debug('align image %d', f.id)
+                    img = preprocessor.process(img)
                     image_array[:, :, f.zplane, f.tpoint] = img.array
                 store['pipe'][ch.name] = image_array
 
@@ -324,21 +352,19 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 mapobject_type = session.query(tm.MapobjectType).\
                     filter_by(name=obj.name).\
                     one()
-                polygons = list()
-                for t in sorted(tpoints):
-                    zpolys = list()
-                    for z in sorted(zplanes):
-                        zpolys.append(
-                            mapobject_type.get_segmentations_per_site(
-                                site_id=site.id, tpoint=t, zplane=z
-                            )
+                logger.info('load objects of type "%s"', obj.name)
+                label_array = np.zeros(
+                    (height, width, n_zplanes, n_tpoints), np.int32
+                )
+                for t, z in itertools.product(tpoints, zplanes):
+                    label_array[:, :, z, t] = \
+                        mapobject_type.get_label_image_per_site(
+                            site.id, t, z, y_offset, x_offset,
+                            (height, width), cache=obj.cache
                         )
-                    polygons.append(zpolys)
 
                 segm_obj = SegmentedObjects(obj.name, obj.name)
-                segm_obj.add_polygons(
-                    polygons, y_offset, x_offset, (height, width)
-                )
+                segm_obj.value = label_array
                 store['objects'][segm_obj.name] = segm_obj
                 store['pipe'][segm_obj.name] = segm_obj.value
 
@@ -392,6 +418,7 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
             as_polygons = item.as_polygons
             store['objects'][item.name].save = True
             store['objects'][item.name].represent_as_polygons = as_polygons
+            store['objects'][item.name].represent_as_raster = item.as_raster
 
         with tm.utils.ExperimentSession(self.experiment_id, False) as session:
             layer = session.query(tm.ChannelLayer).first()
@@ -533,11 +560,42 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 logger.info('insert segmentations into database')
                 session.bulk_ingest(mapobject_segmentations)
 
+                if segm_objs.represent_as_raster:
+                    # Raster tiles of the base level that lie within the site
+                    # are created right away. Outlines are saved for tiles
+                    # that overlap other sites, which are rendered in the
+                    # collect phase together with lower levels.
+                    logger.info(
+                        'save outlines of objects of type "%s"', obj_name
+                    )
+                    for t, z, outlines in segm_objs.iter_outlines():
+                        segmentation_layer = session.query(
+                                tm.SegmentationLayer
+                            ).\
+                            get(segmentation_layer_ids[(obj_name, t, z)])
+                        filename = segmentation_layer.get_outlines_filename(
+                            store['site_id']
+                        )
+                        if outlines.any():
+                            with ImageWriter(filename) as f:
+                                f.write(outlines)
+                        elif os.path.exists(filename):
+                            # Outlines of a previous run are obsolete.
+                            os.remove(filename)
+                        raster_store = PackFileTileStore(
+                            session, segmentation_layer, assume_clean_state,
+                            name='site%d' % store['site_id']
+                        )
+                        with raster_store:
+                            self._add_site_raster_tiles(
+                                raster_store, segmentation_layer, outlines,
+                                y_offset, x_offset
+                            )
+
                 logger.info(
                     'add feature values for objects of type "%s"', obj_name
                 )
                 logger.debug('round feature values to 6 decimals')
-                feature_values = list()
                 for t, data in enumerate(segm_objs.measurements):
                     data = data.round(6)  # single!
                     if data.empty:
@@ -549,24 +607,19 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                     elif data.shape[0] > len(mapobject_ids):
                         # Not sure this could happen.
                         logger.error('too many feature values')
-                    column_lut = feature_ids[obj_name]
-                    for label, c in data.rename(columns=column_lut).iterrows():
-                        logger.debug(
-                            'add values for mapobject #%d at time point %d',
-                            label, t
-                        )
-                        values = dict(
-                            zip(c.index.astype(str), c.values.astype(str))
-                        )
-                        feature_values.append(
-                            tm.FeatureValues(
-                                partition_key=store['site_id'],
-                                mapobject_id=mapobject_ids[label],
-                                tpoint=t, values=values
-                            )
-                        )
-                logger.debug('insert feature values into db table')
-                session.bulk_ingest(feature_values)
+                    # Values are ingested directly from the data frame with
+                    # rows indexed by mapobject ID and columns labeled by
+                    # feature ID.
+                    data = data.rename(columns=feature_ids[obj_name])
+                    data.index = [mapobject_ids[label] for label in data.index]
+                    logger.debug(
+                        'insert feature values of %d mapobjects at time point '
+                        '%d into db table', data.shape[0], t
+                    )
+                    session.bulk_ingest_frame(
+                        tm.FeatureValues, data,
+                        partition_key=store['site_id'], tpoint=t
+                    )
 
     def create_debug_run_phase(self, submission_id):
         '''Creates a job collection for the debug "run" phase of the step.
@@ -669,6 +722,10 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
 
         self.start_engines()
 
+        if batch.get('pipelined', False) and not batch['plot']:
+            self._run_pipelined(batch['site_ids'], assume_clean_state)
+            return
+
         # Enable debugging of pipelines by providing the full path to images.
         # This requires a work around for "plot" and "job_id" arguments.
         for site_id in batch['site_ids']:
@@ -677,6 +734,106 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
             store = self._run_pipeline(store, site_id, batch['plot'])
             self._save_pipeline_outputs(store, assume_clean_state)
 
+    def _run_pipelined(self, site_ids, assume_clean_state):
+        '''Processes sites in three overlapping stages: a loader thread
+        loads the input of the next site and a writer thread saves the
+        outputs of the previous site, while the pipeline runs in the main
+        thread. Stages are connected by bounded queues (see
+        :attr:`_PIPELINE_QUEUE_SIZE
+        <tmlib.workflow.jterator.api.ImageAnalysisPipelineEngine._PIPELINE_QUEUE_SIZE>`),
+        such that memory consumption doesn't grow with the number of sites.
+
+        Parameters
+        ----------
+        site_ids: List[int]
+            IDs of sites that should be processed
+        assume_clean_state: bool
+            assume that output of previous runs has already been cleaned up
+
+        Note
+        ----
+        Modules are only run in the main thread, because the engines of
+        other languages are not thread-safe. Loader and writer use separate
+        database sessions.
+        '''
+        inputs = Queue.Queue(self._PIPELINE_QUEUE_SIZE)
+        outputs = Queue.Queue(self._PIPELINE_QUEUE_SIZE)
+        stop = threading.Event()
+        failures = list()
+
+        def put(queue, item):
+            # Give up once another stage failed, because nobody may consume.
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=1)
+                    return
+                except Queue.Full:
+                    continue
+
+        def get(queue):
+            # Returns None once another stage failed.
+            while not stop.is_set():
+                try:
+                    return queue.get(timeout=1)
+                except Queue.Empty:
+                    continue
+            return None
+
+        def load():
+            try:
+                for site_id in site_ids:
+                    if stop.is_set():
+                        return
+                    logger.info('load input of site %d', site_id)
+                    put(inputs, (site_id, self._load_pipeline_input(site_id)))
+            except Exception:
+                logger.error('loading of input failed')
+                failures.append(sys.exc_info())
+                stop.set()
+            finally:
+                put(inputs, None)
+
+        def save():
+            try:
+                while True:
+                    item = get(outputs)
+                    if item is None:
+                        return
+                    site_id, store = item
+                    logger.info('save outputs of site %d', site_id)
+                    self._save_pipeline_outputs(store, assume_clean_state)
+            except Exception:
+                logger.error('saving of outputs failed')
+                failures.append(sys.exc_info())
+                stop.set()
+
+        loader = threading.Thread(target=load, name='jterator-loader')
+        writer = threading.Thread(target=save, name='jterator-writer')
+        loader.daemon = True
+        writer.daemon = True
+        loader.start()
+        writer.start()
+        try:
+            while True:
+                item = get(inputs)
+                if item is None:
+                    break
+                site_id, store = item
+                logger.info('process site %d', site_id)
+                store = self._run_pipeline(store, site_id)
+                put(outputs, (site_id, store))
+        except Exception:
+            failures.append(sys.exc_info())
+            stop.set()
+        finally:
+            # Signals the writer that all outputs have been queued.
+            put(outputs, None)
+            loader.join()
+            writer.join()
+        if failures:
+            except_type, except_value, except_trace = failures[0]
+            raise except_type, except_value, except_trace
+
     def collect_job_output(self, batch):
         '''Computes the optimal representation of each
         :class:`SegmentationLayer <tmlib.models.layer.SegmentationLayer>` on the
@@ -750,6 +907,309 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                     filter(tm.Mapobject.id.in_(mapobject_ids)).\
                     delete()
 
+            raster_representation_lut = {
+                o.name: o.as_raster
+                for o in self.project.pipe.description.output.objects
+            }
+            layout = None
+            for layer in segmentation_layers:
+                if layer.tpoint is None or layer.zplane is None:
+                    continue
+                as_raster = raster_representation_lut.get(
+                    layer.mapobject_type.name, False
+                )
+                if as_raster:
+                    if layout is None:
+                        layout = tm.ExperimentLayout(session)
+                    logger.info(
+                        'create raster tiles for segmentation layer %d',
+                        layer.id
+                    )
+                    self._create_raster_tiles(session, layer, layout)
+                layer.has_raster_tiles = as_raster
+                session.flush()
+
+    @staticmethod
+    def _get_raster_tile_coordinates(y_offset, x_offset, height, width,
+            tile_size, dimensions):
+        '''Determines the tiles of a zoom level that intersect with an image.
+
+        Parameters
+        ----------
+        y_offset: int
+            *y* coordinate of the top, left corner of the image
+        x_offset: int
+            *x* coordinate of the top, left corner of the image
+        height: int
+            number of pixels along the vertical axis of the image
+        width: int
+            number of pixels along the horizontal axis of the image
+        tile_size: int
+            number of pixels along each axis of a tile
+        dimensions: Tuple[int]
+            number of tiles along the vertical and horizontal axis of the
+            zoom level
+
+        Returns
+        -------
+        List[Tuple[int]]
+            row, column coordinates of tiles
+        '''
+        rows = range(
+            y_offset // tile_size,
+            min((y_offset + height - 1) // tile_size + 1, dimensions[0])
+        )
+        columns = range(
+            x_offset // tile_size,
+            min((x_offset + width - 1) // tile_size + 1, dimensions[1])
+        )
+        return list(itertools.product(rows, columns))
+
+    @staticmethod
+    def _get_contained_raster_tile_coordinates(y_offset, x_offset, height,
+            width, tile_size, dimensions):
+        '''Determines the tiles of a zoom level that lie completely within an
+        image, i.e. that don't intersect with any other site.
+
+        Parameters
+        ----------
+        y_offset: int
+            *y* coordinate of the top, left corner of the image
+        x_offset: int
+            *x* coordinate of the top, left corner of the image
+        height: int
+            number of pixels along the vertical axis of the image
+        width: int
+            number of pixels along the horizontal axis of the image
+        tile_size: int
+            number of pixels along each axis of a tile
+        dimensions: Tuple[int]
+            number of tiles along the vertical and horizontal axis of the
+            zoom level
+
+        Returns
+        -------
+        List[Tuple[int]]
+            row, column coordinates of tiles
+        '''
+        rows = range(
+            -(-y_offset // tile_size),
+            min((y_offset + height) // tile_size, dimensions[0])
+        )
+        columns = range(
+            -(-x_offset // tile_size),
+            min((x_offset + width) // tile_size, dimensions[1])
+        )
+        return list(itertools.product(rows, columns))
+
+    @staticmethod
+    def _add_raster_tile(store, z, y, x, array):
+        # Tiles that only consist of background pixels are not stored.
+        if not array.any():
+            return
+        pixels = PyramidTile(np.ascontiguousarray(array)).encode('png')
+        store.add(TileRecord(z=z, y=y, x=x, pixels=pixels.tostring()))
+
+    @classmethod
+    def _add_site_raster_tiles(cls, store, layer, outlines, y_offset,
+            x_offset):
+        '''Adds the raster tiles of the base level that lie completely within
+        a site (see :meth:`_get_contained_raster_tile_coordinates
+        <tmlib.workflow.jterator.api.ImageAnalysisPipelineEngine._get_contained_raster_tile_coordinates>`).
+        Other tiles of the site are composed in the collect phase (see
+        :meth:`_create_raster_tiles
+        <tmlib.workflow.jterator.api.ImageAnalysisPipelineEngine._create_raster_tiles>`).
+
+        Parameters
+        ----------
+        store: tmlib.models.tilestore.PackFileTileStore
+            store for raster tiles of the site
+        layer: tmlib.models.mapobject.SegmentationLayer
+            segmentation layer
+        outlines: numpy.ndarray[numpy.uint8]
+            outline image of the site
+        y_offset: int
+            *y* coordinate of the top, left corner of the aligned site
+        x_offset: int
+            *x* coordinate of the top, left corner of the aligned site
+        '''
+        tile_size = layer.tile_size
+        dimensions = layer.dimensions
+        maxzoom = len(dimensions) - 1
+        height, width = outlines.shape
+        coordinates = cls._get_contained_raster_tile_coordinates(
+            y_offset, x_offset, height, width, tile_size,
+            dimensions[maxzoom]
+        )
+        logger.debug('add %d raster tiles of site', len(coordinates))
+        for row, column in coordinates:
+            y = row * tile_size - y_offset
+            x = column * tile_size - x_offset
+            array = outlines[y:y + tile_size, x:x + tile_size]
+            if array.any():
+                cls._add_raster_tile(store, maxzoom, row, column, array)
+            elif not store.assume_clean_state:
+                # The tile may have been stored by a previous run.
+                store.delete(maxzoom, row, column)
+
+    @staticmethod
+    def _downsample_raster_band(band, tile_size, zoom_factor):
+        '''Downsamples a band of raster tiles to the next lower zoom level by
+        max pooling, such that outlines remain visible when zoomed out.
+
+        Parameters
+        ----------
+        band: numpy.ndarray[numpy.uint8]
+            pixels of `zoom_factor` rows of tiles
+        tile_size: int
+            number of pixels along each axis of a tile
+        zoom_factor: int
+            factor by which resolution increases per zoom level
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            pixels of a single row of tiles
+        '''
+        width = band.shape[1] // zoom_factor
+        return band.reshape(
+            tile_size, zoom_factor, width, zoom_factor
+        ).max(axis=3).max(axis=1)
+
+    def _create_raster_tiles(self, session, layer, layout):
+        '''Completes the pyramid of raster tiles of a segmentation layer (see
+        :meth:`get_raster_tiles
+        <tmlib.models.mapobject.SegmentationLayer.get_raster_tiles>`).
+        Run jobs already stored the tiles of the base level that lie within
+        a single site (see :meth:`_add_site_raster_tiles
+        <tmlib.workflow.jterator.api.ImageAnalysisPipelineEngine._add_site_raster_tiles>`).
+        The remaining tiles of the base level are composed of the outline
+        images of the sites they intersect with, which get placed at the
+        aligned offset of their site. Tiles of lower levels are created from
+        the tiles of the next higher level by max pooling (see
+        :meth:`_downsample_raster_band
+        <tmlib.workflow.jterator.api.ImageAnalysisPipelineEngine._downsample_raster_band>`).
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        layer: tmlib.models.mapobject.SegmentationLayer
+            segmentation layer
+        layout: tmlib.models.layout.ExperimentLayout
+            layout of the experiment
+        '''
+        tile_size = layer.tile_size
+        zoom_factor = layer.zoom_factor
+        dimensions = layer.dimensions
+        maxzoom = len(dimensions) - 1
+
+        sites = list()
+        for i, site_id in enumerate(layout.site_ids.tolist()):
+            filename = layer.get_outlines_filename(site_id)
+            if os.path.exists(filename):
+                y_offset, x_offset = layout.aligned_site_offsets[i].tolist()
+                height, width = layout.aligned_site_image_sizes[i].tolist()
+                sites.append((y_offset, x_offset, height, width, filename))
+        # Sites are processed in row-major order of their position, such that
+        # tiles are completed early and only few of them are held in memory.
+        sites.sort()
+        site_coordinates = list()
+        n_sites = collections.Counter()
+        for y_offset, x_offset, height, width, filename in sites:
+            args = (
+                y_offset, x_offset, height, width, tile_size,
+                dimensions[maxzoom]
+            )
+            coordinates = set(self._get_raster_tile_coordinates(*args))
+            coordinates.difference_update(
+                self._get_contained_raster_tile_coordinates(*args)
+            )
+            site_coordinates.append(sorted(coordinates))
+            n_sites.update(coordinates)
+
+        logger.info(
+            'create raster tiles of level %d that overlap several sites',
+            maxzoom
+        )
+        tiles = dict()
+        with PackFileTileStore(session, layer, name='collect') as store:
+            for (y_offset, x_offset, height, width, filename), coordinates in \
+                    zip(sites, site_coordinates):
+                if not coordinates:
+                    continue
+                with ImageReader(filename) as f:
+                    outlines = f.read()
+                for row, column in coordinates:
+                    if (row, column) not in tiles:
+                        tiles[(row, column)] = np.zeros(
+                            (tile_size, tile_size), dtype=np.uint8
+                        )
+                    tile_y = row * tile_size
+                    tile_x = column * tile_size
+                    y_start = max(y_offset, tile_y)
+                    y_end = min(y_offset + height, tile_y + tile_size)
+                    x_start = max(x_offset, tile_x)
+                    x_end = min(x_offset + width, tile_x + tile_size)
+                    region = tiles[(row, column)][
+                        y_start - tile_y:y_end - tile_y,
+                        x_start - tile_x:x_end - tile_x
+                    ]
+                    np.maximum(
+                        region,
+                        outlines[
+                            y_start - y_offset:y_end - y_offset,
+                            x_start - x_offset:x_end - x_offset
+                        ],
+                        out=region
+                    )
+                    n_sites[(row, column)] -= 1
+                    if n_sites[(row, column)] == 0:
+                        self._add_raster_tile(
+                            store, maxzoom, row, column,
+                            tiles.pop((row, column))
+                        )
+
+        for level in reversed(range(maxzoom)):
+            logger.info('create raster tiles of level %d', level)
+            n_rows, n_cols = dimensions[level]
+            n_child_rows, n_child_cols = dimensions[level + 1]
+            reader = PackFileTileStore(session, layer)
+            with PackFileTileStore(session, layer, name='collect') as store:
+                for row in xrange(n_rows):
+                    child_rows = range(
+                        row * zoom_factor,
+                        min((row + 1) * zoom_factor, n_child_rows)
+                    )
+                    children = reader.get_tiles(
+                        level + 1,
+                        list(itertools.product(
+                            child_rows, range(n_child_cols)
+                        ))
+                    )
+                    if not children:
+                        continue
+                    band = np.zeros(
+                        (zoom_factor * tile_size,
+                         n_cols * zoom_factor * tile_size),
+                        dtype=np.uint8
+                    )
+                    for (r, c), pixels in children.iteritems():
+                        y = (r - row * zoom_factor) * tile_size
+                        x = c * tile_size
+                        band[y:y + tile_size, x:x + tile_size] = \
+                            PyramidTile.create_from_buffer(pixels).array
+                    band = self._downsample_raster_band(
+                        band, tile_size, zoom_factor
+                    )
+                    for column in xrange(n_cols):
+                        x = column * tile_size
+                        self._add_raster_tile(
+                            store, level, row, column,
+                            band[:, x:x + tile_size]
+                        )
+            reader.close()
+
     @staticmethod
     def _add_feature(conn, name, mapobject_type_id, is_aggregate):
         conn.execute('''
@@ -33,6 +33,13 @@ class JteratorBatchArguments(BatchArguments):
         default=100, flag='batch-size', short_flag='b'
     )
 
+    pipelined = Argument(
+        type=bool, default=False,
+        help='''whether loading of inputs, running of the pipeline and saving
+            of outputs should overlap between consecutive sites of a job
+        '''
+    )
+
 
 @register_step_submission_args('jterator')
 class JteratorSubmissionArguments(SubmissionArguments):
@@ -387,16 +387,21 @@ class PipelineObjectInputDescription(object):
     should be made available to the pipeline.
     '''
 
-    __slots__ = ('name', )
+    __slots__ = ('_name', '_cache')
 
-    def __init__(self, name):
+    def __init__(self, name, cache=False):
         '''
         Parameters
         ----------
         name: str
             name of the object type
+        cache: bool, optional
+            whether label images that are reconstructed from the stored
+            segmentations should be cached on disk for subsequent runs
+            (default: ``False``)
         '''
         self.name = name
+        self.cache = cache
 
     @property
     def name(self):
@@ -407,16 +412,27 @@ class PipelineObjectInputDescription(object):
     def name(self, value):
         if not isinstance(value, basestring):
             raise TypeError('Attribute "name" must have type basestring.')
-        self._name = str(name)
+        self._name = str(value)
+
+    @property
+    def cache(self):
+        '''bool: whether reconstructed label images should be cached'''
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        if not isinstance(value, bool):
+            raise TypeError('Attribute "cache" must have type bool.')
+        self._cache = value
 
     def to_dict(self):
-        '''Returns attribute "name" as key-value pair.
+        '''Returns attributes "name" and "cache" as key-value pairs.
 
         Returns
         -------
         dict
         '''
-        return {'name': self.name}
+        return {'name': self.name, 'cache': self.cache}
 
 
 class PipelineObjectOutputDescription(object):
@@ -427,9 +443,9 @@ class PipelineObjectOutputDescription(object):
     :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`.
     '''
 
-    __slots__ = ('_name', '_as_polygons')
+    __slots__ = ('_name', '_as_polygons', '_as_raster')
 
-    def __init__(self, name, as_polygons=True):
+    def __init__(self, name, as_polygons=True, as_raster=False):
         '''
         Parameters
         ----------
@@ -439,9 +455,13 @@ class PipelineObjectOutputDescription(object):
             whether objects should be represented as polygons
             (if ``False`` only centroid coordinates will be stored;
             default: ``True``)
+        as_raster: bool, optional
+            whether outlines of objects should additionally be rendered into
+            a pyramid of raster tiles (default: ``False``)
         '''
         self.name = name
         self.as_polygons = as_polygons
+        self.as_raster = as_raster
 
     @property
     def name(self):
@@ -465,14 +485,31 @@ class PipelineObjectOutputDescription(object):
             raise TypeError('Attribute "as_polygons" must have type bool.')
         self._as_polygons = value
 
+    @property
+    def as_raster(self):
+        '''bool: whether outlines of objects should be represented as raster
+        tiles
+        '''
+        return self._as_raster
+
+    @as_raster.setter
+    def as_raster(self, value):
+        if not isinstance(value, bool):
+            raise TypeError('Attribute "as_raster" must have type bool.')
+        self._as_raster = value
+
     def to_dict(self):
-        '''Returns attributes "name" and "as_polygons" as key-value pairs.
+        '''Returns attributes "name", "as_polygons" and "as_raster" as
+        key-value pairs.
 
         Returns
         -------
         dict
         '''
-        return {'name': self.name, 'as_polygons': self.as_polygons}
+        return {
+            'name': self.name, 'as_polygons': self.as_polygons,
+            'as_raster': self.as_raster
+        }
 
 
 class PipelineModuleDescription(object):
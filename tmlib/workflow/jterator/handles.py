@@ -28,12 +28,12 @@ import sys
 import json
 import numpy as np
 import pandas as pd
-import mahotas as mh
 import cv2
 import skimage
 import logging
 import collections
 import skimage.draw
+import scipy.ndimage as ndi
 import shapely.geometry
 from geoalchemy2.shape import to_shape
 from abc import ABCMeta
@@ -396,6 +396,62 @@ class BinaryImage(MaskImage):
         return '<BinaryImage(name=%r, key=%r)>' % (self.name, self.key)
 
 
+class _LabelIndex(object):
+
+    '''Index of the objects in a 2D label image, which is computed in a
+    single pass over the pixels.
+
+    Objects are sorted by label and all attributes are arrays of the same
+    length, such that the values of an object can be looked up by its
+    position in :attr:`labels`.
+    '''
+
+    __slots__ = ('labels', 'areas', 'centroids', 'bboxes', 'is_border')
+
+    def __init__(self, plane):
+        '''
+        Parameters
+        ----------
+        plane: numpy.ndarray[numpy.int32]
+            labeled pixels plane, where background is zero
+        '''
+        mask = plane > 0
+        ys, xs = np.nonzero(mask)
+        values = plane[mask]
+        counts = np.bincount(values, minlength=1)
+        labels = np.nonzero(counts)[0]
+        labels = labels[labels > 0]
+        #: numpy.ndarray[numpy.int64]: sorted unique object labels
+        self.labels = labels
+        #: numpy.ndarray[numpy.int64]: number of pixels of each object
+        self.areas = counts[labels]
+        #: numpy.ndarray[numpy.float64]: *y*, *x* coordinates of the center
+        #: of mass of each object
+        self.centroids = np.column_stack([
+            np.bincount(values, weights=ys, minlength=counts.size)[labels],
+            np.bincount(values, weights=xs, minlength=counts.size)[labels]
+        ]) / self.areas[:, np.newaxis].astype(float)
+        # Slices are ordered by label and are None for missing labels.
+        slices = ndi.find_objects(plane)
+        #: numpy.ndarray[numpy.int64]: minimal *y*, maximal *y*, minimal *x*
+        #: and maximal *x* coordinate of each object (maxima are exclusive)
+        self.bboxes = np.array(
+            [
+                (s[0].start, s[0].stop, s[1].start, s[1].stop)
+                for s in (slices[l - 1] for l in labels.tolist())
+            ],
+            dtype=np.int64
+        ).reshape(-1, 4)
+        #: numpy.ndarray[numpy.bool]: whether an object touches the border
+        #: of the plane
+        self.is_border = (
+            (self.bboxes[:, 0] == 0) |
+            (self.bboxes[:, 1] == plane.shape[0]) |
+            (self.bboxes[:, 2] == 0) |
+            (self.bboxes[:, 3] == plane.shape[1])
+        )
+
+
 class SegmentedObjects(LabelImage):
 
     '''Class for a segmented objects handle, which represents a special type of
@@ -415,13 +471,53 @@ class SegmentedObjects(LabelImage):
         '''
         super(SegmentedObjects, self).__init__(name, key, help)
         self._features = collections.defaultdict(list)
+        self._label_index = None
+        self._labels = None
         self.save = False
         self.represent_as_polygons = True
+        self.represent_as_raster = False
+
+    @property
+    def value(self):
+        '''numpy.ndarray[numpy.int32]: pixels/voxels array'''
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        LabelImage.value.fset(self, value)
+        # The index is only reset here, pixels must not be modified in place.
+        self._label_index = None
+        self._labels = None
+
+    def _get_label_index(self):
+        '''Gets the label index of each plane, which is computed once and
+        reused until :attr:`value` is set again.
+
+        Returns
+        -------
+        Dict[Tuple[int], tmlib.workflow.jterator.handles._LabelIndex]
+            index of objects for each time point and z-plane
+        '''
+        if self._label_index is None:
+            logger.debug('index labels for objects of type "%s"', self.key)
+            self._label_index = {
+                (t, z): _LabelIndex(plane)
+                for (t, z), plane in self.iter_planes()
+            }
+        return self._label_index
 
     @property
     def labels(self):
         '''List[int]: unique object identifier labels'''
-        return np.unique(self.value[self.value > 0]).astype(int).tolist()
+        if self._labels is None:
+            index = self._get_label_index()
+            labels = [i.labels for i in index.itervalues()]
+            if len(labels) == 1:
+                labels = labels[0]
+            else:
+                labels = np.unique(np.concatenate(labels))
+            self._labels = labels.astype(int).tolist()
+        return list(self._labels)
 
     def iter_points(self, y_offset, x_offset):
         '''Iterates over point representations of segmented objects.
@@ -442,19 +538,18 @@ class SegmentedObjects(LabelImage):
             time point, z-plane, label and point geometry
         '''
         logger.debug('calculate centroids for objects of type "%s"', self.key)
-        points = dict()
-        for (t, z), plane in self.iter_planes():
-            centroids = mh.center_of_mass(plane, labels=plane)
+        index = self._get_label_index()
+        for t, z in sorted(index.keys()):
+            centroids = index[(t, z)].centroids.copy()
             centroids[:, 1] += x_offset
             centroids[:, 0] += y_offset
             centroids[:, 0] *= -1
-            for label in self.labels:
-                y = int(centroids[label, 0])
-                x = int(centroids[label, 1])
-                point = shapely.geometry.Point(x, y)
+            labels = index[(t, z)].labels.tolist()
+            for label, (y, x) in zip(labels, centroids.tolist()):
+                point = shapely.geometry.Point(int(x), int(y))
                 yield (t, z, label, point)
 
-    def iter_polygons(self, y_offset, x_offset):
+    def iter_polygons(self, y_offset, x_offset, n_processes=1):
         '''Iterates over polygon representations of segmented objects.
         The coordinates of the polygon contours are relative to the global map,
         i.e. an offset is added to the image site specific coordinates.
@@ -466,16 +561,24 @@ class SegmentedObjects(LabelImage):
             *y*-coordinates (*y*-axis is inverted)
         x_offset: int
             global horizontal offset that needs to be added to *x*-coordinates
+        n_processes: int, optional
+            number of processes that should be used to trace contours
+            (default: ``1``)
 
         Returns
         -------
         Generator[Tuple[Union[int, shapely.geometry.polygon.Polygon]]]
             time point, z-plane, label and polygon
+
+        See also
+        --------
+        :meth:`tmlib.image.SegmentationImage.extract_polygons`
         '''
         logger.debug('calculate polygons for objects type "%s"', self.key)
         for (t, z), plane in self.iter_planes():
             img = SegmentationImage(plane)
-            for label, geometry in img.extract_polygons(y_offset, x_offset):
+            polygons = img.extract_polygons(y_offset, x_offset, n_processes)
+            for label, geometry in polygons:
                 yield (t, z, label, geometry)
 
     def add_polygons(self, polygons, y_offset, x_offset, dimensions):
@@ -520,9 +623,10 @@ class SegmentedObjects(LabelImage):
         at the border of the image and ``False`` otherwise
         '''
         mapping = dict()
-        for (t, z), plane in self.iter_planes():
-            for label, is_border in self._find_border_objects(plane).iteritems():
-                mapping[(t, z, label)] = bool(is_border)
+        for (t, z), index in self._get_label_index().iteritems():
+            labels = index.labels.tolist()
+            for label, is_border in zip(labels, index.is_border.tolist()):
+                mapping[(t, z, label)] = is_border
         return mapping
 
     @staticmethod
@@ -540,15 +644,8 @@ class SegmentedObjects(LabelImage):
             ``True`` if an object lies at the border of the `img` and
             ``False`` otherwise
         '''
-        edges = [np.unique(img[0, :]),   # first row
-                 np.unique(img[-1, :]),  # last row
-                 np.unique(img[:, 0]),   # first col
-                 np.unique(img[:, -1])]  # last col
-
-        # Count only unique ids and remove 0 since it signals 'empty space'
-        border_ids = list(reduce(set.union, map(set, edges)).difference({0}))
-        object_ids = np.unique(img[img != 0])
-        return {o: True if o in border_ids else False for o in object_ids}
+        index = _LabelIndex(img)
+        return dict(zip(index.labels.tolist(), index.is_border.tolist()))
 
     @property
     def save(self):
@@ -574,6 +671,36 @@ class SegmentedObjects(LabelImage):
             )
         self._represent_as_polygons = value
 
+    @property
+    def represent_as_raster(self):
+        '''bool: whether outlines of objects should be represented as raster
+        tiles
+        '''
+        return self._represent_as_raster
+
+    @represent_as_raster.setter
+    def represent_as_raster(self, value):
+        if not isinstance(value, bool):
+            raise TypeError(
+                'Attribute "represent_as_raster" must have type bool.'
+            )
+        self._represent_as_raster = value
+
+    def iter_outlines(self):
+        '''Iterates over outline representations of segmented objects.
+
+        Returns
+        -------
+        Generator[Tuple[Union[int, numpy.ndarray[numpy.uint8]]]]
+            time point, z-plane and outlines of objects
+            (see :meth:`extract_outlines
+            <tmlib.image.SegmentationImage.extract_outlines>`)
+        '''
+        logger.debug('calculate outlines for objects type "%s"', self.key)
+        for (t, z), plane in self.iter_planes():
+            img = SegmentationImage(plane)
+            yield (t, z, img.extract_outlines())
+
     @property
     def measurements(self):
         '''List[pandas.DataFrame]: features extracted for
@@ -615,20 +742,20 @@ class SegmentedObjects(LabelImage):
                 'Argument "measurement" must have type '
                 'tmlib.workflow.jterator.handles.Measurement.'
             )
+        labels = np.array(self.labels)
         for t, val in enumerate(measurement.value):
-            if len(val.index) < len(self.labels):
+            if len(val.index) < len(labels):
                 logger.warn(
                     'missing values for object type "%s" at time point %d',
                     self.key, t
                 )
-                for label in self.labels:
-                    if label not in val.index:
-                        logger.warn(
-                            'add NaN values for missing object #%d', label
-                        )
-                        val.loc[label, :] = np.NaN
+                for label in np.setdiff1d(labels, val.index.values).tolist():
+                    logger.warn(
+                        'add NaN values for missing object #%d', label
+                    )
+                    val.loc[label, :] = np.NaN
                 val.sort_index(inplace=True)
-            elif len(val.index) > len(self.labels):
+            elif len(val.index) > len(labels):
                 if len(np.unique(val.index)) < len(val.index):
                     logger.warn(
                         'duplicate values for "%s" at time point %d',
@@ -641,11 +768,10 @@ class SegmentedObjects(LabelImage):
                         'too many values for object type "%s" at time point %d',
                         self.key, t
                     )
-                    for i in val.index:
-                        if i not in self.labels:
-                            logger.warn('remove values for object #%d', i)
-                            val.drop(i, inplace=True)
-            if np.any(val.index.values != np.array(self.labels)):
+                    for i in np.setdiff1d(val.index.values, labels).tolist():
+                        logger.warn('remove values for object #%d', i)
+                        val.drop(i, inplace=True)
+            if np.any(val.index.values != labels):
                 raise ValueError(
                     'Labels of objects for "%s" at time point %d do not match!'
                     % (measurement.name, t)
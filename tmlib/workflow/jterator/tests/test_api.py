@@ -0,0 +1,181 @@
+import threading
+
+import numpy as np
+import pytest
+
+from tmlib.image import PyramidTile
+from tmlib.workflow.jterator.api import ImageAnalysisPipelineEngine
+
+
+class _Layer(object):
+
+    def __init__(self):
+        self.tile_size = 2
+        self.dimensions = [(2, 2), (4, 4)]
+
+
+class _Store(object):
+
+    def __init__(self, assume_clean_state=False):
+        self.assume_clean_state = assume_clean_state
+        self.tiles = list()
+        self.deleted = list()
+
+    def add(self, tile):
+        self.tiles.append(tile)
+
+    def delete(self, z, y, x):
+        self.deleted.append((z, y, x))
+
+
+def _get_coordinates(y_offset, x_offset, height, width):
+    return ImageAnalysisPipelineEngine._get_raster_tile_coordinates(
+        y_offset, x_offset, height, width, 128, (4, 4)
+    )
+
+
+def _get_contained_coordinates(y_offset, x_offset, height, width):
+    engine = ImageAnalysisPipelineEngine
+    return engine._get_contained_raster_tile_coordinates(
+        y_offset, x_offset, height, width, 128, (4, 4)
+    )
+
+
+def test_get_raster_tile_coordinates():
+    coordinates = _get_coordinates(100, 0, 200, 300)
+    assert coordinates == [(y, x) for y in range(3) for x in range(3)]
+
+
+def test_get_raster_tile_coordinates_tile_boundaries():
+    assert _get_coordinates(128, 256, 128, 128) == [(1, 2)]
+
+
+def test_get_raster_tile_coordinates_clipped_to_level():
+    coordinates = _get_coordinates(300, 300, 300, 300)
+    assert coordinates == [(2, 2), (2, 3), (3, 2), (3, 3)]
+
+
+def test_get_contained_raster_tile_coordinates():
+    coordinates = _get_contained_coordinates(100, 0, 300, 300)
+    assert coordinates == [(1, 0), (1, 1), (2, 0), (2, 1)]
+
+
+def test_get_contained_raster_tile_coordinates_tile_boundaries():
+    assert _get_contained_coordinates(128, 256, 128, 128) == [(1, 2)]
+
+
+def test_get_contained_raster_tile_coordinates_small_image():
+    assert _get_contained_coordinates(10, 10, 100, 100) == []
+
+
+def test_get_contained_raster_tile_coordinates_clipped_to_level():
+    coordinates = _get_contained_coordinates(256, 256, 300, 300)
+    assert coordinates == [(2, 2), (2, 3), (3, 2), (3, 3)]
+
+
+def test_contained_raster_tiles_intersect_image():
+    for args in [(100, 0, 300, 300), (5, 130, 400, 260), (0, 0, 512, 512)]:
+        contained = _get_contained_coordinates(*args)
+        assert set(contained).issubset(_get_coordinates(*args))
+
+
+def test_add_raster_tile_skips_empty_tile():
+    store = _Store()
+    ImageAnalysisPipelineEngine._add_raster_tile(
+        store, 1, 0, 0, np.zeros((2, 2), dtype=np.uint8)
+    )
+    assert store.tiles == []
+
+
+def _add_site_raster_tiles(store, outlines):
+    ImageAnalysisPipelineEngine._add_site_raster_tiles(
+        store, _Layer(), outlines, 1, 1
+    )
+
+
+def test_add_site_raster_tiles():
+    outlines = np.zeros((6, 6), dtype=np.uint8)
+    outlines[1, 2] = 255
+    store = _Store()
+    _add_site_raster_tiles(store, outlines)
+    assert [(t.z, t.y, t.x) for t in store.tiles] == [(1, 1, 1)]
+    tile = PyramidTile.create_from_binary(store.tiles[0].pixels)
+    np.testing.assert_array_equal(tile.array, [[0, 255], [0, 0]])
+    assert store.deleted == [(1, 1, 2), (1, 2, 1), (1, 2, 2)]
+
+
+def test_add_site_raster_tiles_clean_state():
+    store = _Store(assume_clean_state=True)
+    _add_site_raster_tiles(store, np.zeros((6, 6), dtype=np.uint8))
+    assert store.tiles == []
+    assert store.deleted == []
+
+
+def test_downsample_raster_band():
+    band = np.arange(32, dtype=np.uint8).reshape(4, 8)
+    downsampled = ImageAnalysisPipelineEngine._downsample_raster_band(
+        band, 2, 2
+    )
+    # Each pixel is the maximum of a 2x2 block, i.e. its bottom, right pixel
+    np.testing.assert_array_equal(
+        downsampled, [[9, 11, 13, 15], [25, 27, 29, 31]]
+    )
+
+
+def test_downsample_raster_band_keeps_single_pixels():
+    band = np.zeros((4, 8), dtype=np.uint8)
+    band[3, 5] = 255
+    downsampled = ImageAnalysisPipelineEngine._downsample_raster_band(
+        band, 2, 2
+    )
+    expected = np.zeros((2, 4), dtype=np.uint8)
+    expected[1, 2] = 255
+    np.testing.assert_array_equal(downsampled, expected)
+
+
+# Stages only record the processed sites and fail for a given site.
+class _Engine(ImageAnalysisPipelineEngine):
+
+    def __init__(self, failing_stage=None, failing_site_id=None):
+        self.failing_stage = failing_stage
+        self.failing_site_id = failing_site_id
+        self.saved = list()
+
+    def _fail(self, stage, site_id):
+        if stage == self.failing_stage and site_id == self.failing_site_id:
+            raise ValueError('%s failed for site %d' % (stage, site_id))
+
+    def _load_pipeline_input(self, site_id):
+        self._fail('load', site_id)
+        return {'site_id': site_id}
+
+    def _run_pipeline(self, store, site_id, plot=False):
+        self._fail('run', site_id)
+        return store
+
+    def _save_pipeline_outputs(self, store, assume_clean_state):
+        self._fail('save', store['site_id'])
+        self.saved.append(store['site_id'])
+
+
+def _get_pipeline_threads():
+    return [
+        t for t in threading.enumerate() if t.name.startswith('jterator-')
+    ]
+
+
+def test_run_pipelined():
+    engine = _Engine()
+    engine._run_pipelined([1, 2, 3, 4], False)
+    assert engine.saved == [1, 2, 3, 4]
+    assert _get_pipeline_threads() == []
+
+
+@pytest.mark.parametrize('stage', ['load', 'run', 'save'])
+def test_run_pipelined_raises_failure_of_stage(stage):
+    engine = _Engine(stage, 2)
+    with pytest.raises(ValueError) as error:
+        engine._run_pipelined([1, 2, 3, 4], False)
+    assert str(error.value) == '%s failed for site 2' % stage
+    assert 2 not in engine.saved
+    assert _get_pipeline_threads() == []
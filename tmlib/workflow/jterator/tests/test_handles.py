@@ -0,0 +1,57 @@
+import numpy as np
+import mahotas as mh
+
+from tmlib.workflow.jterator.handles import _LabelIndex
+
+
+# Labels 3, 5 and 6 are missing; objects 1, 4 and 7 touch the border of the
+# plane, object 2 doesn't.
+PLANE = np.array([
+    [1, 1, 0, 0, 0, 0, 0],
+    [1, 0, 0, 2, 2, 0, 4],
+    [0, 0, 2, 2, 2, 0, 4],
+    [0, 0, 0, 2, 0, 0, 4],
+    [0, 0, 0, 0, 0, 7, 0],
+    [0, 0, 0, 0, 7, 7, 7],
+], dtype=np.int32)
+
+
+def _find_border_objects(img):
+    edges = [
+        np.unique(img[0, :]), np.unique(img[-1, :]),
+        np.unique(img[:, 0]), np.unique(img[:, -1])
+    ]
+    border_ids = reduce(set.union, map(set, edges)).difference({0})
+    object_ids = np.unique(img[img != 0])
+    return {o: o in border_ids for o in object_ids}
+
+
+def test_label_index_labels():
+    index = _LabelIndex(PLANE)
+    expected = np.unique(PLANE[PLANE > 0])
+    np.testing.assert_array_equal(index.labels, expected)
+
+
+def test_label_index_areas():
+    index = _LabelIndex(PLANE)
+    expected = [np.sum(PLANE == label) for label in index.labels]
+    np.testing.assert_array_equal(index.areas, expected)
+
+
+def test_label_index_centroids():
+    index = _LabelIndex(PLANE)
+    expected = mh.center_of_mass(PLANE, labels=PLANE)[index.labels]
+    np.testing.assert_allclose(index.centroids, expected)
+
+
+def test_label_index_is_border():
+    index = _LabelIndex(PLANE)
+    expected = _find_border_objects(PLANE)
+    assert dict(zip(index.labels, index.is_border)) == expected
+
+
+def test_label_index_empty_plane():
+    index = _LabelIndex(np.zeros((3, 3), dtype=np.int32))
+    assert len(index.labels) == 0
+    assert index.centroids.shape == (0, 2)
+    assert index.bboxes.shape == (0, 4)